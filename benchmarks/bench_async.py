@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+# Time reading documents from a local fake CouchDB server one after the
+# other with get (as before), and with aget, all requested at once and
+# made by the threads of the executor of a CouchdbPool; then time reading
+# all the rows of a view a page at a time while each row takes some work
+#
+# usage: python bench_async.py [DOCUMENTS] [MAX_CONNECTIONS] [ROW_WORK_MS]
+
+import time
+
+from common import Record, arguments, fake_couch, save_records, timed
+from isis.utils.pool import CouchdbPool
+
+DEFAULT_DOCUMENTS = 500
+DEFAULT_MAX_CONNECTIONS = 10
+DEFAULT_ROW_WORK_MS = 0.2
+PAGE_SIZE = 100
+
+def get(ids):
+    return [Record.get('async', doc_id) for doc_id in ids]
+
+def aget(ids):
+    return [future.result() for future in [Record.aget('async', doc_id) for doc_id in ids]]
+
+def view_rows(view, page_size, **params):
+    db = Record.pool.database('async')
+    start = None
+    while True:
+        page_params = dict(params, limit=page_size + 1)
+        if start is not None:
+            page_params['startkey'], page_params['startkey_docid'] = start
+        rows = db.view(view, **page_params).all()
+        for row in rows[:page_size]:
+            yield row
+        if len(rows) <= page_size:
+            return
+        start = (rows[page_size]['key'], rows[page_size]['id'])
+
+def aiter_view(view, page_size, **params):
+    return Record.aiter_view('async', view, page_size, **params)
+
+def bench(label, function, count, unit):
+    elapsed = timed(function)[1]
+    print('%-10s %7.3fs %8.1f %s/s' % (label, elapsed, count / elapsed, unit))
+
+def main(count, max_connections, row_work_ms):
+    print('%d documents, pools of %d connections, %.1fms of work a row' % (
+        count, max_connections, row_work_ms))
+    with fake_couch('async') as server:
+        Record.pool = CouchdbPool(server.url, max_connections=max_connections)
+        save_records('async', count)
+        ids = ['record%d' % i for i in xrange(count)]
+        for read in (get, aget):
+            bench(read.__name__, lambda: read(ids), count, 'documents')
+        Record.sync_indexes('async')
+        for rows in (view_rows, aiter_view):
+            def use_rows():
+                for row in rows('Record/by_title', PAGE_SIZE, include_docs=True):
+                    time.sleep(row_work_ms / 1000.0)
+            bench(rows.__name__, use_rows, count, 'rows')
+
+if __name__ == '__main__':
+    main(*arguments(DEFAULT_DOCUMENTS, DEFAULT_MAX_CONNECTIONS, DEFAULT_ROW_WORK_MS))
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+# Peak memory of uploading and downloading a large attachment to a local
+# fake CouchDB server: with the upload kept in memory, put_attachment and
+# fetch_attachment (as before), and with the upload spooled to disk by
+# SpoolingTmpStore, the chunked upload of save and open_attachment; each
+# run is a new process, the server another one
+#
+# usage: python bench_attachments.py [MEGABYTES]
+
+import StringIO
+import multiprocessing
+import os
+import tempfile
+import time
+
+from common import arguments, fake_couch_process, max_rss
+import couchdbkit
+from isis.model import CouchdbDocument, TextProperty, FileProperty
+from isis.model.mapper import CHUNK_SIZE, MemoryTmpStore, SpoolingTmpStore
+
+DEFAULT_MEGABYTES = 32
+
+class Report(CouchdbDocument):
+    title = TextProperty(required=True)
+    pdf = FileProperty()
+
+def uploaded(tmpstore, fp):
+    fp.seek(0)
+    tmpstore['pdf'] = {'fp': fp, 'uid': 'pdf', 'filename': 'report.pdf'}
+    return tmpstore['pdf']
+
+def whole_upload(db, fp):
+    report = Report(title=u'Annual report')
+    doc = report.to_python()
+    db.save_doc(doc)
+    fp.seek(0)
+    upload = uploaded(MemoryTmpStore(), StringIO.StringIO(fp.read()))
+    db.put_attachment(doc, upload['fp'], 'report.pdf')
+    return doc['_id']
+
+def chunked_upload(db, fp):
+    report = Report(title=u'Annual report', pdf=uploaded(SpoolingTmpStore(), fp))
+    report.save(db)
+    return report._id
+
+def whole_download(db, doc_id):
+    return len(db.fetch_attachment(doc_id, 'report.pdf'))
+
+def chunked_download(db, doc_id):
+    size = 0
+    stream = Report.get(db, doc_id).open_attachment(db, 'pdf')
+    for data in iter(lambda: stream.read(CHUNK_SIZE), ''):
+        size += len(data)
+    return size
+
+def run(url, upload, download, fp, results):
+    db = couchdbkit.Database(url + '/attachments')
+    before = max_rss()
+    t0 = time.time()
+    doc_id = upload(db, fp)
+    uploaded = max_rss()
+    t1 = time.time()
+    size = download(db, doc_id)
+    downloaded = max_rss()
+    results.put((uploaded - before, t1 - t0, downloaded - before,
+                 time.time() - t1, size))
+
+def main(megabytes):
+    fp = tempfile.TemporaryFile()
+    for i in xrange(megabytes):
+        fp.write(os.urandom(1024 * 1024))
+    print('%d MB attachment, peak memory growth of the client' % megabytes)
+    with fake_couch_process('attachments') as url:
+        for upload, download in ((whole_upload, whole_download),
+                                 (chunked_upload, chunked_download)):
+            results = multiprocessing.Queue()
+            child = multiprocessing.Process(target=run, args=(
+                url, upload, download, fp, results))
+            child.start()
+            up_kb, up_time, down_kb, down_time, size = results.get(True, 600)
+            child.join()
+            assert size == megabytes * 1024 * 1024
+            print('%-15s %8.1f MB %6.2fs   %-17s %8.1f MB %6.2fs' % (
+                upload.__name__, up_kb / 1024.0, up_time,
+                download.__name__, down_kb / 1024.0, down_time))
+
+if __name__ == '__main__':
+    main(*arguments(DEFAULT_MEGABYTES))
@@ -0,0 +1,44 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+# Time reading the same few documents again and again from a local fake
+# CouchDB server, as the example views do: always from the database (as
+# before) and through an LRUCache, whose entries older than TTL seconds
+# are revalidated with a HEAD request
+#
+# usage: python bench_cache.py [READS] [DOCUMENTS] [TTL]
+
+from common import Record, arguments, fake_couch, timed
+import couchdbkit
+from isis.utils.cache import LRUCache
+
+DEFAULT_READS = 200
+DEFAULT_DOCUMENTS = 10
+DEFAULT_TTL = 0.1
+
+def bench(server, label, ids, reads):
+    db = couchdbkit.Database(server.url + '/cache')
+    del server.requests[:]
+    elapsed = timed(lambda: [Record.get(db, ids[i % len(ids)]) for i in xrange(reads)])[1]
+    methods = [method for method, path in server.requests]
+    print('%-8s %7.3fs %8.0f reads/s %5d GET %5d HEAD' % (
+        label, elapsed, reads / elapsed, methods.count('GET'),
+        methods.count('HEAD')))
+
+def main(reads, count, ttl):
+    print('%d reads of %d documents, cache ttl %.1fs' % (reads, count, ttl))
+    with fake_couch('cache') as server:
+        db = couchdbkit.Database(server.url + '/cache')
+        ids = []
+        for i in xrange(count):
+            record = Record(title=u'Record %d' % i, authors=(u'Rose, Daiana',),
+                            year=u'2010')
+            record.save(db)
+            ids.append(record._id)
+        bench(server, 'database', ids, reads)
+        Record.cache = LRUCache(ttl=ttl)
+        bench(server, 'cache', ids, reads)
+        print(', '.join('%s %d' % item for item in sorted(Record.cache.stats().items())))
+
+if __name__ == '__main__':
+    main(*arguments(DEFAULT_READS, DEFAULT_DOCUMENTS, DEFAULT_TTL))
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+# Time keeping an index of the titles of the documents of a local fake
+# CouchDB server up to date while some of them are updated: rebuilding it
+# from _all_docs with include_docs after each round of updates (as before),
+# and updating it from the changes read by a ChangesConsumer
+#
+# usage: python bench_changes.py [DOCUMENTS] [ROUNDS] [UPDATES]
+
+import time
+
+from common import BATCH_SIZE, Record, arguments, fake_couch, save_records
+import couchdbkit
+from isis.model.couchdb import ChangesConsumer
+
+DEFAULT_DOCUMENTS = 10000
+DEFAULT_ROUNDS = 20
+DEFAULT_UPDATES = 50 # documents updated in each round
+
+def rescan(db, titles, consumer):
+    titles.clear()
+    for row in db.view('_all_docs', include_docs=True).all():
+        if row['doc'].get('TYPE') == 'Record':
+            titles[row['id']] = row['doc']['title']
+
+def changes(db, titles, consumer):
+    while consumer.poll(wait=False) == BATCH_SIZE:
+        pass
+
+def bench(server, db, refresh, count, rounds, updates):
+    titles = {}
+    def update_titles(changes):
+        for change in changes:
+            if change.document is not None:
+                titles[change.id] = change.document.title
+    consumer = ChangesConsumer(db, [update_titles], classes=[Record], batch_size=BATCH_SIZE)
+    refresh(db, titles, consumer)
+    elapsed, requests = 0, 0
+    for i in xrange(rounds):
+        records = [Record.get(db, 'record%d' % ((i * updates + j) % count))
+                   for j in xrange(updates)]
+        for record in records:
+            record.title = u'%s, round %d' % (record.title.split(',')[0], i)
+        Record.save_many(db, records)
+        del server.requests[:]
+        t0 = time.time()
+        refresh(db, titles, consumer)
+        elapsed += time.time() - t0
+        requests += len(server.requests)
+    assert len(titles) == count and titles['record0'].endswith('round 0')
+    print('%-7s %7.3fs %8.1f refreshes/s %5d requests' % (
+        refresh.__name__, elapsed, rounds / elapsed, requests))
+
+def main(count, rounds, updates):
+    print('%d documents, %d rounds of %d updates' % (count, rounds, updates))
+    with fake_couch() as server:
+        for refresh in (rescan, changes):
+            server.databases['changes'] = {}
+            db = couchdbkit.Database(server.url + '/changes')
+            save_records(db, count, authors=(u'Rose, Daiana',))
+            bench(server, db, refresh, count, rounds, updates)
+
+if __name__ == '__main__':
+    main(*arguments(DEFAULT_DOCUMENTS, DEFAULT_ROUNDS, DEFAULT_UPDATES))
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+# Compare subfield lookups in CompositeString and CompositeField with the
+# previous linear scan and per lookup dict implementations
+#
+# usage: python bench_composite.py [FIELDS] [PASSES]
+
+from common import arguments, timed
+from isis.model.subfield import CompositeString, CompositeField
+
+DEFAULT_FIELDS = 20000
+DEFAULT_PASSES = 3 # formats read the same fields more than once
+LOOKUPS = 'acdeg' # subfields read from each field, as a display format would
+# a LILACS tag 10 (individual author) like field, and a tag 30 (journal) one
+RAW_FIELDS = [
+    u'Mendes, Eug\xeanio Vilaça^1Secretaria de Sa\xfade^2Belo Horizonte'
+    u'^pBrasil^cMinas Gerais^aBH^dSES^eautor^gcoordenador',
+    u'Rev. Pediatr.^v23^n4^c1980^aSao Paulo^dSPSP^e2009^gonline',
+]
+
+class LinearCompositeString(CompositeString):
+    ''' the previous lookup: a scan of the expanded subfields '''
+
+    def __getitem__(self, key):
+        for subfield in self.items():
+            if subfield[0] == key:
+                return subfield[1]
+        else:
+            raise KeyError(key)
+
+class DictCompositeField(CompositeField):
+    ''' the previous lookup: a new dict for every access '''
+
+    def __getitem__(self, key):
+        return dict(self.value)[key]
+
+def lookup_all(fields):
+    for field in fields:
+        for key in LOOKUPS:
+            field[key]
+
+def bench(label, fields, passes):
+    elapsed = timed(lambda: [lookup_all(fields) for i in xrange(passes)])[1]
+    count = len(fields) * len(LOOKUPS) * passes
+    print('%-22s %7.3fs %10.0f lookups/s' % (label, elapsed, count / elapsed))
+
+def main(count, passes):
+    raws = [RAW_FIELDS[i % len(RAW_FIELDS)].encode('utf-8')
+            for i in xrange(count)]
+    print('%d fields, %d lookups each, %d passes' % (
+        count, len(LOOKUPS), passes))
+    for cls in (LinearCompositeString, CompositeString):
+        bench(cls.__name__, [cls(raw) for raw in raws], passes)
+    subkeys = list('123acdegnpv_')
+    items = [CompositeString(raw).items() for raw in raws]
+    for cls in (DictCompositeField, CompositeField):
+        bench(cls.__name__, [cls(item, subkeys) for item in items], passes)
+
+if __name__ == '__main__':
+    main(*arguments(DEFAULT_FIELDS, DEFAULT_PASSES))
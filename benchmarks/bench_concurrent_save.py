@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+# Measure saves/second of new documents from many threads in a local fake
+# CouchDB server, with random ids and a 0.5s sleep on each conflict (as
+# before) and with the node prefixed counter ids; the random ids are
+# ID_LENGTH characters long, so they collide about as often as 5 character
+# ids in a database already holding millions of documents
+#
+# usage: python bench_concurrent_save.py [THREADS] [SAVES] [ID_LENGTH]
+
+import threading
+import time
+
+from common import Record, arguments, fake_couch
+import couchdbkit
+from isis.utils import base28
+
+DEFAULT_THREADS = 16
+DEFAULT_SAVES = 20 # per thread
+DEFAULT_ID_LENGTH = 2
+
+class SleepingRecord(Record):
+    ''' random ids, and the previous conflict handling of save '''
+    id_length = DEFAULT_ID_LENGTH
+    conflicts = 0
+
+    def __init__(self, **kwargs):
+        super(SleepingRecord, self).__init__(_id=self.random_id(), **kwargs)
+
+    @classmethod
+    def random_id(cls):
+        return base28.genbase(cls.id_length)
+
+    def save(self, db):
+        new_doc = self.to_python()
+        while True:
+            try:
+                db.save_doc(new_doc)
+                break
+            except couchdbkit.ResourceConflict:
+                SleepingRecord.conflicts += 1
+                time.sleep(0.5)
+                new_doc['_id'] = self.random_id()
+        self._id, self._rev = new_doc['_id'], new_doc['_rev']
+
+def worker(db, cls, saves):
+    for i in xrange(saves):
+        cls(title=u'Record %d' % i).save(db)
+
+def bench(server, cls, threads, saves):
+    server.databases[cls.__name__.lower()] = {}
+    db = couchdbkit.Database(server.url + '/' + cls.__name__.lower())
+    workers = [threading.Thread(target=worker, args=(db, cls, saves))
+               for i in xrange(threads)]
+    t0 = time.time()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.time() - t0
+    count = len(server.databases[cls.__name__.lower()])
+    print('%-14s %7.3fs %8.0f saves/s %6d documents' % (
+        cls.__name__, elapsed, count / elapsed, count))
+
+def main(threads, saves, id_length):
+    SleepingRecord.id_length = id_length
+    print('%d threads, %d saves each, random ids of %d characters' % (
+        threads, saves, id_length))
+    with fake_couch() as server:
+        bench(server, SleepingRecord, threads, saves)
+        print('%d conflicts' % SleepingRecord.conflicts)
+        bench(server, Record, threads, saves)
+
+if __name__ == '__main__':
+    main(*arguments(DEFAULT_THREADS, DEFAULT_SAVES, DEFAULT_ID_LENGTH))
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+# Time building (with validation) and serializing Document instances of a
+# LILACS-shaped model, iterating the per-class property table and with
+# the previous per-property descriptor lookups; then loading pystructs,
+# one at a time with from_python and streaming with from_python_many
+#
+# usage: python bench_document.py [DOCUMENTS]
+
+import time
+
+from common import arguments, lilacs_properties, timed
+from isis.model import Document
+
+DEFAULT_DOCUMENTS = 20000
+
+class LookupMethods(object):
+    ''' validate and to_python as they were before the property table,
+        with the whole validation repeated after the values are set '''
+    __slots__ = ()
+
+    def check_required(self):
+        self.validate()
+
+    def validate(self):
+        for prop in self:
+            descriptor = self.__class__.__getattribute__(self.__class__, prop)
+            if descriptor.required and getattr(self, prop, None) is None:
+                raise TypeError('required %r property missing' % prop)
+            descriptor.validate(self, getattr(self, prop, None))
+
+    def to_python(self):
+        properties = {}
+        for prop in self:
+            descriptor = self.__class__.__getattribute__(self.__class__, prop)
+            try:
+                properties[prop] = descriptor._pystruct(self, getattr(self, prop))
+            except AttributeError:
+                pass
+        if not 'TYPE' in properties:
+            properties['TYPE'] = self.TYPE
+        return properties
+
+TableRecord = type('TableRecord', (Document,), lilacs_properties())
+LookupRecord = type('LookupRecord', (LookupMethods, Document),
+                    lilacs_properties())
+
+# a typical record sets about half of the fields
+VALUES = {'v2': u'538886', 'v4': (u'LILACS', u'LLXPEDT'), 'v5': u'S',
+          'v6': u'as', 'v10': (u'Mendes, Eugenio^1SES^rautor',),
+          'v12': u'Titulo', 'v30': u'Rev. Pediatr.', 'v31': u'23',
+          'v35': u'0100-0000', 'v40': u'Pt', 'v64': u'2009',
+          'v65': u'20090000', 'v71': (u'artigo',), 'v87': (u'Pediatria',)}
+
+def bench(cls, count):
+    t0 = time.time()
+    for i in xrange(count):
+        cls(**VALUES).to_python()
+    elapsed = time.time() - t0
+    print('%-14s %7.3fs %9.0f documents/s' % (cls.__name__, elapsed,
+                                              count / elapsed))
+
+def from_python_loop(cls, pystructs):
+    for pystruct in pystructs:
+        try:
+            yield cls.from_python(dict(pystruct))
+        except Exception, error:
+            yield error
+
+def bench_load(label, load, count):
+    # lists, as decoded from JSON, and 1 invalid record in 100
+    pystruct = dict((key, list(value) if isinstance(value, tuple) else value)
+                    for key, value in VALUES.items())
+    invalid = dict(pystruct, v12=None)
+    pystructs = (invalid if i % 100 == 0 else pystruct for i in xrange(count))
+    elapsed = timed(lambda: sum(1 for document in load(TableRecord, pystructs)))[1]
+    print('%-16s %7.3fs %9.0f documents/s' % (label, elapsed, count / elapsed))
+
+def main(count):
+    print('%d documents, %d of %d properties set' % (
+        count, len(VALUES), len(TableRecord._property_table)))
+    for cls in (LookupRecord, TableRecord):
+        bench(cls, count)
+    bench_load('from_python', from_python_loop, count)
+    bench_load('from_python_many', lambda cls, pystructs:
+               cls.from_python_many(pystructs), count)
+
+if __name__ == '__main__':
+    main(*arguments(DEFAULT_DOCUMENTS))
@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+# Time looking documents up by title in a local fake CouchDB server:
+# scanning _all_docs with include_docs (as before) and with the index view
+# of a TextProperty(index=True), through find_by_title; each lookup asks
+# for KEYS titles
+#
+# usage: python bench_find.py [DOCUMENTS] [LOOKUPS] [KEYS]
+
+import random
+import time
+
+from common import Record, arguments, fake_couch, save_records
+import couchdbkit
+
+DEFAULT_DOCUMENTS = 5000
+DEFAULT_LOOKUPS = 20
+DEFAULT_KEYS = 10
+
+def scan(db, titles):
+    titles = set(titles)
+    return [Record.from_python(row['doc'])
+            for row in db.view('_all_docs', include_docs=True).all()
+            if row['doc'].get('TYPE') == 'Record' and row['doc']['title'] in titles]
+
+def find(db, titles):
+    return Record.find_by_title(db, titles)
+
+def bench(server, db, lookup, lookups, count, keys):
+    random.seed(0)
+    Record.sync_indexes(db)
+    lookup(db, [u'Record 0']) # the view is built on its first query
+    del server.requests[:]
+    t0 = time.time()
+    for i in xrange(lookups):
+        found = lookup(db, [u'Record %d' % random.randrange(count) for j in xrange(keys)])
+        assert found
+    elapsed = time.time() - t0
+    print('%-6s %7.3fs %8.1f lookups/s %5d requests' % (
+        lookup.__name__, elapsed, lookups / elapsed, len(server.requests)))
+
+def main(count, lookups, keys):
+    print('%d documents, %d lookups of %d titles' % (count, lookups, keys))
+    with fake_couch('find') as server:
+        db = couchdbkit.Database(server.url + '/find')
+        save_records(db, count, authors=(u'Rose, Daiana',))
+        bench(server, db, scan, lookups, count, keys)
+        bench(server, db, find, lookups, count, keys)
+
+if __name__ == '__main__':
+    main(*arguments(DEFAULT_DOCUMENTS, DEFAULT_LOOKUPS, DEFAULT_KEYS))
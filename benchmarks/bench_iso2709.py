@@ -0,0 +1,44 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+# Compare the IsoFile and MappedIsoFile readers on a scaled up copy
+# of the LILACS.iso fixture
+#
+# usage: python bench_iso2709.py [COPIES]
+
+import os
+import tempfile
+
+from common import HERE, arguments, timed
+from iso2709 import IsoFile, MappedIsoFile
+
+FIXTURE = os.path.join(HERE, '..', 'fixtures', 'lilacs1', 'LILACS.iso')
+DEFAULT_COPIES = 5000
+
+def scaled_fixture(copies):
+    data = open(FIXTURE, 'rb').read()
+    tmp = tempfile.NamedTemporaryFile(suffix='.iso')
+    for i in xrange(copies):
+        tmp.write(data)
+    tmp.flush()
+    return tmp
+
+def read(reader_class, file_name):
+    iso = reader_class(file_name)
+    count = sum(1 for record in iso)
+    iso.close()
+    return count
+
+def main(copies):
+    tmp = scaled_fixture(copies)
+    size = os.path.getsize(tmp.name) / 2.0**20
+    print('%d records, %.1f MB' % (copies, size))
+    for reader_class in (IsoFile, MappedIsoFile):
+        count, elapsed = timed(read, reader_class, tmp.name)
+        assert count == copies
+        print('%-14s %7.3fs %10.0f records/s %7.1f MB/s' % (
+            reader_class.__name__, elapsed, count / elapsed, size / elapsed))
+    tmp.close()
+
+if __name__ == '__main__':
+    main(*arguments(DEFAULT_COPIES))
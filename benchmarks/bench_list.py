@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+# Time and peak memory of listing the titles of all the documents of a
+# local fake CouchDB server: from _all_docs with include_docs, all at once
+# (as before), and with CouchdbDocument.list, a page at a time from a view
+# emitting only the titles; each run is a new process, the server another
+#
+# usage: python bench_list.py [DOCUMENTS] [PAGE_SIZE]
+
+import multiprocessing
+
+from common import Record, arguments, fake_couch_process, max_rss, save_records, timed
+import couchdbkit
+
+DEFAULT_DOCUMENTS = 20000
+DEFAULT_PAGE_SIZE = 1000
+
+def all_docs(db, page_size):
+    for row in db.view('_all_docs', include_docs=True).all():
+        if row['doc'].get('TYPE') == 'Record':
+            yield row['doc']['title']
+
+def paged_list(db, page_size):
+    for row in Record.list(db, ['title'], page_size=page_size):
+        yield row['title']
+
+def run(url, listing, page_size, results):
+    db = couchdbkit.Database(url + '/list')
+    before = max_rss()
+    count, elapsed = timed(lambda: sum(1 for title in listing(db, page_size)))
+    results.put((count, elapsed, max_rss() - before))
+
+def main(count, page_size):
+    print('%d documents, pages of %d rows, peak memory growth of the client' % (
+        count, page_size))
+    with fake_couch_process('list') as url:
+        db = couchdbkit.Database(url + '/list')
+        save_records(db, count, authors=(u'Rose, Daiana',),
+                     abstract=u'An abstract of some length. ' * 70)
+        Record.sync_list(db, ['title'])
+        for listing in (all_docs, paged_list):
+            results = multiprocessing.Queue()
+            child = multiprocessing.Process(target=run, args=(
+                url, listing, page_size, results))
+            child.start()
+            listed, elapsed, kb = results.get(True, 600)
+            child.join()
+            assert listed == count
+            print('%-10s %7.3fs %8.1f MB' % (listing.__name__, elapsed, kb / 1024.0))
+
+if __name__ == '__main__':
+    main(*arguments(DEFAULT_DOCUMENTS, DEFAULT_PAGE_SIZE))
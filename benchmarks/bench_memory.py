@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+# Compare the memory used by Document instances with property values in
+# per-instance dicts (the previous layout), in generated slots plus a
+# __dict__ created only for other attributes (the default layout), and in
+# the slots alone, when the class declares __slots__, for a model shaped
+# like a LILACS record
+#
+# usage: python bench_memory.py [DOCUMENTS]
+
+import os
+import sys
+
+from common import arguments, lilacs_properties, timed
+from isis.model import Document, MultiTextProperty, MultiIsisCompositeTextProperty
+
+DEFAULT_DOCUMENTS = 20000
+
+class DictLayoutModel(Document):
+    ''' instances with a __dict__ plus a _prop_values dict, as before
+        (the unused property slots add 8 bytes per property) '''
+    __slots__ = ('__dict__',)
+
+    def __init__(self, **kwargs):
+        self._prop_values = {}
+        super(DictLayoutModel, self).__init__(**kwargs)
+
+def dict_layout(cls):
+    ''' make the properties of cls store their values in _prop_values '''
+    for prop in cls._ordered_props:
+        prop.slot = DictSlot(prop.name)
+    return cls
+
+class DictSlot(object):
+
+    def __init__(self, name):
+        self.name = name
+
+    def __get__(self, instance, cls):
+        try:
+            return instance._prop_values[self.name]
+        except KeyError:
+            raise AttributeError(self.name)
+
+    def __set__(self, instance, value):
+        instance._prop_values[self.name] = value
+
+DefaultRecord = type('DefaultRecord', (Document,), lilacs_properties())
+SlotsRecord = type('SlotsRecord', (Document,), dict(lilacs_properties(), __slots__=()))
+DictRecord = dict_layout(type('DictRecord', (DictLayoutModel,),
+                              lilacs_properties()))
+
+def values():
+    kwargs = {}
+    for prop in SlotsRecord._ordered_props:
+        if isinstance(prop, (MultiTextProperty, MultiIsisCompositeTextProperty)):
+            kwargs[prop.name] = (u'value',)
+        else:
+            kwargs[prop.name] = u'value'
+    return kwargs
+
+def instance_size(document):
+    size = sys.getsizeof(document)
+    if getattr(document, '__dict__', None): # made by the first attribute set
+        size += sys.getsizeof(document.__dict__)
+    if hasattr(document, '_prop_values'):
+        size += sys.getsizeof(document._prop_values)
+    return size
+
+def rss():
+    ''' resident memory, in bytes (Linux only) '''
+    try:
+        pages = int(open('/proc/self/statm').read().split()[1])
+    except IOError:
+        return 0
+    return pages * os.sysconf('SC_PAGE_SIZE')
+
+def bench(cls, count, kwargs):
+    before = rss()
+    documents, elapsed = timed(lambda: [cls(**kwargs) for i in xrange(count)])
+    growth = rss() - before
+    print('%-13s %6d bytes/instance %8.1f MB resident %7.3fs' % (
+        cls.__name__, instance_size(documents[0]), growth / 2.0**20, elapsed))
+    return documents
+
+def main(count):
+    kwargs = values()
+    print('%d documents, %d properties' % (count, len(kwargs)))
+    for cls in (DictRecord, DefaultRecord, SlotsRecord):
+        documents = bench(cls, count, kwargs)
+        del documents
+
+if __name__ == '__main__':
+    main(*arguments(DEFAULT_DOCUMENTS))
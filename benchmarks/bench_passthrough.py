@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+# Measure pass-through workloads, where Isis composite fields are built
+# and serialized again without reading their subfields
+#
+# usage: python bench_passthrough.py [DOCUMENTS]
+
+from common import arguments, timed
+from isis.model import Document, TextProperty, MultiIsisCompositeTextProperty
+from isis.model.subfield import CompositeString
+
+DEFAULT_DOCUMENTS = 5000
+AUTHORS = (u'^lHeineman^fGeorge T.^rautor^1Worcester Polytechnic Institute',
+           u'^lPollice^fGary^rautor^1Worcester Polytechnic Institute',
+           u'^lSelkov^fStanley^rautor^1Salem State College')
+
+class EagerCompositeString(CompositeString):
+    ''' expands its subfields when built, as before lazy expansion '''
+
+    def __init__(self, *args, **kwargs):
+        super(EagerCompositeString, self).__init__(*args, **kwargs)
+        self.items()
+
+class Expanded(Document):
+    title = TextProperty(required=True)
+    authors = MultiIsisCompositeTextProperty(subkeys='lfr1')
+
+class Raw(Document):
+    title = TextProperty(required=True)
+    authors = MultiIsisCompositeTextProperty(subkeys='lfr1', raw=True)
+
+def fields(cls, count):
+    for i in xrange(count):
+        for author in AUTHORS:
+            unicode(cls(author, 'lfr1'))
+
+def documents(cls, count):
+    for i in xrange(count):
+        cls(title=u'Algorithms in a nutshell', authors=AUTHORS).to_python()
+
+def bench(label, function, cls, count):
+    elapsed = timed(function, cls, count)[1]
+    print('%-24s %7.3fs %10.0f /s' % (label, elapsed, count / elapsed))
+
+def main(count):
+    print('%d documents with %d authors' % (count, len(AUTHORS)))
+    bench('eager fields', fields, EagerCompositeString, count)
+    bench('lazy fields', fields, CompositeString, count)
+    bench('expanded to_python', documents, Expanded, count)
+    bench('raw to_python', documents, Raw, count)
+
+if __name__ == '__main__':
+    main(*arguments(DEFAULT_DOCUMENTS))
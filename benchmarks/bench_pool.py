@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+# Measure saves and gets/second from many threads in a local fake CouchDB
+# server, all threads sharing one couchdbkit.Database (as before) and each
+# with its database handle from a CouchdbPool, and count the connections
+# opened to the server
+#
+# usage: python bench_pool.py [THREADS] [OPERATIONS] [MAX_CONNECTIONS]
+
+import threading
+import time
+
+from common import Record, arguments, fake_couch
+import couchdbkit
+from isis.utils.pool import CouchdbPool
+
+DEFAULT_THREADS = 32
+DEFAULT_OPERATIONS = 50 # saves and gets per thread
+DEFAULT_MAX_CONNECTIONS = 10
+
+def worker(db, operations, errors):
+    for i in xrange(operations):
+        try:
+            record = Record(title=u'Record %d' % i)
+            record.save(db)
+            Record.get(db, record._id)
+        except Exception, error:
+            errors.append(error)
+
+def bench(server, label, db, threads, operations):
+    server.connections.clear()
+    errors = []
+    workers = [threading.Thread(target=worker, args=(db, operations, errors))
+               for i in xrange(threads)]
+    t0 = time.time()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.time() - t0
+    print('%-10s %7.3fs %8.0f operations/s %5d connections %4d errors' % (
+        label, elapsed, 2 * threads * operations / elapsed,
+        len(server.connections), len(errors)))
+
+def main(threads, operations, max_connections):
+    print('%d threads, %d saves and gets each, pools of %d connections' % (
+        threads, operations, max_connections))
+    with fake_couch('pool') as server:
+        shared = couchdbkit.Server(server.url)['pool']
+        bench(server, 'shared', shared, threads, operations)
+        Record.pool = CouchdbPool(server.url, max_connections=max_connections)
+        bench(server, 'CouchdbPool', 'pool', threads, operations)
+        print(', '.join('%s %d' % item for item in sorted(Record.pool.stats().items())))
+
+if __name__ == '__main__':
+    main(*arguments(DEFAULT_THREADS, DEFAULT_OPERATIONS, DEFAULT_MAX_CONNECTIONS))
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+# Time editing documents whose forms send their attachments again,
+# unchanged, in a local fake CouchDB server: uploading the files every
+# time (as before) and comparing their digests with the stored ones
+#
+# usage: python bench_resave.py [EDITS] [MEGABYTES]
+
+import os
+import tempfile
+import time
+
+from common import arguments, fake_couch
+import couchdbkit
+from isis.model import CouchdbDocument, TextProperty, FileProperty
+from isis.model import couchdb
+
+DEFAULT_EDITS = 10
+DEFAULT_MEGABYTES = 4
+
+class Report(CouchdbDocument):
+    title = TextProperty(required=True)
+    pdf = FileProperty()
+
+def bench(server, label, fp, edits):
+    db = couchdbkit.Database(server.url + '/resave')
+    report = Report(title=u'Annual report',
+                    pdf={'fp': fp, 'uid': 'pdf', 'filename': 'report.pdf'})
+    report.save(db)
+    del server.requests[:]
+    t0 = time.time()
+    for i in xrange(edits):
+        report = Report.get(db, report._id)
+        report.title = u'Annual report, revision %d' % i
+        # the form sends the file again
+        report.pdf = {'fp': fp, 'uid': 'pdf', 'filename': 'report.pdf'}
+        report.save(db)
+    elapsed = time.time() - t0
+    uploads = sum(1 for method, path in server.requests
+                  if method == 'PUT' and path.split('?')[0].endswith('.pdf'))
+    print('%-10s %7.3fs %7.1f edits/s %4d uploads %5d requests' % (
+        label, elapsed, edits / elapsed, uploads, len(server.requests)))
+
+def main(edits, megabytes):
+    fp = tempfile.TemporaryFile()
+    for i in xrange(megabytes):
+        fp.write(os.urandom(1024 * 1024))
+    print('%d edits, %d MB attachment' % (edits, megabytes))
+    attach_same = couchdb._attach_same
+    with fake_couch('resave') as server:
+        try:
+            couchdb._attach_same = lambda old_doc, prop, file_metadata: False
+            bench(server, 'upload', fp, edits)
+            couchdb._attach_same = attach_same
+            bench(server, 'digest', fp, edits)
+        finally:
+            couchdb._attach_same = attach_same
+
+if __name__ == '__main__':
+    main(*arguments(DEFAULT_EDITS, DEFAULT_MEGABYTES))
@@ -0,0 +1,44 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+# Time saving new and then updated documents in a local fake CouchDB
+# server, one at a time with save and in batches with save_many, and
+# count the HTTP requests made
+#
+# usage: python bench_save_many.py [DOCUMENTS] [BATCH_SIZE]
+
+from common import Record, arguments, fake_couch, timed
+import couchdbkit
+
+DEFAULT_DOCUMENTS = 200
+DEFAULT_BATCH_SIZE = 50
+
+def save_each(db, documents, batch_size):
+    for document in documents:
+        document.save(db)
+
+def save_batches(db, documents, batch_size):
+    for start in xrange(0, len(documents), batch_size):
+        errors = Record.save_many(db, documents[start:start + batch_size])
+        if errors:
+            raise errors[0].error
+
+def bench(server, label, save, count, batch_size):
+    server.databases[label] = {}
+    db = couchdbkit.Database(server.url + '/' + label)
+    documents = [Record(title=u'Record %d' % i, authors=(u'Rose, Daiana',),
+                        year=u'2010') for i in xrange(count)]
+    for step in ('new', 'updated'):
+        del server.requests[:]
+        elapsed = timed(save, db, documents, batch_size)[1]
+        print('%-8s %-8s %7.3fs %8.0f documents/s %6d requests' % (
+            label, step, elapsed, count / elapsed, len(server.requests)))
+
+def main(count, batch_size):
+    print('%d documents, batches of %d' % (count, batch_size))
+    with fake_couch() as server:
+        bench(server, 'save', save_each, count, batch_size)
+        bench(server, 'save_many', save_batches, count, batch_size)
+
+if __name__ == '__main__':
+    main(*arguments(DEFAULT_DOCUMENTS, DEFAULT_BATCH_SIZE))
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+# Time the work done by the insert_entry and edit_entry views of the
+# pyramid examples on a GET request (schema, form and rendering), with
+# the schema rebuilt for every request as before, and cached
+#
+# usage: python bench_schema.py [REQUESTS]
+
+import imp
+import os
+import time
+
+from common import HERE, arguments
+import deform
+
+EXAMPLES = os.path.join(HERE, '..', 'examples')
+MODELS = [('pyramid-attachs', os.path.join(EXAMPLES, 'pyramid-attachs',
+                                           'pyramidattachs', 'main', 'models.py')),
+          ('textproperty', os.path.join(EXAMPLES, 'textproperty',
+                                        'textproperty', 'main', 'models.py'))]
+DEFAULT_REQUESTS = 500
+ENTRY = {'_id': u'x1y2z', '_rev': u'1-abc', 'title': u'Alice',
+         'description': u'Through the looking glass'}
+
+def rebuilt_schema(cls):
+    return cls._build_schema()
+
+def cached_schema(cls):
+    return cls.get_schema()
+
+def get_request(cls, schema_for, edit):
+    entry_form = deform.Form(schema_for(cls), buttons=('submit',))
+    if edit:
+        return entry_form.render(ENTRY)
+    return entry_form.render()
+
+def bench(cls, schema_for, edit, count):
+    get_request(cls, schema_for, edit) # load the templates
+    t0 = time.time()
+    for i in xrange(count):
+        get_request(cls, schema_for, edit)
+    return (time.time() - t0) / count * 1000
+
+def main(count):
+    print('%d GET requests per view' % count)
+    for example, file_name in MODELS:
+        cls = imp.load_source(example.replace('-', '_') + '_models',
+                              file_name).Entry
+        for view, edit in (('insert_entry', False), ('edit_entry', True)):
+            for schema_for in (rebuilt_schema, cached_schema):
+                print('%-16s %-13s %-15s %6.2f ms/request' % (
+                    example, view, schema_for.__name__,
+                    bench(cls, schema_for, edit, count)))
+
+if __name__ == '__main__':
+    main(*arguments(DEFAULT_REQUESTS))
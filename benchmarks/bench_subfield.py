@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+# Compare subfield.expand with the previous regular expression parser,
+# over the field values of the LILACS.iso fixture
+#
+# usage: python bench_subfield.py [REPEAT]
+
+import os
+import re
+import time
+
+from common import HERE, arguments
+from iso2709 import IsoFile
+from isis.model.subfield import expand
+
+FIXTURE = os.path.join(HERE, '..', 'fixtures', 'lilacs1', 'LILACS.iso')
+DEFAULT_REPEAT = 2000
+SUBFIELD_MARKER_RE = re.compile(r'\^([a-z0-9])', re.IGNORECASE)
+
+def regex_expand(content, subkeys=None):
+    ''' the parser used before the subfield_parser cache '''
+    if subkeys is None:
+        regex = SUBFIELD_MARKER_RE
+    elif subkeys == '':
+        return [('_', content)]
+    else:
+        regex = re.compile(r'\^(['+subkeys+'])', re.IGNORECASE)
+    content = content.replace('^^', '^^ ')
+    parts = []
+    start = 0
+    key = '_'
+    while True:
+        found = regex.search(content, start)
+        if found is None: break
+        parts.append((key, content[start:found.start()].rstrip()))
+        key = found.group(1).lower()
+        start = found.end()
+    parts.append((key, content[start:].rstrip()))
+    return parts
+
+def field_values():
+    iso = IsoFile(FIXTURE)
+    values = [field.value.decode('cp1252') for record in iso
+              for field in record.directory]
+    iso.close()
+    return values
+
+def bench(function, values, subkeys, repeat):
+    t0 = time.time()
+    for i in xrange(repeat):
+        for value in values:
+            function(value, subkeys)
+    return time.time() - t0
+
+def main(repeat):
+    values = field_values()
+    with_subfields = [value for value in values if '^' in value]
+    for label, sample in (('all', values), ('with subfields', with_subfields)):
+        print('%s: %d field values x %d' % (label, len(sample), repeat))
+        for subkeys in (None, 'fl', 'abcdefgh'):
+            for function in (regex_expand, expand):
+                elapsed = bench(function, sample, subkeys, repeat)
+                print('%-12s subkeys=%-10r %7.3fs %10.0f values/s' % (
+                    function.__name__, subkeys, elapsed,
+                    len(sample) * repeat / elapsed))
+
+if __name__ == '__main__':
+    main(*arguments(DEFAULT_REPEAT))
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+# Time building and validating documents with validators and choices,
+# running the validators on assignment and again in validate (as before),
+# once on assignment, once in validate, and once on assignment timing the
+# validators; then show the validator cost of each property
+#
+# usage: python bench_validation.py [DOCUMENTS]
+
+import re
+import time
+
+from common import arguments
+from isis.model import Document, TextProperty, MultiTextProperty
+
+DEFAULT_DOCUMENTS = 20000
+LANGUAGES = [(code, code) for code in 'en es pt fr de it'.split()]
+ISSN_RE = re.compile(r'^\d{4}-\d{3}[\dX]$')
+
+def issn_validator(node, value):
+    if not ISSN_RE.match(value):
+        raise ValueError('%r is not an ISSN' % value)
+
+def author_validator(node, value):
+    for author in value:
+        if ',' not in author:
+            raise ValueError("authors must be in 'LastName, FirstName' format")
+
+def properties():
+    return {'title': TextProperty(required=True),
+            'issn': TextProperty(validator=issn_validator),
+            'authors': MultiTextProperty(validator=author_validator),
+            'language': TextProperty(choices=LANGUAGES),
+            'abstract_languages': MultiTextProperty(choices=LANGUAGES)}
+
+class TwiceValidated(Document):
+    ''' validate running every validator again, as before '''
+
+    def validate(self):
+        for name, descriptor, required, serializer in self._property_table:
+            value = descriptor.value(self)
+            if value is not None or required:
+                descriptor.validate(self, value)
+
+AssignRecord = type('AssignRecord', (Document,), properties())
+TwiceRecord = type('TwiceRecord', (TwiceValidated,), properties())
+DeferredRecord = type('DeferredRecord', (Document,), dict(properties(),
+    Meta=type('Meta', (), {'validation': 'validate'})))
+TimedRecord = type('TimedRecord', (Document,), dict(properties(),
+    Meta=type('Meta', (), {'time_validators': True})))
+
+VALUES = {'title': u'Rev. Pediatr.', 'issn': u'0100-0000',
+          'authors': (u'Mendes, Eugenio', u'Rose, Daiana'),
+          'language': u'pt', 'abstract_languages': (u'en', u'es', u'pt')}
+
+def bench(cls, count):
+    cls.validator_stats(reset=True)
+    t0 = time.time()
+    for i in xrange(count):
+        cls(**VALUES).validate()
+    elapsed = time.time() - t0
+    calls = sum(calls for calls, seconds in cls.validator_stats().values())
+    print('%-15s %7.3fs %9.0f documents/s %8d checks' % (
+        cls.__name__, elapsed, count / elapsed, calls))
+
+def main(count):
+    print('%d documents' % count)
+    for cls in (TwiceRecord, AssignRecord, DeferredRecord, TimedRecord):
+        bench(cls, count)
+    print('')
+    for name, (calls, seconds) in TimedRecord.validator_stats().items():
+        print('%-20s %8d calls %7.3fs' % (name, calls, seconds))
+
+if __name__ == '__main__':
+    main(*arguments(DEFAULT_DOCUMENTS))
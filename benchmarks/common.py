@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+# Code shared by the benchmarks; importing it first puts the checkout and
+# its tools ahead of any isis package installed
+
+import contextlib
+import multiprocessing
+import os
+import resource
+import sys
+import time
+
+HERE = os.path.abspath(os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(HERE, '..'))
+sys.path.insert(0, os.path.join(HERE, '..', 'tools'))
+from fakecouch import FakeCouchServer
+from isis.model import CouchdbDocument, TextProperty, MultiTextProperty
+from isis.model import MultiIsisCompositeTextProperty
+
+BATCH_SIZE = 1000 # documents saved by each save_many of save_records
+
+class Record(CouchdbDocument):
+    ''' the documents of the benchmarks against the fake CouchDB server '''
+    title = TextProperty(required=True, index=True)
+    authors = MultiTextProperty()
+    year = TextProperty()
+    abstract = TextProperty()
+
+def lilacs_properties():
+    ''' id, database, document type, titles, authors, source, dates... '''
+    names = ('v2 v4 v5 v6 v8 v10 v12 v13 v30 v31 v32 v35 v38 v40 v64 v65 '
+             'v71 v76 v83 v87 v88 v91 v92 v93 v98 v110 v111 v112 v113').split()
+    props = {}
+    for name in names:
+        if name == 'v10':
+            props[name] = MultiIsisCompositeTextProperty(subkeys='s1r', raw=True)
+        elif name in ('v4', 'v8', 'v71', 'v76', 'v83', 'v87', 'v88'):
+            props[name] = MultiTextProperty()
+        else:
+            props[name] = TextProperty(required=name in ('v2', 'v5', 'v12'))
+    return props
+
+def arguments(*defaults):
+    ''' the command line arguments, of the types of the defaults given for
+        them; defaults for the ones missing '''
+    args = sys.argv[1:]
+    return ([type(default)(arg) for default, arg in zip(defaults, args)] +
+            list(defaults[len(args):]))
+
+def timed(function, *args):
+    ''' (result of the call, seconds it took) '''
+    t0 = time.time()
+    result = function(*args)
+    return result, time.time() - t0
+
+def save_records(db, count, **values):
+    ''' save count Records, "record<n>" titled "Record <n>", in batches '''
+    for start in xrange(0, count, BATCH_SIZE):
+        Record.save_many(db, [Record(_id=u'record%d' % i, title=u'Record %d' % i, **values)
+                              for i in xrange(start, min(start + BATCH_SIZE, count))])
+
+@contextlib.contextmanager
+def fake_couch(*databases):
+    ''' a FakeCouchServer with the databases named, stopped on exit '''
+    server = FakeCouchServer()
+    for name in databases:
+        server.databases[name] = {}
+    try:
+        yield server
+    finally:
+        server.stop()
+
+def _serve(databases, urls, stop):
+    with fake_couch(*databases) as server:
+        urls.put(server.url)
+        stop.wait()
+
+@contextlib.contextmanager
+def fake_couch_process(*databases):
+    ''' the url of a FakeCouchServer run by another process, for the memory
+        of the clients to be measured without it '''
+    urls, stop = multiprocessing.Queue(), multiprocessing.Event()
+    server = multiprocessing.Process(target=_serve, args=(databases, urls, stop))
+    server.start()
+    try:
+        yield urls.get()
+    finally:
+        stop.set()
+        server.join()
+
+def max_rss():
+    ''' peak resident memory of this process, in KB (Linux) '''
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
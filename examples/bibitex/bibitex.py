@@ -6,9 +6,14 @@ from pyramid.renderers import render_to_response
 from paste.httpserver import serve
 from models import Bibitex
 from forms import BibitexForm
+from isis.utils.pool import CouchdbPool
 
 import deform
-import couchdbkit
+import itertools
+
+DB_NAME = 'bibitex'
+PAGE_SIZE = 20 # records listed in each page
+LIST_FIELDS = ['entry_type', 'reference_name', 'title'] # shown in the list
 
 def new(request):
     bibitex_form = BibitexForm.get_form()
@@ -22,13 +27,13 @@ def new(request):
               {'content': e.render()})
 
         bibitex = Bibitex.from_python(appstruct)
-        bibitex.save(db)
+        bibitex.save(DB_NAME)
 
         return Response('Saved under id: %s' % bibitex._id)
     else:
 
         if 'id' in request.matchdict: #edit
-            bibitex = Bibitex.get(db, request.matchdict['id'])
+            bibitex = Bibitex.get(DB_NAME, request.matchdict['id'])
             
             return render_to_response('bibitex:form.pt',
               {'content': bibitex_form.render(bibitex.to_python())})
@@ -38,18 +43,26 @@ def new(request):
 
 
 def index(request):
-    records = db.view('_all_docs', include_docs=True)
+    # a page of records, and the first one of the next page, in one request
+    records = list(itertools.islice(
+        Bibitex.list(DB_NAME, LIST_FIELDS, page_size=PAGE_SIZE + 1,
+                     start_key=request.GET.get('start')),
+        PAGE_SIZE + 1))
+    next_start = records.pop()['_id'] if len(records) > PAGE_SIZE else None
 
     return render_to_response('bibitex:index.pt',
-      {'records':records})
+      {'records':records, 'next_start':next_start})
 
 
 if __name__ == '__main__':
     config = Configurator()
 
     """Configuring couchdb"""
-    server = couchdbkit.Server()
-    db = server.get_or_create_db('bibitex')
+    # the threads serving requests share its connections
+    Bibitex.pool = CouchdbPool()
+    Bibitex.pool.database(DB_NAME, create=True)
+    Bibitex.sync_list(DB_NAME, LIST_FIELDS)
+    Bibitex.sync_indexes(DB_NAME)
 
     """Adding static views"""
     config.add_static_view('deform_static', 'deform:static')
@@ -5,7 +5,7 @@ import colander
 
 class BibitexForm():
 
-    base_schema = Bibitex.get_schema()
+    base_schema = Bibitex.clone_schema()
     base_schema['review'].widget = deform.widget.TextAreaWidget(cols=80, rows=15)
     @classmethod
     def get_form(cls):
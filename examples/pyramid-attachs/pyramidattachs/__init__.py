@@ -4,9 +4,11 @@ from pyramid.events import subscriber
 from pyramid.events import NewRequest, NewResponse
 
 from pyramidattachs.main import views
+from pyramidattachs.main.models import Entry
 
-
-import couchdbkit
+from isis.model import CouchdbDocument
+from isis.utils.cache import LRUCache
+from isis.utils.pool import CouchdbPool
 
 def main(global_config, **settings):
     """ This function returns a Pyramid WSGI application.
@@ -20,10 +22,22 @@ def main(global_config, **settings):
     config.add_route('main', '', view=views.list_entries)
     config.add_route('edit', '/edit/{id}', view=views.edit_entry)
     config.add_route('view', '/view/{id}', view=views.view_entry)
+    config.add_route('attachment', '/attachment/{id}', view=views.view_attachment)
     
-    db_uri = settings['db_uri']
-    conn = couchdbkit.Server(db_uri)
-    config.registry.settings['db_conn'] = conn
+    # connections shared by the threads of the server, each request using
+    # the database handle of its thread
+    pool = CouchdbPool(settings['db_uri'],
+                       max_connections=int(settings.get('db_max_connections', 10)),
+                       timeout=float(settings.get('db_timeout', 30)))
+    config.registry.settings['db_pool'] = pool
+    CouchdbDocument.pool = pool
+    # the views listed by list_entries and of the indexes find_by reads
+    Entry.sync_list(settings['db_name'], ['title'])
+    Entry.sync_indexes(settings['db_name'])
+    # documents read or saved are kept for the views that read them again
+    CouchdbDocument.cache = LRUCache(
+        max_items=int(settings.get('cache_max_items', 1000)),
+        ttl=float(settings.get('cache_ttl', 60)))
     config.add_subscriber(add_couch_db, NewRequest) 
     
     attachs_uri = settings['db_uri'] + '/' + settings['db_name']
@@ -33,6 +47,5 @@ def main(global_config, **settings):
 
 def add_couch_db(event):
     settings = event.request.registry.settings
-    db = settings['db_conn'][settings['db_name']]
-    event.request.db = db
+    event.request.db = settings['db_pool'].database(settings['db_name'])
     
@@ -8,25 +8,46 @@ import deform
 import couchdbkit
 import Image
 import StringIO
+import itertools
+import mimetypes
+
+CHUNK_SIZE = 64 * 1024
+PAGE_SIZE = 20 # entries listed in each page
 
 def list_entries(request):
-    all_docs = request.db.view('pyattachs/all_docs')        
+    # a page of titles, and the first entry of the next page, in one request
+    rows = list(itertools.islice(Entry.list(request.db, ['title'],
+                                            page_size=PAGE_SIZE + 1,
+                                            start_key=request.GET.get('start')),
+                                 PAGE_SIZE + 1))
+    next_start = rows.pop()['_id'] if len(rows) > PAGE_SIZE else None
+    result = [{'key':row['_id'], 'value':row['title']} for row in rows]
     return render_to_response('templates/list.pt',
-                              {'result':all_docs.all()},
+                              {'result':result,
+                               'next_start':next_start},
                               request=request)
     
 def view_entry(request):
-    doc = request.db.get(request.matchdict['id'])
+    entry = Entry.get(request.db, request.matchdict['id'])
     
-    img_url = static_url('pyramidattachs:attachments/%s/%s', request)  % (doc['_id'], doc['attachment']['filename'])
+    img_url = request.route_url('attachment', id=entry._id)
     
     return render_to_response('templates/view.pt',
-                              {'title':doc['title'],
+                              {'title':entry.title,
                                'attach':img_url,
-                               'about':doc['description'],
-                               '_id': doc['_id']},
+                               'about':entry.description,
+                               '_id': entry._id},
                               request=request)
 
+def view_attachment(request):
+    entry = Entry.get(request.db, request.matchdict['id'])
+    stream = entry.open_attachment(request.db, 'attachment')
+    content_type = mimetypes.guess_type(entry.attachment['filename'])[0]
+
+    # the file is sent as it is read from CouchDB, never whole in memory
+    return Response(app_iter=iter(lambda: stream.read(CHUNK_SIZE), ''),
+                    content_type=content_type or 'application/octet-stream')
+
 def insert_entry(request):
     entry_schema = Entry.get_schema()
     entry_form = deform.Form(entry_schema, buttons=('submit',))
@@ -58,10 +79,15 @@ def edit_entry(request):
         
         entry = Entry.from_python(appstruct)
         
+        # saved over the _rev the form was rendered with, posted with it
         entry._id = request.matchdict['id']
-        entry._rev = request.db.get(entry._id)['_rev']
-
-        entry_id = entry.save(request.db)
+        try:
+            entry.save(request.db)
+        except couchdbkit.ResourceConflict:
+            return Response('''<html>
+                        <p>O registro %s foi alterado por outra pessoa</p>
+                        <a href="/edit/%s">Editar a vers&atilde;o atual</a>
+                    </html>''' % (entry._id, entry._id))
         
         response_text = '''<html>
                         <p>Atualizado com sucesso sob o ID %s </p>
@@ -71,7 +97,7 @@ def edit_entry(request):
 
     else:        
         try:
-           entry = request.db.get(request.matchdict['id'])
+           entry = Entry.get(request.db, request.matchdict['id'], cached=False).to_python()
         except couchdbkit.ResourceNotFound:
             raise exceptions.NotFound()
          
@@ -8,28 +8,30 @@ import deform
 import couchdbkit
 import Image
 import StringIO
+import itertools
 
-def list_entries(request):
+PAGE_SIZE = 20 # entries listed in each page
 
-    all_docs = request.db.view('_all_docs', include_docs=True).all()
-    result = []
-    
-    for doc in all_docs:
-        doc = doc['doc']
-        result.append({'key':doc['_id'],
-                      'value':doc['title']
-                      })
+def list_entries(request):
+    # a page of titles, and the first entry of the next page, in one request
+    rows = list(itertools.islice(Entry.list(request.db, ['title'],
+                                            page_size=PAGE_SIZE + 1,
+                                            start_key=request.GET.get('start')),
+                                 PAGE_SIZE + 1))
+    next_start = rows.pop()['_id'] if len(rows) > PAGE_SIZE else None
+    result = [{'key':row['_id'], 'value':row['title']} for row in rows]
     return render_to_response('templates/list.pt',
-                              {'result':result},
+                              {'result':result,
+                               'next_start':next_start},
                               request=request)
     
 def view_entry(request):
-    doc = request.db.get(request.matchdict['id'])    
+    entry = Entry.get(request.db, request.matchdict['id'])
     
     return render_to_response('templates/view.pt',
-                              {'title':doc['title'],
-                               'about':doc['description'],
-                               '_id': doc['_id']},
+                              {'title':entry.title,
+                               'about':entry.description,
+                               '_id': entry._id},
                               request=request)
 
 def insert_entry(request):
@@ -66,10 +68,15 @@ def edit_entry(request):
         
         entry = Entry.from_python(appstruct)
         
+        # saved over the _rev the form was rendered with, posted with it
         entry._id = request.matchdict['id']
-        entry._rev = request.db.get(entry._id)['_rev']
-
-        entry_id = entry.save(request.db)
+        try:
+            entry.save(request.db)
+        except couchdbkit.ResourceConflict:
+            return Response('''<html>
+                        <p>O registro %s foi alterado por outra pessoa</p>
+                        <a href="/edit/%s">Editar a vers&atilde;o atual</a>
+                    </html>''' % (entry._id, entry._id))
         
         response_text = '''<html>
                         <p>Atualizado com sucesso sob o ID %s </p>
@@ -79,7 +86,7 @@ def edit_entry(request):
 
     else:        
         try:
-           entry = request.db.get(request.matchdict['id'])
+           entry = Entry.get(request.db, request.matchdict['id'], cached=False).to_python()
         except couchdbkit.ResourceNotFound:
             raise exceptions.NotFound()
          
@@ -1,5 +1,5 @@
 # package
-from .mapper import Document
+from .mapper import Document, RecordError
 from .mapper import TextProperty, MultiTextProperty
 from .mapper import CompositeTextProperty, IsisCompositeTextProperty
 from .mapper import MultiIsisCompositeTextProperty, MultiCompositeTextProperty
@@ -19,13 +19,57 @@
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 
 from ..utils import base28
-from .mapper import Document, TextProperty, FileProperty
+from ..utils.executor import Executor
+from .mapper import Document, DocumentMeta, TextProperty, FileProperty, RecordError
+import base64
+import json
+import mimetypes
+import os
+import threading
 import uuid
 import couchdbkit
-import time
+from couchdbkit import resource
 import colander
 import deform
 
+ID_ATTEMPTS = 10 # ids tried for a new document before giving up
+INLINE_ATTACHMENT_SIZE = 64 * 1024 # larger files are not sent to _bulk_docs
+LIST_PAGE_SIZE = 100 # rows read by each request of CouchdbDocument.list
+
+FIND_BATCH_SIZE = 500 # keys sent with each request of CouchdbDocument.find_by
+EXECUTOR_WORKERS = 10 # threads of the executor made for classes without a pool
+CHANGES_BATCH_SIZE = 100 # changes given to the handlers of a ChangesConsumer at once
+CHANGES_HEARTBEAT = 1000 # milliseconds between heartbeats of a continuous feed
+CHANGES_TIMEOUT = 60000 # milliseconds before CouchDB ends a longpoll or continuous feed
+
+_views = set() # (database uri, design document id, views, obsolete) in sync
+_executor_lock = threading.Lock()
+_document_types = {} # CouchdbDocument subclasses by TYPE, for ChangesConsumer
+
+# map function of the index views, emitting the values found by following
+# a path from the documents of a type: property names, '*' for each item of
+# a sequence, and subkeys for the subfields of [subkey, value] pairs
+INDEX_MAP = '''function(doc) {
+  var type = %s, path = %s;
+  if (doc.TYPE !== type) return;
+  var values = [doc];
+  path.forEach(function(step) {
+    var next = [];
+    values.forEach(function(value) {
+      if (value === null || value === undefined) return;
+      if (step === "*") next = next.concat(value);
+      else if (value instanceof Array) value.forEach(function(pair) {
+        if (pair[0] === step) next.push(pair[1]);
+      });
+      else next.push(value[step]);
+    });
+    values = next;
+  });
+  values.forEach(function(value) {
+    if (value !== null && value !== undefined) emit(value, null);
+  });
+}'''
+
 def _attach_exists(old_doc, property_name):
     if property_name in old_doc:
         try:
@@ -42,13 +86,124 @@ def _attach_updated(new_doc, property_name):
     except KeyError:
         return False
 
+def _attach_same(old_doc, prop, file_metadata):
+    '''
+    True if old_doc has an attachment with the name and digest of the
+    file of file_metadata, which then need not be uploaded again
+    '''
+    try:
+        stub = old_doc['_attachments'][file_metadata['filename']]
+    except (TypeError, KeyError):
+        return False
+    return 'digest' in stub and stub['digest'] == prop.digest(file_metadata)
+
+def _file_size(fp):
+    '''
+    size of the file fp, or None if it cannot seek
+    '''
+    try:
+        position = fp.tell()
+        fp.seek(0, 2)
+        size = fp.tell()
+        fp.seek(position)
+    except (AttributeError, IOError):
+        return None
+    return size
+
+def _put_attachment(db, doc, fp, filename):
+    '''
+    upload fp in chunks, never reading it whole: with its size, or with
+    chunked transfer encoding if it cannot seek
+    '''
+    size = _file_size(fp)
+    if size is None:
+        return db.put_attachment(doc, fp, filename,
+                                 headers={'Transfer-Encoding': 'chunked'})
+    return db.put_attachment(doc, fp, filename, content_length=size)
+
+def _sync_views(db, design_id, views, obsolete=None):
+    '''
+    create or update the views (name: map function) of the design document
+    design_id with a single write, removing the other views whose names
+    start with obsolete, unless it was already done by this process
+    '''
+    key = (db.uri, design_id, tuple(sorted(views.items())), obsolete)
+    if key in _views:
+        return
+    while True:
+        try:
+            design = db.get(design_id)
+        except couchdbkit.ResourceNotFound:
+            design = {'_id': design_id, 'language': 'javascript'}
+        current = design.get('views', {})
+        wanted = dict((name, view) for name, view in current.items()
+                      if obsolete is None or not name.startswith(obsolete)
+                      or name in views)
+        wanted.update((name, {'map': source}) for name, source in views.items())
+        if wanted == current:
+            break
+        design['views'] = wanted
+        try:
+            db.save_doc(design)
+            break
+        except couchdbkit.ResourceConflict:
+            pass # changed by another process: read it again
+    _views.add(key)
+
+def _inline_attachment(file_metadata):
+    '''
+    _attachments entry with the contents of an uploaded file, for
+    _bulk_docs
+    '''
+    content_type = mimetypes.guess_type(file_metadata['filename'])[0]
+    return {'content_type': content_type or 'application/octet-stream',
+            'data': base64.b64encode(file_metadata['fp'].read())}
+
+def _finder(index):
+    ''' find_by_<index> class method '''
+    def find(cls, db, keys, stale=False):
+        return cls.find_by(db, index, keys, stale)
+    find.__name__ = 'find_by_' + index
+    find.__doc__ = 'documents with one of keys in the %s index, see find_by' % index
+    return classmethod(find)
+
+
+class CouchdbDocumentMeta(DocumentMeta):
+    ''' adds a find_by_<index> class method for each index of the class
+        and registers it by TYPE, to decode the changes of its documents '''
+    def __init__(cls, name, bases, dict):
+        super(CouchdbDocumentMeta, cls).__init__(name, bases, dict)
+        _document_types[cls.TYPE] = cls
+        for index in cls._indexes:
+            setattr(cls, 'find_by_' + index, _finder(index))
+
 
 class CouchdbDocument(Document):
+    __metaclass__ = CouchdbDocumentMeta
+    __slots__ = ('_id', '_rev', '_attachments') # as read from CouchDB
+    # ids of new documents, shared by all classes unless one sets its own:
+    # 8 base28 characters, a random node prefix for each process and a
+    # counter of 4 digits, or more once it passes 28**4 (ids were random
+    # and 5 characters long before)
+    id_generator = base28.IdGenerator()
+    # documents read by get and written by save, like an
+    # isis.utils.cache.LRUCache; None to always read from the database
+    cache = None
+    # an isis.utils.pool.CouchdbPool, to name databases instead of passing
+    # couchdbkit.Database objects: each thread gets its own, sharing the
+    # connections of the pool
+    pool = None
+    # an isis.utils.executor.Executor running the blocking calls of aget,
+    # asave, asave_many and aiter_view in its threads, not non-blocking
+    # requests; the one of CouchdbDocument is shared by the classes which
+    # set none, made on first use with a thread for each connection of the
+    # pool, the databases best named for each thread to open its own
+    executor = None
 
     def __init__(self, **kwargs):
         super(CouchdbDocument, self).__init__(**kwargs)
         if '_id' not in kwargs:
-            self._id = base28.genbase(5)
+            self._id = self.id_generator.next()
 
     def __clean_before_save(self, doc):
         '''
@@ -82,12 +237,51 @@ class CouchdbDocument(Document):
 
         return super(CouchdbDocument, cls).from_python(pystruct)
 
+    @classmethod
+    def _build_converter(cls):
+        convert = super(CouchdbDocument, cls)._build_converter()
+
+        def convert_controls(pystruct):
+            kwargs = convert(pystruct)
+            for key in ('_id', '_rev'):
+                if kwargs.get(key) == 'None':
+                    del kwargs[key]
+            return kwargs
+
+        return convert_controls
+
+    @classmethod
+    def _database(cls, db):
+        '''
+        db, or the database of the current thread named db in the pool
+        '''
+        if not isinstance(db, basestring):
+            return db
+        if cls.pool is None:
+            raise TypeError('%s has no pool to open database %r' % (cls.__name__, db))
+        return cls.pool.database(db)
+
     def save(self, db):
+        db = self._database(db)
         new_doc = self.to_python()
         new_doc = self.__clean_before_save(new_doc)
 
         old_doc = db.get(new_doc['_id']) if '_rev' in new_doc else None
 
+        uploads = []
+        for key, prop, required, serializer in self._property_table:
+            if not isinstance(prop, FileProperty):
+                continue
+            file_metadata = prop.value(self)
+            if file_metadata is None:
+                if old_doc is not None and _attach_exists(old_doc, key):
+                    #Attachment exists and had not been changed
+                    new_doc[key] = old_doc[key]
+            elif file_metadata.get('fp') and not _attach_same(old_doc, prop, file_metadata):
+                #New or updated attachment
+                uploads.append(file_metadata)
+
+        attempts = 0
         while True:
             try:
                 if old_doc is not None and '_attachments' in old_doc:
@@ -96,33 +290,148 @@ class CouchdbDocument(Document):
                 db.save_doc(new_doc)
                 break
             except couchdbkit.ResourceConflict:
-                time.sleep(0.5)
-                new_doc['_id'] = base28.genbase(5)
-
-        for key in self.__class__:
-            prop = self.__class__.__getattribute__(self.__class__,key)
-            if isinstance(prop, FileProperty):
-
-                if old_doc is None:
-                    #New document
-                    file_metadata = getattr(self,key, None)
-                    if file_metadata:
-                        db.put_attachment(new_doc, file_metadata['fp'], getattr(self, key)['filename'])
-                elif _attach_exists(old_doc, key) and not hasattr(self,key):
-                    #Attachment exists and had not been changed
-                    new_doc[key] = old_doc[key]
-                    db.save_doc(new_doc)
-                else:
-                    #Attachment updated
-                    file_metadata = getattr(self,key, None)
-                    if file_metadata and file_metadata.get('fp'):
-                        db.put_attachment(new_doc, file_metadata['fp'], getattr(self, key)['filename'])
+                attempts += 1
+                if '_rev' in new_doc or attempts == ID_ATTEMPTS:
+                    # changed by someone else since it was read
+                    if self.cache is not None:
+                        self.cache.pop((db.uri, new_doc['_id']))
+                    raise
+                # the id is taken: another process may share our node
+                self.id_generator.renew()
+                new_doc['_id'] = self.id_generator.next()
+
+        for file_metadata in uploads:
+            _put_attachment(db, new_doc, file_metadata['fp'], file_metadata['filename'])
 
         self._id, self._rev = new_doc['_id'], new_doc['_rev']
+        self._cache_doc(db, new_doc, complete=not uploads)
 
     @classmethod
-    def get(cls, db, doc_id, controls=True):
-        doc = db.get(doc_id)
+    def save_many(cls, db, documents):
+        '''
+        save documents with one request to _all_docs, for the current
+        revisions and attachments, and one to _bulk_docs, with the files
+        of FileProperty values inline. New documents whose _id is taken
+        get another one; a RecordError is returned for each document
+        which could not be saved, like the ones changed by someone else
+        since they were read. Files larger than INLINE_ATTACHMENT_SIZE
+        are uploaded afterwards, one request each
+        '''
+        db = cls._database(db)
+        documents = list(documents)
+        new_docs = [document.__clean_before_save(document.to_python())
+                    for document in documents]
+        for new_doc in new_docs:
+            if '_id' not in new_doc:
+                new_doc['_id'] = cls.id_generator.next()
+        rows = db.all_docs(keys=[new_doc['_id'] for new_doc in new_docs],
+                           include_docs=True).all()
+        # deleted documents have no doc, and their ids can be reused
+        old_docs = dict((row['key'], row['doc']) for row in rows
+                        if row.get('doc') is not None)
+
+        uploads = dict((index, []) for index in range(len(documents)))
+        for index, (document, new_doc) in enumerate(zip(documents, new_docs)):
+            if '_rev' in new_doc:
+                old_doc = old_docs.get(new_doc['_id'])
+            else:
+                old_doc = None
+                while new_doc['_id'] in old_docs:
+                    new_doc['_id'] = cls.id_generator.next()
+            attachments = {}
+            if old_doc is not None and '_attachments' in old_doc:
+                attachments.update(old_doc['_attachments'])
+            for key, prop, required, serializer in cls._property_table:
+                if not isinstance(prop, FileProperty):
+                    continue
+                file_metadata = prop.value(document)
+                if file_metadata and file_metadata.get('fp'):
+                    if _attach_same(old_doc, prop, file_metadata):
+                        continue
+                    size = _file_size(file_metadata['fp'])
+                    if size is not None and size <= INLINE_ATTACHMENT_SIZE:
+                        attachments[file_metadata['filename']] = _inline_attachment(file_metadata)
+                    else:
+                        uploads[index].append(file_metadata)
+                elif file_metadata is None and old_doc is not None and _attach_exists(old_doc, key):
+                    new_doc[key] = old_doc[key]
+            if attachments:
+                new_doc['_attachments'] = attachments
+
+        errors = []
+        pending = range(len(documents))
+        attempts = 0
+        while pending:
+            attempts += 1
+            try:
+                results = db.bulk_save([new_docs[index] for index in pending],
+                                       use_uuids=False)
+            except couchdbkit.BulkSaveError, error:
+                results = error.results
+            retry = []
+            for index, result in zip(pending, results):
+                if 'error' not in result:
+                    try:
+                        for file_metadata in uploads[index]:
+                            _put_attachment(db, new_docs[index], file_metadata['fp'],
+                                            file_metadata['filename'])
+                    except (couchdbkit.ResourceConflict, couchdbkit.RequestFailed), error:
+                        errors.append(RecordError(index, documents[index], None, error))
+                    documents[index]._id = new_docs[index]['_id']
+                    documents[index]._rev = new_docs[index]['_rev']
+                    documents[index]._cache_doc(db, new_docs[index],
+                                                complete=not uploads[index])
+                elif (result['error'] == 'conflict' and '_rev' not in new_docs[index]
+                      and attempts < ID_ATTEMPTS):
+                    # the id was taken after _all_docs was read
+                    retry.append(index)
+                else:
+                    if result['error'] == 'conflict':
+                        error = couchdbkit.ResourceConflict(result.get('reason'))
+                        if cls.cache is not None:
+                            cls.cache.pop((db.uri, new_docs[index]['_id']))
+                    else:
+                        error = couchdbkit.RequestFailed(result.get('reason'))
+                    errors.append(RecordError(index, documents[index], None, error))
+            if retry: # another process may share our node
+                cls.id_generator.renew()
+            for index in retry:
+                new_docs[index]['_id'] = cls.id_generator.next()
+            pending = retry
+
+        return sorted(errors, key=lambda error: error.index)
+
+    def open_attachment(self, db, name):
+        '''
+        file-like object streaming an attachment of this document, by
+        the name of a FileProperty or of the attachment itself; read it
+        in chunks, and close it (or use it in a with statement) to
+        release the connection
+        '''
+        for key, prop, required, serializer in self._property_table:
+            if key == name and isinstance(prop, FileProperty):
+                file_metadata = prop.value(self)
+                if file_metadata is None:
+                    raise couchdbkit.ResourceNotFound('%r has no file' % name)
+                name = file_metadata['filename']
+                break
+        return self._database(db).fetch_attachment(self._id, name, stream=True)
+
+    @classmethod
+    def get(cls, db, doc_id, controls=True, cached=True):
+        '''
+        the document doc_id, from the cache if the class has one, unless
+        cached is False, as when its _rev is needed to save it: then it is
+        read from the database, and cached again
+        '''
+        db = cls._database(db)
+        doc = None
+        if cached and cls.cache is not None:
+            doc = cls._cached_doc(db, doc_id)
+        if doc is None:
+            doc = db.get(doc_id)
+            if cls.cache is not None:
+                cls.cache.set((db.uri, doc_id), (doc['_rev'], json.dumps(doc)))
         couchdocument = cls.from_python(doc)
 
         if not controls:
@@ -131,10 +440,217 @@ class CouchdbDocument(Document):
 
         return couchdocument
 
+    @classmethod
+    def list(cls, db, fields=(), page_size=LIST_PAGE_SIZE, start_key=None):
+        '''
+        rows of the documents of this class in _id order, from start_key
+        on: dicts with the _id and the named fields only, as emitted by the
+        view sync_list writes for these fields, which must be called first;
+        until then the view is missing, and couchdbkit.ResourceNotFound is
+        raised. Rows are read lazily, page_size (plus one, the start key of
+        the next page) with each request, so whole documents are never
+        loaded nor all rows kept
+        '''
+        db = cls._database(db)
+        fields = cls._list_fields(fields)
+        return cls._list_rows(db, '%s/list' % cls._list_design(fields)[len('_design/'):],
+                              fields, page_size, start_key)
+
+    @classmethod
+    def sync_list(cls, db, fields=()):
+        '''
+        create the view list reads the named fields from, when setting up:
+        each combination of fields has a design document of its own,
+        _design/<class>-list-<fields>, as any change to a design document
+        rebuilds all of its views
+        '''
+        db = cls._database(db)
+        fields = cls._list_fields(fields)
+        map_source = ('function(doc) {\n'
+                      '  if (doc.TYPE === %s) {\n'
+                      '    emit(doc._id, [%s]);\n'
+                      '  }\n'
+                      '}' % (json.dumps(cls.TYPE),
+                             ', '.join('doc[%s]' % json.dumps(name) for name in fields)))
+        _sync_views(db, cls._list_design(fields), {'list': map_source})
+
+    @classmethod
+    def _list_fields(cls, fields):
+        fields = tuple(fields)
+        names = set(name for name, prop, required, serializer in cls._property_table)
+        for name in fields:
+            if name not in names:
+                raise TypeError('%s has no property %r' % (cls.__name__, name))
+        return fields
+
+    @classmethod
+    def _list_design(cls, fields):
+        return '_design/' + '-'.join((cls.TYPE, 'list') + fields)
+
+    @classmethod
+    def sync_indexes(cls, db):
+        '''
+        create or update the views of the indexes of this class, named
+        by_<index> in the design document named after the class, and
+        remove the ones of indexes no longer declared, when setting up,
+        as sync_list: find_by only reads them
+        '''
+        db = cls._database(db)
+        views = dict(('by_' + index, INDEX_MAP % (json.dumps(cls.TYPE), json.dumps(path)))
+                     for index, path in cls._indexes.items())
+        _sync_views(db, '_design/' + cls.TYPE, views, obsolete='by_')
+
+    @classmethod
+    def find_by(cls, db, index, keys, stale=False):
+        '''
+        documents with one of keys in the index, each once, in the order
+        of the keys; FIND_BATCH_SIZE keys are sent with each request. With
+        stale=True the index is read as it is, not waiting for the latest
+        writes to be indexed; 'update_after' also updates it afterwards.
+        The views are written by sync_indexes, which must be called first;
+        until then couchdbkit.ResourceNotFound is raised
+        '''
+        db = cls._database(db)
+        if index not in cls._indexes:
+            raise TypeError('%s has no index %r' % (cls.__name__, index))
+        params = {'include_docs': True}
+        if stale:
+            params['stale'] = 'ok' if stale is True else stale
+        keys = list(keys)
+        documents, found = [], set()
+        for start in xrange(0, len(keys), FIND_BATCH_SIZE):
+            rows = db.view('%s/by_%s' % (cls.TYPE, index),
+                           keys=keys[start:start + FIND_BATCH_SIZE], **params).all()
+            for row in rows:
+                if row.get('doc') is not None and row['id'] not in found:
+                    found.add(row['id'])
+                    documents.append(cls.from_python(row['doc']))
+        return documents
+
+    @classmethod
+    def aget(cls, db, doc_id, controls=True):
+        '''
+        get, in a thread of the executor: returns an
+        isis.utils.executor.Future of the document. The request is still
+        a blocking couchdbkit one, made by that thread instead of the
+        caller; handing it over costs more than it saves unless the
+        caller has other work, or other requests, to do meanwhile
+        '''
+        return cls._submit(cls.get, db, doc_id, controls)
+
+    def asave(self, db):
+        '''
+        save, in a thread of the executor: returns an
+        isis.utils.executor.Future, done when the document is saved
+        '''
+        return self._submit(self.save, db)
+
+    @classmethod
+    def asave_many(cls, db, documents):
+        '''
+        save_many, in a thread of the executor: returns an
+        isis.utils.executor.Future of the list of RecordErrors
+        '''
+        return cls._submit(cls.save_many, db, list(documents))
+
+    @classmethod
+    def aiter_view(cls, db, view, page_size=LIST_PAGE_SIZE, **params):
+        '''
+        the rows of view, read a page at a time: each page is requested
+        from a thread of the executor as soon as the previous one arrives,
+        while its rows are used. Only that one page is read ahead, and
+        the iteration itself blocks, like iterating over list, until the
+        page it needs has arrived
+        '''
+        def read_page(start):
+            page_params = dict(params, limit=page_size + 1)
+            if start is not None:
+                page_params['startkey'], page_params['startkey_docid'] = start
+            return cls._database(db).view(view, **page_params).all()
+
+        page = cls._submit(read_page, None)
+        while page is not None:
+            rows = page.result()
+            page = None
+            if len(rows) > page_size:
+                last = rows[page_size]
+                page = cls._submit(read_page, (last['key'], last['id']))
+            for row in rows[:page_size]:
+                yield row
+
+    @classmethod
+    def _submit(cls, function, *args):
+        executor = cls.executor
+        if executor is None: # the one shared by all classes
+            with _executor_lock:
+                if CouchdbDocument.executor is None:
+                    workers = cls.pool.max_connections if cls.pool is not None else EXECUTOR_WORKERS
+                    CouchdbDocument.executor = Executor(max_workers=workers)
+                executor = CouchdbDocument.executor
+        return executor.submit(function, *args)
+
+    @staticmethod
+    def _list_rows(db, view, fields, page_size, start_key):
+        while True:
+            params = {'limit': page_size + 1}
+            if start_key is not None:
+                params['startkey'] = start_key
+            rows = db.view(view, **params).all()
+            for row in rows[:page_size]:
+                item = dict(zip(fields, row['value']))
+                item['_id'] = row['id']
+                yield item
+            if len(rows) <= page_size:
+                return
+            start_key = rows[page_size]['key']
+
+    @classmethod
+    def _cached_doc(cls, db, doc_id):
+        '''
+        the cached doc_id, revalidated with a HEAD request if it is older
+        than the cache ttl; None if it is not cached or has changed
+        '''
+        key = (db.uri, doc_id)
+        cached = cls.cache.get(key)
+        if cached is None:
+            return None
+        (rev, doc_json), fresh = cached
+        if not fresh:
+            try:
+                etag = db.res.head(resource.escape_docid(doc_id))['etag']
+            except couchdbkit.ResourceNotFound:
+                etag = None
+            if etag is None or etag.strip('"') != rev:
+                cls.cache.pop(key)
+                return None
+            cls.cache.touch(key)
+        return json.loads(doc_json)
+
+    def _cache_doc(self, db, doc, complete=True):
+        '''
+        keep doc, as just written, in the cache; it is dropped instead if
+        it is not complete, as when files were uploaded after it, or was
+        written with inline attachments, as CouchDB keeps only stubs
+        '''
+        if self.cache is None:
+            return
+        key = (db.uri, doc['_id'])
+        if not complete or any('data' in attachment for attachment in doc.get('_attachments', {}).values()):
+            self.cache.pop(key)
+        else:
+            self.cache.set(key, (doc['_rev'], json.dumps(doc)))
 
     @classmethod
     def get_schema(cls, controls=True):
-        schema = super(CouchdbDocument, cls).get_schema()
+        return super(CouchdbDocument, cls).get_schema(controls=controls)
+
+    @classmethod
+    def clone_schema(cls, controls=True):
+        return super(CouchdbDocument, cls).clone_schema(controls=controls)
+
+    @classmethod
+    def _build_schema(cls, controls=True):
+        schema = super(CouchdbDocument, cls)._build_schema()
 
         if controls:
             rev_definition = colander.SchemaNode(colander.String(),
@@ -149,3 +665,169 @@ class CouchdbDocument(Document):
             schema.add(id_definition)
 
         return schema
+
+
+class Change(object):
+    '''
+    a row of the _changes feed: its sequence, the id and revision of the
+    document and whether it was deleted; document is the document decoded
+    into the class named by its TYPE, None when it was deleted or has no
+    such class, and error the exception raised decoding it, if any
+    '''
+    __slots__ = ('seq', 'id', 'rev', 'deleted', 'document', 'error')
+
+    def __init__(self, seq, id, rev, deleted=False, document=None, error=None):
+        self.seq = seq
+        self.id = id
+        self.rev = rev
+        self.deleted = deleted
+        self.document = document
+        self.error = error
+
+    def __repr__(self):
+        return '%s(seq=%r, id=%r, rev=%r, deleted=%r)' % (
+            self.__class__.__name__, self.seq, self.id, self.rev, self.deleted)
+
+
+class FileSequenceStore(object):
+    '''
+    the last sequence handled by a ChangesConsumer, kept in a file so that
+    a new process resumes the feed where the last one stopped
+    '''
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        try:
+            with open(self.path) as fp:
+                return json.load(fp)
+        except IOError:
+            return 0
+
+    def save(self, seq):
+        # write a new file and rename it, never leaving a partial one
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as fp:
+            json.dump(seq, fp)
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.rename(temp_path, self.path)
+
+
+class ChangesConsumer(object):
+    '''
+    reads the _changes feed of db from since on, or from the sequence
+    saved in store, and calls each handler with lists of up to batch_size
+    Change objects, in the order of the feed. The sequence of a batch is
+    saved only after all handlers return: a batch a handler failed on is
+    read again by the next consumer. feed is 'longpoll', one request for
+    each batch, or 'continuous', a request kept open, the changes received
+    given to the handlers at each heartbeat (milliseconds) if not before.
+    classes are the CouchdbDocument subclasses to decode, by default all;
+    db may name a database of CouchdbDocument.pool, opened by each thread
+    the consumer runs in.
+    '''
+    def __init__(self, db, handlers, store=None, since=0, classes=None,
+                 feed='longpoll', batch_size=CHANGES_BATCH_SIZE,
+                 heartbeat=CHANGES_HEARTBEAT, timeout=CHANGES_TIMEOUT):
+        if feed not in ('longpoll', 'continuous'):
+            raise ValueError('unknown feed %r' % feed)
+        self.db = db
+        self.handlers = list(handlers)
+        self.store = store
+        self.since = store.load() if store is not None else since
+        if classes is None:
+            self.types = _document_types
+        else:
+            self.types = dict((cls.TYPE, cls) for cls in classes)
+        self.feed = feed
+        self.batch_size = batch_size
+        self.heartbeat = heartbeat
+        self.timeout = timeout
+        self._stopped = threading.Event()
+
+    def poll(self, wait=True):
+        '''
+        handle the next batch of changes, waiting up to timeout for one
+        unless wait is False; returns the number of changes handled
+        '''
+        params = {'since': self.since, 'include_docs': True,
+                  'limit': self.batch_size}
+        if wait:
+            params.update(feed='longpoll', timeout=self.timeout)
+        result = CouchdbDocument._database(self.db).res.get('_changes', **params).json_body
+        changes = [self._change(row) for row in result['results']]
+        if changes:
+            self._dispatch(changes)
+        return len(changes)
+
+    def run(self):
+        '''
+        handle changes as they come, until stop is called; a continuous
+        feed ended by CouchDB after timeout is requested again
+        '''
+        self._stopped.clear()
+        while not self._stopped.is_set():
+            if self.feed == 'continuous':
+                self._stream()
+            else:
+                self.poll()
+
+    def stop(self):
+        '''
+        make run return after the batch being read, at the latest after
+        the next heartbeat or the timeout of the feed
+        '''
+        self._stopped.set()
+
+    def _stream(self):
+        db = CouchdbDocument._database(self.db)
+        response = db.res.get('_changes', feed='continuous', since=self.since,
+                              include_docs=True, heartbeat=self.heartbeat,
+                              timeout=self.timeout)
+        changes, ended = [], False
+        body = response.body_stream()
+        try:
+            while not self._stopped.is_set():
+                line = body.readline()
+                if not line:
+                    ended = True
+                    break
+                line = line.strip()
+                if line:
+                    row = json.loads(line)
+                    if 'last_seq' in row:
+                        ended = True
+                        break
+                    changes.append(self._change(row))
+                if changes and (not line or len(changes) >= self.batch_size):
+                    self._dispatch(changes)
+                    changes = []
+        finally:
+            if ended:
+                body.close()
+            else: # closing the body would read the feed until its timeout
+                response.close()
+        if changes:
+            self._dispatch(changes)
+
+    def _change(self, row):
+        change = Change(row['seq'], row['id'], row['changes'][0]['rev'],
+                        row.get('deleted', False))
+        doc = row.get('doc')
+        cls = self.types.get(doc.get('TYPE')) if doc and not change.deleted else None
+        if cls is not None:
+            try:
+                change.document = cls.from_python(doc)
+            except (KeyboardInterrupt, SystemExit):
+                raise
+            except BaseException, error: # validators may raise anything
+                change.error = error
+        return change
+
+    def _dispatch(self, changes):
+        for handler in self.handlers:
+            handler(changes)
+        self.since = changes[-1].seq
+        if self.store is not None:
+            self.store.save(self.since)
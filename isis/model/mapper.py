@@ -18,40 +18,171 @@
 # You should have received a copy of the GNU Lesser General Public License
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 
-from .ordered import OrderedProperty, OrderedModel
+from .ordered import OrderedProperty, OrderedModel, OrderedMeta
 from .subfield import CompositeString, CompositeField
+from collections import OrderedDict
+import base64
+import copy
 import json
+import shutil
+import tempfile
+import threading
+import time
 import colander
 import deform
 import hashlib
 
+_schemas = {} # get_schema results by (class, Meta.hide, options)
+_converters = {} # from_python_many converters by class
+_validators = {} # compiled validate functions by class
+
+CHUNK_SIZE = 64 * 1024 # bytes copied at a time from uploads
+SPOOL_SIZE = 1024 * 1024 # uploads larger than this are kept on disk
+
+# Meta.validation values: run the validators and check the choices when
+# a value is assigned (the default), or only when validate is called
+VALIDATION_MODES = ('assign', 'validate')
+
+class DocumentMeta(OrderedMeta):
+    ''' tells the properties of each class whether their validators are
+        deferred to validate, as chosen by Meta.validation, and timed, as
+        chosen by Meta.time_validators, and collects the paths to the keys
+        of the indexes they declare '''
+    def __init__(cls, name, bases, dict):
+        super(DocumentMeta, cls).__init__(name, bases, dict)
+        deferred = cls.validation_mode() == 'validate'
+        timed = getattr(getattr(cls, 'Meta', None), 'time_validators', False)
+        cls._indexes = OrderedDict()
+        for prop in cls._ordered_props:
+            prop.deferred = deferred
+            if isinstance(prop, CheckedProperty):
+                if timed:
+                    prop.check = prop._build_check(timed=True)
+                cls._indexes.update(prop.index_paths())
+
 class Document(OrderedModel):
+    __metaclass__ = DocumentMeta
+    __slots__ = ()
 
     def __init__(self, **kwargs):
         super(Document, self).__init__(**kwargs)
-        self.validate()
+        # values were validated when set, only check the required ones
+        self.check_required()
+
+    def check_required(self):
+        for name, descriptor, required, serializer in self._property_table:
+            if required and descriptor.value(self) is None:
+                raise TypeError('required %r property missing' % name)
 
     def validate(self):
-        for prop in self:
-            descriptor = self.__class__.__getattribute__(self.__class__, prop)
-            descriptor.validate(self, getattr(self, prop, None))
+        '''
+        check the required properties and, in the 'validate' mode, run
+        the validators and check the choices, which the 'assign' mode
+        did when the values were set
+        '''
+        validate = _validators.get(self.__class__)
+        if validate is None:
+            validate = _validators[self.__class__] = self._build_validator()
+        validate(self)
 
     @classmethod
-    def get_schema(cls):
-        schema = colander.SchemaNode(colander.Mapping())
-        exclude_fields = ()
+    def _build_validator(cls):
+        '''
+        function validating a document, with the properties which need
+        no check left out
+        '''
+        deferred = cls.validation_mode() == 'validate'
+        plan = tuple((name, descriptor.slot.__get__, required,
+                      descriptor.check if deferred else None)
+                     for name, descriptor, required, serializer in cls._property_table
+                     if required or (deferred and getattr(descriptor, 'check', None)))
+
+        def validate(document):
+            for name, get_value, required, check in plan:
+                try:
+                    value = get_value(document, None)
+                except AttributeError:
+                    value = None
+                if value is None:
+                    if required:
+                        raise TypeError('required %r property missing' % name)
+                elif check is not None:
+                    check(value)
+
+        return validate
 
+    @classmethod
+    def validation_mode(cls):
+        if hasattr(cls, 'Meta'):
+            if hasattr(cls.Meta, 'validation'):
+                if cls.Meta.validation not in VALIDATION_MODES:
+                    raise TypeError('validation value must be one of %r'
+                                    % (VALIDATION_MODES,))
+                return cls.Meta.validation
+        return VALIDATION_MODES[0]
+
+    @classmethod
+    def validator_stats(cls, reset=False):
+        '''
+        calls and seconds spent in the validators and choices checks of
+        each property which has them, the seconds only counted if
+        Meta.time_validators is True; reset clears the counters
+        '''
+        stats = OrderedDict()
+        for name, descriptor, required, serializer in cls._property_table:
+            if getattr(descriptor, 'check', None) is None:
+                continue
+            stats[name] = (descriptor.validator_calls, descriptor.validator_seconds)
+            if reset:
+                descriptor.validator_calls = 0
+                descriptor.validator_seconds = 0.0
+        return stats
+
+    @classmethod
+    def hidden_fields(cls):
         if hasattr(cls, 'Meta'):
             if hasattr(cls.Meta, 'hide'):
                 if not isinstance(cls.Meta.hide, tuple):
                     raise TypeError('hide value must be tuple')
-                exclude_fields = cls.Meta.hide
+                return cls.Meta.hide
+        return ()
 
-        for prop in cls:
-            if prop in exclude_fields:
+    @classmethod
+    def get_schema(cls, **options):
+        '''
+        colander schema for this class, built once and shared by all
+        callers: use clone_schema to get a copy which can be changed
+        '''
+        key = (cls, cls.hidden_fields(), tuple(sorted(options.items())))
+        schema = _schemas.get(key)
+        if schema is None:
+            schema = _schemas[key] = cls._build_schema(**options)
+        return schema
+
+    @classmethod
+    def clone_schema(cls, **options):
+        '''
+        a copy of get_schema(), with copies of the nodes and widgets,
+        which callers may change
+        '''
+        schema = cls.get_schema(**options).clone()
+        nodes = [schema]
+        while nodes:
+            node = nodes.pop()
+            if 'widget' in node.__dict__:
+                node.widget = copy.copy(node.widget)
+            nodes.extend(node.children)
+        return schema
+
+    @classmethod
+    def _build_schema(cls):
+        schema = colander.SchemaNode(colander.Mapping())
+        exclude_fields = cls.hidden_fields()
+
+        for name, descriptor, required, serializer in cls._property_table:
+            if name in exclude_fields:
                 continue
-            descriptor = cls.__getattribute__(cls, prop)
-            colander_definition = descriptor._colander_schema(cls, getattr(cls, prop, None))
+            colander_definition = descriptor._colander_schema(cls, None)
             schema.add(colander_definition)
 
         return schema
@@ -61,10 +192,11 @@ class Document(OrderedModel):
         generate a python representation for Document type classes
         '''
         properties = {}
-        for prop in self:
-            descriptor = self.__class__.__getattribute__(self.__class__, prop)
+        for name, descriptor, required, serializer in self._property_table:
+            if serializer is None:
+                continue
             try:
-                properties[prop] = descriptor._pystruct(self, getattr(self, prop))
+                properties[name] = serializer(self, descriptor.slot.__get__(self, None))
             except AttributeError:
                 pass
         if not 'TYPE' in properties:
@@ -82,6 +214,100 @@ class Document(OrderedModel):
 
         return cls(**isisdm_pystruct)
 
+    @classmethod
+    def from_python_many(cls, pystructs):
+        '''
+        generate a document for each pystruct, or a RecordError for the
+        ones which are not valid, without raising; the pystructs are
+        not changed. In the 'validate' mode each document is validated
+        '''
+        convert = _converters.get(cls)
+        if convert is None:
+            convert = _converters[cls] = cls._build_converter()
+        deferred = cls.validation_mode() == 'validate'
+        for index, pystruct in enumerate(pystructs):
+            try:
+                kwargs = convert(pystruct)
+                document = cls(**kwargs)
+                if deferred:
+                    document.validate()
+            except (KeyboardInterrupt, SystemExit):
+                raise
+            except BaseException, error: # validators may raise anything
+                yield RecordError(index, pystruct, cls._failed_property(pystruct), error)
+            else:
+                yield document
+
+    @classmethod
+    def _build_converter(cls):
+        '''
+        function converting a pystruct into keyword arguments
+        '''
+        type_name = cls.TYPE
+
+        def convert(pystruct):
+            kwargs = {}
+            for key, value in pystruct.iteritems():
+                if value is None:
+                    continue
+                if key == 'TYPE':
+                    if value != type_name:
+                        raise TypeError('%r record for a %r document' % (value, type_name))
+                    continue
+                kwargs[str(key)] = tuple(value) if isinstance(value, list) else value
+            return kwargs
+
+        return convert
+
+    @classmethod
+    def _failed_property(cls, pystruct):
+        '''
+        name of the first property of pystruct which cannot be set, or
+        is required and missing; None if the error is elsewhere
+        '''
+        try:
+            kwargs = _converters[cls](pystruct)
+        except Exception:
+            return None
+        document = cls.__new__(cls)
+        for key, value in kwargs.iteritems():
+            try:
+                setattr(document, key, value)
+            except (KeyboardInterrupt, SystemExit):
+                raise
+            except BaseException:
+                return key
+        for name, descriptor, required, serializer in cls._property_table:
+            if required and name not in kwargs:
+                return name
+            check = getattr(descriptor, 'check', None)
+            if check is not None and descriptor.deferred and name in kwargs:
+                try:
+                    check(descriptor.value(document))
+                except (KeyboardInterrupt, SystemExit):
+                    raise
+                except BaseException:
+                    return name
+        return None
+
+class RecordError(object):
+    '''
+    a pystruct which from_python_many could not convert: its position in
+    the input, the pystruct itself, the property at fault (None when it
+    is not known) and the exception raised
+    '''
+    __slots__ = ('index', 'record', 'property', 'error')
+
+    def __init__(self, index, record, property, error):
+        self.index = index
+        self.record = record
+        self.property = property
+        self.error = error
+
+    def __repr__(self):
+        return '%s(index=%r, property=%r, error=%r)' % (
+            self.__class__.__name__, self.index, self.property, self.error)
+
 class Invalid(Exception):
     ''' TODO: study colander.Invalid exception '''
     def __init__(self, message):
@@ -92,23 +318,83 @@ class Invalid(Exception):
 
 
 class CheckedProperty(OrderedProperty):
+    multiple = False # values are sequences, indexed item by item
 
-    def __init__(self, required=False, validator=None, choices=None):
+    def __init__(self, required=False, validator=None, choices=None, index=False):
         super(CheckedProperty, self).__init__()
         self.required = required
         self.validator = validator
+        self.index = index
         self.choices = choices if choices else ()
+        self.choice_keys = frozenset(item[0] for item in self.choices)
+        self.deferred = False # set by DocumentMeta
+        self.validator_calls = 0
+        self.validator_seconds = 0.0
+        self.check = self._build_check()
 
     def __set__(self, instance, value):
-        if self.validator:
-            self.validator(self, value)
+        if self.check is not None and not self.deferred:
+            self.check(value)
         super(CheckedProperty, self).__set__(instance, value)
 
     def validate(self, instance, value):
-        if self.missing(instance):
+        if self.required and value is None:
             raise TypeError('required %r property missing' % self.name)
-        if value is not None and self.validator:
-            self.validator(self, value)
+        if value is not None and self.check is not None:
+            self.check(value)
+
+    def _build_check(self, timed=False):
+        '''
+        function running the validator and checking the choices of a
+        value, and counting its calls and, if timed, its time; None if
+        there is nothing to check
+        '''
+        validator, choice_keys = self.validator, self.choice_keys
+        if validator is None and not choice_keys:
+            return None
+
+        def check(value):
+            self.validator_calls += 1
+            if choice_keys:
+                for item in value if isinstance(value, tuple) else (value,):
+                    if item not in choice_keys:
+                        raise Invalid('%r value %r is not one of the choices'
+                                      % (self.name, item))
+            if validator is not None:
+                validator(self, value)
+
+        if not timed:
+            return check
+
+        def timed_check(value):
+            started = time.time()
+            try:
+                check(value)
+            finally:
+                self.validator_seconds += time.time() - started
+
+        return timed_check
+
+    def index_paths(self):
+        '''
+        path to the keys of each index declared by this property, by index
+        name: its values if index is True, or the values of each subfield
+        named in index, as <property>_<subkey>; '*' stands for each item
+        of a sequence
+        '''
+        paths = OrderedDict()
+        path = [self.name, '*'] if self.multiple else [self.name]
+        if self.index is True:
+            paths[self.name] = path
+        elif self.index:
+            subkeys = getattr(self, 'subkeys', None)
+            if not subkeys or getattr(self, 'raw', False):
+                raise TypeError('%r has no subfields to index' % self.name)
+            for subkey in self.index:
+                if subkey not in subkeys:
+                    raise TypeError('%r has no subfield %r' % (self.name, subkey))
+                paths['%s_%s' % (self.name, subkey)] = path + [subkey]
+        return paths
 
     def missing(self, instance):
         # a property is missing if it is required and
@@ -178,6 +464,29 @@ class FileProperty(CheckedProperty):
         
         super(FileProperty, self).__set__(instance, value)
 
+    def digest(self, value):
+        '''
+        digest of the file of value, as CouchDB gives for attachments,
+        read in chunks and kept in value['digest']; None without a file
+        or when it cannot be read again, like a pipe, as it is then
+        taken for changed and uploaded
+        '''
+        fp = value.get('fp')
+        if fp is None or not hasattr(fp, 'tell') or not hasattr(fp, 'seek'):
+            return None
+        if 'digest' not in value:
+            try:
+                position = fp.tell()
+                fp.seek(0)
+            except IOError: # not seekable
+                return None
+            md5 = hashlib.md5()
+            for chunk in iter(lambda: fp.read(CHUNK_SIZE), ''):
+                md5.update(chunk)
+            fp.seek(position)
+            value['digest'] = 'md5-' + base64.b64encode(md5.digest())
+        return value['digest']
+
     def _pystruct(self, instance, value):
         '''
         python representation for this property
@@ -190,34 +499,85 @@ class FileProperty(CheckedProperty):
         return value
 
     def _colander_schema(self, instance, value):
-        class MemoryTmpStore(dict):
-
-            def __getitem__(self, name):                
-                return self.get(name)
-            
-            def get(self, name):
-                item = super(MemoryTmpStore,self).get(name)
-                
-                if item is not None and item['fp'] is not None:
-                    if not item['fp'].read(100):
-                        item['fp'] = None
-                    else:
-                        item['fp'].seek(0)
-
-                return item
-
-            def preview_url(self, name):
-                return None
-        tmpstore = MemoryTmpStore()
-
-        kwargs = {'widget':deform.widget.FileUploadWidget(tmpstore),
+        kwargs = {'widget':deform.widget.FileUploadWidget(SpoolingTmpStore()),
                   'name':self.name}
         if not self.required:
             kwargs.update({'missing':None})
 
         return colander.SchemaNode(deform.FileData(), **kwargs)
 
+class MemoryTmpStore(OrderedDict):
+    '''
+    temporary store for the uploads of a FileUploadWidget; schemas are
+    cached, so one store serves every thread, with a lock, and only the
+    `max_items` most recent uploads are kept
+    '''
+    def __init__(self, max_items=100):
+        super(MemoryTmpStore, self).__init__()
+        self.max_items = max_items
+        self.lock = threading.RLock()
+
+    def __getitem__(self, name):
+        return self.get(name)
+
+    def __setitem__(self, name, value):
+        with self.lock:
+            super(MemoryTmpStore, self).__setitem__(name, value)
+            while len(self) > self.max_items:
+                del self[next(iter(self))] # the oldest upload
+
+    def __delitem__(self, name):
+        with self.lock:
+            super(MemoryTmpStore, self).__delitem__(name)
+
+    def get(self, name, default=None):
+        with self.lock:
+            item = super(MemoryTmpStore, self).get(name, default)
+
+            if item is not None and item['fp'] is not None:
+                if not item['fp'].read(100):
+                    item['fp'] = None
+                else:
+                    item['fp'].seek(0)
+
+            return item
+
+    def preview_url(self, name):
+        return None
+
+class SpoolingTmpStore(MemoryTmpStore):
+    '''
+    MemoryTmpStore which copies each upload, in chunks, to a temporary
+    file kept in memory up to `spool_size` bytes and on disk after that;
+    the files are rewound when read. A dropped file is not closed, as a
+    request may still be reading it, but removed once it is not used
+    '''
+    def __init__(self, max_items=100, spool_size=SPOOL_SIZE):
+        super(SpoolingTmpStore, self).__init__(max_items)
+        self.spool_size = spool_size
+
+    def __setitem__(self, name, value):
+        fp = value.get('fp')
+        if fp is not None and not isinstance(fp, tempfile.SpooledTemporaryFile):
+            spooled = tempfile.SpooledTemporaryFile(max_size=self.spool_size)
+            shutil.copyfileobj(fp, spooled, CHUNK_SIZE)
+            if spooled.tell():
+                spooled.seek(0)
+            else: # an empty upload
+                spooled.close()
+                spooled = None
+            value = dict(value, fp=spooled)
+        super(SpoolingTmpStore, self).__setitem__(name, value)
+
+    def get(self, name, default=None):
+        with self.lock:
+            item = OrderedDict.get(self, name, default)
+            if item is not None and item.get('fp') is not None:
+                item['fp'].seek(0)
+            return item
+
 class MultiTextProperty(CheckedProperty):
+    multiple = True
 
     def __set__(self, instance, value):
         if not isinstance(value, tuple):
@@ -243,9 +603,10 @@ class MultiTextProperty(CheckedProperty):
 
 class IsisCompositeTextProperty(CheckedProperty):
 
-    def __init__(self, subkeys=None, **kwargs):
+    def __init__(self, subkeys=None, raw=False, **kwargs):
         super(IsisCompositeTextProperty, self).__init__(**kwargs)
         self.subkeys = subkeys
+        self.raw = raw
 
     def __set__(self, instance, value):
         if not isinstance(value, basestring):
@@ -256,11 +617,16 @@ class IsisCompositeTextProperty(CheckedProperty):
 
     def _pystruct(self, instance, value):
         '''
-        python representation for this property
+        python representation for this property: the raw field,
+        without expanding its subfields, if raw is set
         '''
+        if self.raw:
+            return unicode(value)
         return value.items()
 
     def _colander_schema(self, instance, value):
+        if self.raw:
+            return colander.SchemaNode(colander.String(), name=self.name)
         subfield = colander.SchemaNode(colander.Tuple())
         subfield.add(colander.SchemaNode(colander.String(), name='subkey'))
         subfield.add(colander.SchemaNode(colander.String(), name='value'))
@@ -309,10 +675,12 @@ class CompositeTextProperty(CheckedProperty):
         return subfield
 
 class MultiIsisCompositeTextProperty(CheckedProperty):
+    multiple = True
 
-    def __init__(self, subkeys=None, **kwargs):
+    def __init__(self, subkeys=None, raw=False, **kwargs):
         super(MultiIsisCompositeTextProperty, self).__init__(**kwargs)
         self.subkeys = subkeys
+        self.raw = raw
 
     def __set__(self, instance, value):
         if not isinstance(value, tuple):
@@ -323,11 +691,18 @@ class MultiIsisCompositeTextProperty(CheckedProperty):
 
     def _pystruct(self, instance, value):
         '''
-        python representation for this property
+        python representation for this property: the raw fields,
+        without expanding their subfields, if raw is set
         '''
+        if self.raw:
+            return tuple(unicode(composite_text) for composite_text in value)
         return tuple(composite_text.items() for composite_text in value)
 
     def _colander_schema(self, instance, value):
+        if self.raw:
+            schema = colander.SchemaNode(colander.Sequence(), name=self.name)
+            schema.add(colander.SchemaNode(colander.String(), name=self.name))
+            return schema
         schema = colander.SchemaNode(colander.Tuple())
         for subkey in self.subkeys:
             schema.add(colander.SchemaNode(colander.String(), name=subkey))
@@ -337,6 +712,7 @@ class MultiIsisCompositeTextProperty(CheckedProperty):
                                    name=self.name)
 
 class MultiCompositeTextProperty(CheckedProperty):
+    multiple = True
 
     def __init__(self, subkeys, **kwargs):
         super(MultiCompositeTextProperty, self).__init__(**kwargs)
@@ -20,6 +20,8 @@
 
 from operator import attrgetter
 
+SLOT_PREFIX = '_slot_' # property values are kept in slots named _slot_<name>
+
 class OrderedProperty(object):
     __count = 0
 
@@ -29,17 +31,34 @@ class OrderedProperty(object):
 
     def __get__(self, instance, cls):
         try:
-            return instance._prop_values[self.name]
-        except KeyError:
-            raise AttributeError("'%s' object has no attribute '%s'" % (instance.__class__.__name__, self.name))
+            if instance is None:
+                raise AttributeError
+            return self.slot.__get__(instance, cls)
+        except AttributeError:
+            raise AttributeError("'%s' object has no attribute '%s'" % (cls.__name__, self.name))
 
     def __set__(self, instance, value):
-        instance._prop_values[self.name] = value
+        self.slot.__set__(instance, value)
+
+    def value(self, instance, default=None):
+        ''' the value of this property in instance, or default if unset '''
+        try:
+            return self.slot.__get__(instance, None)
+        except AttributeError:
+            return default
 
     def __repr__(self):
         return '<%s %s>' % (self.__class__.__name__, self.name)
 
 class OrderedMeta(type):
+    ''' Keeps the declaration order of the properties and stores their
+        values in generated slots. Instances keep a __dict__ for other
+        attributes, like fields not declared as properties, unless the
+        class and all its bases declare __slots__: then only the slots
+        declared are left, which saves memory when many documents are
+        loaded. Instances can always be weakly referenced. A class may
+        derive from only one class with properties, as Python cannot
+        combine the slots of many '''
     def __new__(cls, name, bases, dict):
         if 'TYPE' in dict:
             raise TypeError('TYPE is a reserved identifier.')
@@ -50,7 +69,37 @@ class OrderedMeta(type):
                 attr.name = key
                 props.append(attr)
         dict['_ordered_props'] = sorted(props, key=attrgetter('order'))
-        return type.__new__(cls, name, bases, dict)
+        # (name, descriptor, required, serializer) for each property, so
+        # validation and serialization need no per-instance lookups
+        dict['_property_table'] = tuple(
+            (prop.name, prop, getattr(prop, 'required', False),
+             getattr(prop, '_pystruct', None))
+            for prop in dict['_ordered_props'])
+        if '__slots__' not in dict:
+            slots = ('__dict__',)
+        elif isinstance(dict['__slots__'], basestring):
+            slots = (dict['__slots__'],)
+        else:
+            slots = tuple(dict['__slots__'])
+        if any(base.__dictoffset__ for base in bases):
+            slots = tuple(slot for slot in slots if slot != '__dict__')
+        if '__weakref__' not in slots and not any(base.__weakrefoffset__ for base in bases):
+            slots += ('__weakref__',)
+        dict['__slots__'] = slots + tuple(SLOT_PREFIX + prop.name
+                                          for prop in dict['_ordered_props'])
+        try:
+            new_class = type.__new__(cls, name, bases, dict)
+        except TypeError, error:
+            if 'lay-out conflict' not in str(error):
+                raise
+            # each base keeps its property values in slots of its own
+            raise TypeError('%s cannot derive from more than one of %s, whose '
+                            'properties are kept in slots: derive from one and '
+                            'declare the properties of the others'
+                            % (name, ', '.join(base.__name__ for base in bases)))
+        for prop in props:
+            prop.slot = getattr(new_class, SLOT_PREFIX + prop.name)
+        return new_class
 
     def __iter__(self):
         return (prop.name for prop in self._ordered_props)
@@ -60,9 +109,9 @@ class OrderedMeta(type):
 
 class OrderedModel(object):
     __metaclass__ = OrderedMeta
+    __slots__ = () # subclasses choose their layout
 
     def __init__(self, **kwargs):
-        self._prop_values = {}
         for k in kwargs:
             setattr(self, k, kwargs[k])
 
@@ -73,6 +122,26 @@ class OrderedModel(object):
         return ((key, getattr(self, key))
                 for key in self.__class__)
 
+    def __getstate__(self):
+        ''' the values set in the slots, and in __dict__ if there is one,
+            for pickle, which only saves a __dict__ by itself '''
+        state = {}
+        for cls in type(self).__mro__:
+            slots = cls.__dict__.get('__slots__', ())
+            for name in (slots,) if isinstance(slots, basestring) else slots:
+                if name in ('__dict__', '__weakref__'):
+                    continue
+                try:
+                    state[name] = getattr(self, name)
+                except AttributeError:
+                    pass
+        state.update(getattr(self, '__dict__', {}))
+        return state
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            object.__setattr__(self, name, value)
+
 
 if __name__=='__main__':
     import doctest
@@ -19,13 +19,36 @@
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 
 from collections import namedtuple
-import re
+import string
+
+from isis.utils.cache import LRUCache
 
 
 MAIN_SUBFIELD_KEY = '_'
-SUBFIELD_MARKER_RE = re.compile(r'\^([a-z0-9])', re.IGNORECASE)
+SUBFIELD_DELIMITER = '^'
+DEFAULT_SUBKEYS = string.ascii_lowercase + string.digits
+PARSER_CACHE_SIZE = 128 # distinct subkeys sets kept by subfield_parser
 DEFAULT_ENCODING = u'utf-8'
 
+_parsers = LRUCache(max_items=PARSER_CACHE_SIZE, ttl=None)
+
+def subfield_parser(subkeys=None):
+    ''' Return the set of characters which start a subfield after the
+        delimiter, for the given subkeys; up to PARSER_CACHE_SIZE sets
+        are cached, the least recently used being dropped first
+
+        >>> sorted(subfield_parser('fl'))
+        ['F', 'L', 'f', 'l']
+
+    '''
+    cached = _parsers.get(subkeys)
+    if cached is not None:
+        return cached[0]
+    keys = DEFAULT_SUBKEYS if subkeys is None else subkeys
+    parser = frozenset(keys.lower() + keys.upper())
+    _parsers.set(subkeys, parser)
+    return parser
+
 def expand(content, subkeys=None):
     ''' Parse a field into an association list of keys and subfields
 
@@ -33,29 +56,30 @@ def expand(content, subkeys=None):
         [('_', 'zero'), ('1', 'one'), ('2', 'two'), ('3', 'three')]
 
     '''
-    if subkeys is None:
-        regex = SUBFIELD_MARKER_RE
-    elif subkeys == '':
+    if subkeys == '':
         return [(MAIN_SUBFIELD_KEY, content)]
-    else:
-        regex = re.compile(r'\^(['+subkeys+'])', re.IGNORECASE)
-    content = content.replace('^^', '^^ ')
+    if SUBFIELD_DELIMITER not in content:
+        return [(MAIN_SUBFIELD_KEY, content.rstrip())]
+    keys = subfield_parser(subkeys)
+    chunks = content.replace('^^', '^^ ').split(SUBFIELD_DELIMITER)
     parts = []
-    start = 0
     key = MAIN_SUBFIELD_KEY
-    while True:
-        found = regex.search(content, start)
-        if found is None: break
-        parts.append((key, content[start:found.start()].rstrip()))
-        key = found.group(1).lower()
-        start = found.end()
-    parts.append((key, content[start:].rstrip()))
+    value = chunks[0]
+    for chunk in chunks[1:]:
+        if chunk[:1] in keys:
+            parts.append((key, value.rstrip()))
+            key = chunk[0].lower()
+            value = chunk[1:]
+        else: # not a subfield marker, keep the delimiter in the value
+            value = value + SUBFIELD_DELIMITER + chunk
+    parts.append((key, value.rstrip()))
     return parts
 
 
 class CompositeString(object):
     ''' Represent an Isis field, with subfields, using
-    Python native datastructures
+    Python native datastructures; subfields are only expanded
+    when first accessed
 
     >>> author = CompositeString('John Tenniel^xillustrator',
     ... subkeys='x')
@@ -67,21 +91,44 @@ class CompositeString(object):
         if not isinstance(isis_raw, basestring):
             raise TypeError('%r value must be unicode or str instance' % isis_raw)
 
-        self.__isis_raw = isis_raw.decode(encoding)
-        self.__expanded = expand(self.__isis_raw, subkeys)
+        if isinstance(isis_raw, str):
+            isis_raw = isis_raw.decode(encoding)
+        self.__isis_raw = isis_raw
+        self.__subkeys = subkeys
+        self.__expanded = None
+        self.__index = None
+
+    @property
+    def expanded(self):
+        ''' True if the subfields were already parsed '''
+        return self.__expanded is not None
+
+    def __expand(self):
+        self.__expanded = expand(self.__isis_raw, self.__subkeys)
+        return self.__expanded
 
     def __getitem__(self, key):
-        for subfield in self.__expanded:
-            if subfield[0] == key:
-                return subfield[1]
-        else:
-            raise KeyError(key)
+        ''' first occurrence of a subfield '''
+        try:
+            return self.__index[key]
+        except TypeError: # first lookup: index the first occurrences
+            self.__index = dict(reversed(self.items()))
+            return self.__index[key]
+
+    def getall(self, key):
+        ''' all occurrences of a subfield, in field order
+
+            >>> field = CompositeString('Paris^c1900^cFrance', subkeys='c')
+            >>> field['c'], field.getall('c'), field.getall('x')
+            (u'1900', [u'1900', u'France'], [])
+        '''
+        return [value for subkey, value in self.items() if subkey == key]
 
     def __iter__(self):
-        return (subfield[0] for subfield in self.__expanded)
+        return (subfield[0] for subfield in self.items())
 
     def items(self):
-        return self.__expanded
+        return self.__expanded or self.__expand()
 
     def __unicode__(self):
         return self.__isis_raw
@@ -117,9 +164,22 @@ class CompositeField(object):
                 raise TypeError('Unexpected keyword %r' % key)
     
         self.value = tuple([(key, value_as_dict.get(key,None)) for key in subkeys])
+        self.__index = self.__indexed = None
 
     def __getitem__(self, key):
-        return dict(self.value)[key]
+        if self.__indexed is self.value:
+            return self.__index[key]
+        self.__index = dict(self.value) # first access, or value replaced
+        self.__indexed = self.value
+        return self.__index[key]
+
+    def getall(self, key):
+        ''' all occurrences of a subfield: keys are unique in a
+            CompositeField, so the list has at most one item '''
+        try:
+            return [self[key]]
+        except KeyError:
+            return []
 
     def __repr__(self):
         return "CompositeField(%s)" % str(self.items())
@@ -33,8 +33,13 @@ Instantiating a Book object::
     ...               pages='777',)
     ...
 
+New documents get ids from a counter, prefixed by a random node id for
+each process, so they do not collide::
+
     >>> len(book1._id)
-    5
+    8
+    >>> Book(title='Le Ton beau de Marot')._id[:4] == book1._id[:4]
+    True
 
     >>> for key in sorted(book1.to_python()): print key, book1.to_python()[key] #doctest: +ELLIPSIS
     TYPE Book
@@ -61,6 +66,436 @@ Instantiating a Book object::
     >>> ' '.join('%s:%s' % (c.name, type(c.typ).__name__) for c in book_schema.children)
     'title:String authors:Sequence cover:FileData _rev:String _id:String'
 
+Schemas with and without the _id and _rev controls are cached separately::
+
+    >>> BookWithAttachment.get_schema() is BookWithAttachment.get_schema(controls=True)
+    True
+    >>> no_controls = BookWithAttachment.get_schema(controls=False)
+    >>> ' '.join(c.name for c in no_controls.children)
+    'title authors cover'
+    >>> no_controls is BookWithAttachment.get_schema(controls=False)
+    True
+    >>> ' '.join(c.name for c in BookWithAttachment.clone_schema(controls=False).children)
+    'title authors cover'
+
+
+Saving many documents at once, here in a fake CouchDB server: one request
+reads the current revisions and another writes all the documents::
+
+    >>> import os, sys
+    >>> tests_dir = os.path.dirname(os.path.abspath(__file__))
+    >>> sys.path.insert(0, os.path.join(tests_dir, '..', '..', '..', 'tools'))
+    >>> from fakecouch import FakeCouchServer
+    >>> server = FakeCouchServer()
+    >>> server.databases['save_many'] = {}
+    >>> fake_db = couchdbkit.Database(server.url + '/save_many')
+    >>> books = [Book(title=u'Book %d' % i, pages=str(i)) for i in range(5)]
+    >>> Book.save_many(fake_db, books)
+    []
+    >>> [(method, path.split('?')[0]) for method, path in server.requests]
+    [('POST', '/save_many/_all_docs'), ('POST', '/save_many/_bulk_docs')]
+    >>> all(book._rev.startswith('1-') for book in books)
+    True
+
+Documents changed since they were read are not saved, and new documents
+whose _id is taken, in the database or in the same batch, get another::
+
+    >>> stale = Book.get(fake_db, books[0]._id)
+    >>> books[0].title = u'Book zero'
+    >>> stale.title = u'Book 0, revised'
+    >>> taken = Book(_id=books[1]._id, title=u'Book 1, again')
+    >>> twins = [Book(_id=u'twins', title=u'Twin %d' % i) for i in range(2)]
+    >>> errors = Book.save_many(fake_db, [books[0], stale, taken] + twins)
+    >>> [(error.index, error.error.__class__.__name__) for error in errors]
+    [(1, 'ResourceConflict')]
+    >>> books[0]._rev.startswith('2-'), Book.get(fake_db, books[0]._id).title
+    (True, u'Book zero')
+    >>> taken._id == books[1]._id, Book.get(fake_db, books[1]._id).title
+    (False, u'Book 1')
+    >>> sorted(Book.get(fake_db, twin._id).title for twin in twins)
+    [u'Twin 0', u'Twin 1']
+
+Files are sent inline, and kept when the document is saved again::
+
+    >>> book4 = BookWithAttachment(title='Ninar songs, again',
+    ...               cover={'fp':open('test_mapper.py'),'uid':'asldkfj', 'filename':'test_mapper.py'})
+    >>> BookWithAttachment.save_many(fake_db, [book4])
+    []
+    >>> stub = server.databases['save_many'][book4._id]['_attachments']['test_mapper.py']
+    >>> stub['length'] == os.path.getsize('test_mapper.py'), stub['content_type']
+    (True, u'text/x-python')
+    >>> book5 = BookWithAttachment.get(fake_db, book4._id)
+    >>> book5.title = u'Ninar songs, revised'
+    >>> BookWithAttachment.save_many(fake_db, [book5])
+    []
+    >>> server.databases['save_many'][book4._id]['_attachments'] == {'test_mapper.py': stub}
+    True
+
+When the id of a new document is taken, save tries another one at once,
+with a new node id; a document changed since it was read is not saved::
+
+    >>> node = Book.id_generator.node
+    >>> taken = Book(_id=books[2]._id, title=u'Book 2, again')
+    >>> taken.save(fake_db)
+    >>> taken._id == books[2]._id, Book.id_generator.node == node
+    (False, False)
+    >>> stale.save(fake_db)
+    Traceback (most recent call last):
+    ...
+    ResourceConflict: Document update conflict.
+
+Files larger than INLINE_ATTACHMENT_SIZE are uploaded in chunks after the
+_bulk_docs request, with their size or, when they cannot seek, chunked
+transfer encoding; open_attachment streams them back::
+
+    >>> import tempfile
+    >>> from isis.model.couchdb import INLINE_ATTACHMENT_SIZE
+    >>> big_file = tempfile.TemporaryFile()
+    >>> big_file.write('0123456789' * INLINE_ATTACHMENT_SIZE)
+    >>> book6 = BookWithAttachment(title='Ninar songs, complete',
+    ...               cover={'fp':big_file, 'uid':'qwerty', 'filename':'complete.txt'})
+    >>> del server.requests[:]
+    >>> BookWithAttachment.save_many(fake_db, [book6])
+    []
+    >>> [method for method, path in server.requests]
+    ['POST', 'POST', 'PUT', 'GET']
+    >>> book6._rev.startswith('2-')
+    True
+    >>> stream = book6.open_attachment(fake_db, 'cover')
+    >>> stream.read(10)
+    '0123456789'
+    >>> len(stream.read()) == 10 * INLINE_ATTACHMENT_SIZE - 10
+    True
+    >>> stream.close()
+
+    >>> import StringIO
+    >>> class Pipe(object):
+    ...     def __init__(self, data):
+    ...         self.data = StringIO.StringIO(data)
+    ...     def read(self, size=-1):
+    ...         return self.data.read(size)
+    >>> book7 = BookWithAttachment(title='Ninar songs, piped',
+    ...               cover={'fp':Pipe('piped ' * 1000), 'uid':'asdfgh', 'filename':'piped.txt'})
+    >>> book7.save(fake_db)
+    >>> with BookWithAttachment.get(fake_db, book7._id).open_attachment(fake_db, 'piped.txt') as stream:
+    ...     stream.read() == 'piped ' * 1000
+    True
+
+Files are compared with the digests CouchDB keeps for the attachments, and
+only uploaded again when their contents changed; saving the same file only
+writes the document::
+
+    >>> book8 = BookWithAttachment.get(fake_db, book6._id)
+    >>> book8.cover = {'fp':big_file, 'uid':'qwerty', 'filename':'complete.txt'}
+    >>> del server.requests[:]
+    >>> book8.save(fake_db)
+    >>> [method for method, path in server.requests]
+    ['GET', 'PUT']
+    >>> stub = server.databases['save_many'][book8._id]['_attachments']['complete.txt']
+    >>> book8.cover['digest'] == stub['digest']
+    True
+    >>> book8.cover = {'fp':big_file, 'uid':'qwerty', 'filename':'complete.txt'}
+    >>> del server.requests[:]
+    >>> BookWithAttachment.save_many(fake_db, [book8])
+    []
+    >>> [method for method, path in server.requests]
+    ['POST', 'POST']
+    >>> book8.cover = {'fp':StringIO.StringIO('changed'), 'uid':'qwerty', 'filename':'complete.txt'}
+    >>> del server.requests[:]
+    >>> book8.save(fake_db)
+    >>> [method for method, path in server.requests]
+    ['GET', 'PUT', 'PUT', 'GET']
+    >>> server.databases['save_many'][book8._id]['_attachments']['complete.txt']['length']
+    7
+
+A file which cannot be read twice, like a pipe, has no digest and is
+always uploaded again::
+
+    >>> piped_book = BookWithAttachment.get(fake_db, book7._id)
+    >>> piped_book.cover = {'fp':Pipe('piped again'), 'uid':'asdfgh', 'filename':'piped.txt'}
+    >>> piped_book.save(fake_db)
+    >>> server.databases['save_many'][piped_book._id]['_attachments']['piped.txt']['length']
+    11
+    >>> piped_book.cover = {'fp':Pipe('piped at last'), 'uid':'asdfgh', 'filename':'piped.txt'}
+    >>> BookWithAttachment.save_many(fake_db, [piped_book])
+    []
+    >>> server.databases['save_many'][piped_book._id]['_attachments']['piped.txt']['length']
+    13
+
+Classes may keep the documents they read and write in a cache, like an
+LRUCache: get reads only the documents which are not cached, and checks
+the revision of the ones older than the cache ttl with a HEAD request::
+
+    >>> from isis.utils.cache import LRUCache
+    >>> Book.cache = LRUCache(max_items=100, ttl=60)
+    >>> del server.requests[:]
+    >>> Book.get(fake_db, books[3]._id).title
+    u'Book 3'
+    >>> Book.get(fake_db, books[3]._id).title
+    u'Book 3'
+    >>> [method for method, path in server.requests]
+    ['GET']
+    >>> books[3].title = u'Book three'
+    >>> books[3].save(fake_db)
+    >>> del server.requests[:]
+    >>> Book.get(fake_db, books[3]._id).title
+    u'Book three'
+    >>> Book.cache.ttl = 0
+    >>> Book.get(fake_db, books[3]._id)._rev == books[3]._rev
+    True
+    >>> [method for method, path in server.requests]
+    ['HEAD']
+    >>> elsewhere = dict(server.databases['save_many'][books[3]._id], title=u'Book 3, elsewhere')
+    >>> server.store(server.databases['save_many'], elsewhere)['ok']
+    True
+    >>> Book.get(fake_db, books[3]._id).title
+    u'Book 3, elsewhere'
+    >>> [method for method, path in server.requests]
+    ['HEAD', 'HEAD', 'GET']
+    >>> sorted(Book.cache.stats().items())
+    [('evictions', 0), ('hits', 4), ('invalidations', 1), ('items', 1), ('misses', 1), ('validations', 1)]
+
+A document about to be edited and saved is read with cached=False, for the
+_rev of the revision stored, which is then cached::
+
+    >>> Book.cache.ttl = 60
+    >>> elsewhere = dict(server.databases['save_many'][books[3]._id], title=u'Book 3, edited')
+    >>> server.store(server.databases['save_many'], elsewhere)['ok']
+    True
+    >>> Book.get(fake_db, books[3]._id).title
+    u'Book 3, elsewhere'
+    >>> book = Book.get(fake_db, books[3]._id, cached=False)
+    >>> book.title, book._rev == server.databases['save_many'][books[3]._id]['_rev']
+    (u'Book 3, edited', True)
+    >>> Book.get(fake_db, books[3]._id).title
+    u'Book 3, edited'
+    >>> Book.cache = None
+
+Fields stored which the class does not declare, like legacy fields or the
+_conflicts CouchDB adds, are kept as attributes of the documents read, and
+documents may be weakly referenced::
+
+    >>> legacy = dict(server.databases['save_many'][books[3]._id], extra=u'legacy',
+    ...               _conflicts=[u'1-abc'])
+    >>> server.store(server.databases['save_many'], legacy)['ok']
+    True
+    >>> book = Book.get(fake_db, books[3]._id)
+    >>> book.extra, book._conflicts
+    (u'legacy', (u'1-abc',))
+    >>> import weakref
+    >>> weakref.ref(book)() is book
+    True
+
+Listing the documents of a class reads only their _id and the fields asked
+for, a page at a time and only as the rows are used, from a view written
+when setting up, in a design document for these fields only::
+
+    >>> server.databases['list'] = {}
+    >>> list_db = couchdbkit.Database(server.url + '/list')
+    >>> Book.save_many(list_db, [Book(_id=u'book%d' % i, title=u'Book %d' % i, pages=str(i))
+    ...                          for i in range(5)])
+    []
+    >>> BookWithAttachment(_id=u'other', title=u'Not a Book').save(list_db)
+    >>> Book.list(list_db, fields=['title']).next() #doctest: +ELLIPSIS
+    Traceback (most recent call last):
+    ...
+    ResourceNotFound: ...
+    >>> del server.requests[:]
+    >>> Book.sync_list(list_db, ['title'])
+    >>> [(method, path.split('?')[0]) for method, path in server.requests]
+    [('GET', '/list/_design/Book-list-title'), ('PUT', '/list/_design/Book-list-title')]
+    >>> del server.requests[:]
+    >>> rows = Book.list(list_db, fields=['title'], page_size=2)
+    >>> sorted(next(rows).items())
+    [('_id', u'book0'), ('title', u'Book 0')]
+    >>> [row['_id'] for row in rows]
+    [u'book1', u'book2', u'book3', u'book4']
+    >>> len([path for method, path in server.requests if '/_view/' in path])
+    3
+    >>> del server.requests[:]
+    >>> [row['title'] for row in Book.list(list_db, ['title'], start_key=u'book3')]
+    [u'Book 3', u'Book 4']
+    >>> [(method, path.split('?')[0]) for method, path in server.requests]
+    [('GET', '/list/_design/Book-list-title/_view/list')]
+    >>> Book.sync_list(list_db, ['isbn'])
+    Traceback (most recent call last):
+    ...
+    TypeError: Book has no property 'isbn'
+
+Each index of a class gets a view in the same design document, and a
+find_by_<index> class method reading the documents of many keys with each
+request; the views are written by sync_indexes, when setting up, and
+only read by the queries::
+
+    >>> class Thesis(CouchdbDocument):
+    ...     title = TextProperty(required=True, index=True)
+    ...     keywords = MultiTextProperty(index=True)
+    ...     authors = MultiCompositeTextProperty(subkeys=['last', 'first'], index=['last'])
+    >>> knuth = [('last', u'Knuth'), ('first', u'Donald')]
+    >>> sedgewick = [('last', u'Sedgewick'), ('first', u'Robert')]
+    >>> Thesis.save_many(list_db, [
+    ...     Thesis(_id=u'thesis1', title=u'Sorting', keywords=(u'algorithms', u'sorting'),
+    ...            authors=(knuth,)),
+    ...     Thesis(_id=u'thesis2', title=u'Searching', keywords=(u'algorithms',),
+    ...            authors=(knuth, sedgewick))])
+    []
+    >>> Thesis.find_by_title(list_db, [u'Sorting']) #doctest: +ELLIPSIS
+    Traceback (most recent call last):
+    ...
+    ResourceNotFound: ...
+    >>> del server.requests[:]
+    >>> Thesis.sync_indexes(list_db)
+    >>> [(method, path.split('?')[0]) for method, path in server.requests]
+    [('GET', '/list/_design/Thesis'), ('PUT', '/list/_design/Thesis')]
+    >>> del server.requests[:]
+    >>> [thesis._id for thesis in Thesis.find_by_keywords(list_db, [u'sorting', u'algorithms'])]
+    [u'thesis1', u'thesis2']
+    >>> [(method, path.split('?')[0]) for method, path in server.requests]
+    [('POST', '/list/_design/Thesis/_view/by_keywords')]
+    >>> sorted(server.databases['list']['_design/Thesis']['views'])
+    [u'by_authors_last', u'by_keywords', u'by_title']
+    >>> [thesis.title for thesis in Thesis.find_by_authors_last(list_db, [u'Sedgewick'], stale=True)]
+    [u'Searching']
+    >>> sorted(server.requests[-1][1].split('?')[1].split('&'))
+    ['include_docs=true', 'stale=ok']
+    >>> from isis.model import couchdb
+    >>> couchdb.FIND_BATCH_SIZE = 2
+    >>> del server.requests[:]
+    >>> [thesis.title for thesis in Thesis.find_by_title(list_db, [u'Sorting', u'Missing', u'Searching'])]
+    [u'Sorting', u'Searching']
+    >>> len(server.requests)
+    2
+    >>> couchdb.FIND_BATCH_SIZE = 500
+    >>> Thesis.find_by(list_db, 'pages', [u'100'])
+    Traceback (most recent call last):
+    ...
+    TypeError: Thesis has no index 'pages'
+
+The views of the indexes a class no longer declares are removed::
+
+    >>> class Thesis(CouchdbDocument):
+    ...     title = TextProperty(required=True, index=True)
+    >>> Thesis.sync_indexes(list_db)
+    >>> sorted(server.databases['list']['_design/Thesis']['views'])
+    [u'by_title']
+
+With a CouchdbPool, databases are named instead, and threads share the
+connections of the pool, each with its own database handle::
+
+    >>> import threading
+    >>> from isis.utils.pool import CouchdbPool
+    >>> Book.pool = CouchdbPool(server.url, max_connections=2)
+    >>> server.connections.clear()
+    >>> read = []
+    >>> def read_books():
+    ...     for book in books[:4]:
+    ...         try:
+    ...             read.append(Book.get('save_many', book._id)._id)
+    ...         except Exception, error:
+    ...             read.append(error)
+    >>> readers = [threading.Thread(target=read_books) for i in range(4)]
+    >>> for reader in readers:
+    ...     reader.start()
+    >>> for reader in readers:
+    ...     reader.join()
+    >>> sorted(read) == sorted([book._id for book in books[:4]] * 4)
+    True
+    >>> len(server.connections) <= 2
+    True
+    >>> stats = Book.pool.stats()
+    >>> stats['in_use'], stats['created'] + stats['reused']
+    (0, 16)
+
+The a* methods return Futures instead of waiting for CouchDB, their
+requests made by the threads of an executor, one for each connection of
+the pool::
+
+    >>> futures = [Book.aget('save_many', book._id) for book in books[:4]]
+    >>> [future.result(5)._id for future in futures] == [book._id for book in books[:4]]
+    True
+    >>> Book.executor.max_workers
+    2
+    >>> Book.aget('save_many', u'missing').exception(5).__class__.__name__
+    'ResourceNotFound'
+    >>> book9 = Book(title=u'Book 9')
+    >>> book9.asave('save_many').result(5)
+    >>> Book.asave_many('save_many', [Book(title=u'Book 10'), Book(title=u'Book 11')]).result(5)
+    []
+    >>> Book.get('save_many', book9._id)._rev == book9._rev
+    True
+    >>> rows = Book.aiter_view('list', 'Book-list-title/list', page_size=2)
+    >>> [row['id'] for row in rows]
+    [u'book0', u'book1', u'book2', u'book3', u'book4']
+    >>> Book.executor.shutdown()
+    >>> Book.executor = CouchdbDocument.executor = None
+    >>> Book.aget('save_many', books[0]._id).result(5)._id == books[0]._id
+    True
+    >>> Book.executor is None, CouchdbDocument.executor.max_workers
+    (True, 2)
+    >>> CouchdbDocument.executor.shutdown()
+    >>> CouchdbDocument.executor = None
+    >>> del Book.executor
+    >>> Book.pool = None
+    >>> Book.get('save_many', books[3]._id)
+    Traceback (most recent call last):
+    ...
+    TypeError: Book has no pool to open database 'save_many'
+
+A ChangesConsumer reads the _changes feed from the last sequence handled,
+decoding the documents into their classes, and gives its handlers batches
+of changes; with a store, the sequence is kept for the next process::
+
+    >>> import os, tempfile
+    >>> from isis.model.couchdb import ChangesConsumer, FileSequenceStore
+    >>> server.databases['changes'] = {}
+    >>> changes_db = couchdbkit.Database(server.url + '/changes')
+    >>> Book.save_many(changes_db, [Book(_id=u'change%d' % i, title=u'Book %d' % i)
+    ...                             for i in range(3)])
+    []
+    >>> server.store(server.databases['changes'], {'_id': u'untyped'})['ok']
+    True
+    >>> batches = []
+    >>> seq_path = os.path.join(tempfile.mkdtemp(), 'changes.seq')
+    >>> consumer = ChangesConsumer(changes_db, [batches.append],
+    ...                            store=FileSequenceStore(seq_path), batch_size=3)
+    >>> consumer.poll(), consumer.poll(), consumer.poll(wait=False)
+    (3, 1, 0)
+    >>> [[change.id for change in batch] for batch in batches]
+    [[u'change0', u'change1', u'change2'], [u'untyped']]
+    >>> batches[0][1].document.title, batches[1][0].document
+    (u'Book 1', None)
+    >>> FileSequenceStore(seq_path).load()
+    4
+
+A continuous feed gives the handlers the changes as they are written, as
+to drop the cached documents changed elsewhere; the consumer runs until
+it is stopped::
+
+    >>> Book.cache = LRUCache(max_items=100, ttl=60)
+    >>> Book.get(changes_db, u'change0').title
+    u'Book 0'
+    >>> handled = threading.Event()
+    >>> def drop_cached(changes):
+    ...     for change in changes:
+    ...         Book.cache.pop((changes_db.uri, change.id))
+    ...     handled.set()
+    >>> consumer = ChangesConsumer(changes_db, [drop_cached], store=FileSequenceStore(seq_path),
+    ...                            feed='continuous', heartbeat=50)
+    >>> runner = threading.Thread(target=consumer.run)
+    >>> runner.start()
+    >>> elsewhere = dict(server.databases['changes'][u'change0'], title=u'Book 0, elsewhere')
+    >>> server.store(server.databases['changes'], elsewhere)['ok']
+    True
+    >>> handled.wait(5)
+    True
+    >>> consumer.stop()
+    >>> runner.join()
+    >>> Book.get(changes_db, u'change0').title
+    u'Book 0, elsewhere'
+    >>> consumer.since
+    5
+    >>> Book.cache = None
+    >>> server.stop()
 
 ----------------------------------------
 _attach_updated method tests
@@ -167,6 +167,148 @@ Manipulating its attributes::
       ...
     TypeError: 'is_published' must be bool
 
+Many documents can be built from an iterable of pystructs, getting
+RecordError objects for invalid ones instead of exceptions::
+
+    >>> records = [{'title': u'Godel, Escher, Bach', 'authors': [u'Hofstadter, Douglas']},
+    ...            {'title': u'Banana split', 'TYPE': 'Book'},
+    ...            {'authors': [u'Rose, Daiana']},
+    ...            {'title': u'Fractals', 'TYPE': 'Magazine'},
+    ...            {'title': u'Chaos', 'publisher': u'Viking'},
+    ...            {'title': u'Metamagical Themas', 'pages': None}]
+    >>> for item in Book.from_python_many(records): #doctest: +ELLIPSIS
+    ...     print item
+    ...     if isinstance(item, RecordError): print '   ', item.error
+    <...Book object at ...>
+    RecordError(index=1, property='title', error=BaseException("You can't start a text with 'Banana'",))
+        You can't start a text with 'Banana'
+    RecordError(index=2, property='title', error=TypeError("required 'title' property missing",))
+        required 'title' property missing
+    RecordError(index=3, property=None, error=TypeError("'Magazine' record for a 'Book' document",))
+        'Magazine' record for a 'Book' document
+    <...Book object at ...>
+    <...Book object at ...>
+    >>> book_copy = Book.from_python_many(records).next()
+    >>> book_copy.authors
+    (u'Hofstadter, Douglas',)
+
+Fields the class does not declare are kept as attributes, as by from_python::
+
+    >>> list(Book.from_python_many(records[4:5]))[0].publisher
+    u'Viking'
+    >>> Book.from_python({'title': u'Chaos', 'publisher': u'Viking'}).publisher
+    u'Viking'
+    >>> records[1]['TYPE']
+    'Book'
+
+Each class keeps a table with the name, descriptor, required flag and
+serializer of its properties, used by validate and to_python::
+
+    >>> for name, descriptor, required, serializer in Book._property_table:
+    ...     print name, descriptor, required, serializer.__name__
+    title <TextProperty title> True _pystruct
+    authors <MultiTextProperty authors> False _pystruct
+    pages <TextProperty pages> False _pystruct
+
+Validators run once for each value: by default when it is assigned, so
+validate only checks the required properties, or only by validate if
+Meta.validation is 'validate'. Each property counts the calls of its
+validator, and the time spent in it if Meta.time_validators is True::
+
+    >>> Book.validator_stats(reset=True).keys()
+    ['title', 'authors']
+    >>> book5 = Book(title='Metamagical Themas', authors=(u'Hofstadter, Douglas',))
+    >>> book5.validate()
+    >>> Book.validator_stats().values()
+    [(1, 0.0), (1, 0.0)]
+
+    >>> def slow_validator(node, value):
+    ...     time.sleep(0.01)
+    >>> class Timed(Document):
+    ...     title = TextProperty(validator=slow_validator)
+    ...
+    ...     class Meta:
+    ...         time_validators = True
+    >>> timed = Timed(title=u'Godel')
+    >>> calls, seconds = Timed.validator_stats()['title']
+    >>> calls, seconds >= 0.01
+    (1, True)
+
+    >>> class Report(Document):
+    ...     title = TextProperty(required=True, validator=text_validator)
+    ...     status = TextProperty(choices=[('draft', 'Draft'), ('final', 'Final')])
+    ...
+    ...     class Meta:
+    ...         validation = 'validate'
+    >>> Report.validation_mode()
+    'validate'
+    >>> report = Report(title='Banana split', status='lost')
+    >>> Report.validator_stats()['title']
+    (0, 0.0)
+    >>> report.validate()
+    Traceback (most recent call last):
+    ...
+    BaseException: You can't start a text with 'Banana'
+    >>> report.title = 'Split'
+    >>> report.validate()
+    Traceback (most recent call last):
+    ...
+    Invalid: 'status' value u'lost' is not one of the choices
+    >>> report.status = 'final'
+    >>> report.validate()
+    >>> Report.validator_stats()['title'][0]
+    3
+
+from_python_many validates the documents in the 'validate' mode, giving a
+RecordError for the invalid ones::
+
+    >>> for item in Report.from_python_many([{'title': 'Split', 'status': 'final'},
+    ...                                      {'title': 'Banana split'},
+    ...                                      {'title': 'Split', 'status': 'lost'}]): #doctest: +ELLIPSIS
+    ...     print item
+    <...Report object at ...>
+    RecordError(index=1, property='title', error=BaseException("You can't start a text with 'Banana'",))
+    RecordError(index=2, property='status', error=Invalid("'status' value u'lost' is not one of the choices"))
+
+Values out of the choices are rejected on assignment in the default mode::
+
+    >>> class Draft(Document):
+    ...     status = TextProperty(choices=[('draft', 'Draft'), ('final', 'Final')])
+    >>> Draft(status='lost')
+    Traceback (most recent call last):
+    ...
+    Invalid: 'status' value u'lost' is not one of the choices
+    >>> Draft.Meta = type('Meta', (), {'validation': 'lazy'})
+    >>> Draft.validation_mode()
+    Traceback (most recent call last):
+    ...
+    TypeError: validation value must be one of ('assign', 'validate')
+
+Properties may be indexed, by their values or, for composite properties,
+by the values of some subfields; each class keeps the path to the keys of
+each of its indexes, '*' standing for each item of a sequence::
+
+    >>> class Thesis(Document):
+    ...     title = TextProperty(required=True, index=True)
+    ...     keywords = MultiTextProperty(index=True)
+    ...     advisor = CompositeTextProperty(subkeys=['name', 'role'], index=['name'])
+    ...     authors = MultiIsisCompositeTextProperty(subkeys='fl', index='l')
+    >>> for index, path in Thesis._indexes.items(): print index, path
+    title ['title']
+    keywords ['keywords', '*']
+    advisor_name ['advisor', 'name']
+    authors_l ['authors', '*', 'l']
+    >>> class BadIndex(Document):
+    ...     editor = IsisCompositeTextProperty(subkeys='fl', raw=True, index='l')
+    Traceback (most recent call last):
+    ...
+    TypeError: 'editor' has no subfields to index
+    >>> class BadIndex(Document):
+    ...     advisor = CompositeTextProperty(subkeys=['name', 'role'], index=['email'])
+    Traceback (most recent call last):
+    ...
+    TypeError: 'advisor' has no subfield 'email'
+
 Colander Schema Generation::
 
     >>> book1.to_python() == {'authors': (u'Hofstadter, Douglas', u'Rose, Daiana'),
@@ -191,6 +333,58 @@ Hidding an attribute
     >>> ' '.join('%s:%s' % (c.name, type(c.typ).__name__) for c in book_with_meta_schema.children)
     'title:String authors:Sequence pages:String'
 
+Schemas are built once for each class and shared; clone_schema returns a
+copy which can be changed without affecting other callers::
+
+    >>> Book.get_schema() is Book.get_schema()
+    True
+    >>> book_form_schema = Book.clone_schema()
+    >>> book_form_schema is Book.get_schema()
+    False
+    >>> book_form_schema['pages'].title = 'Number of pages'
+    >>> Book.get_schema()['pages'].title
+    'Pages'
+
+Every schema for a class with a FileProperty shares the upload widget's
+temporary store, which locks its changes and keeps only the most recent
+uploads::
+
+    >>> cover_widget = BookWithAttachment.get_schema()['cover'].widget
+    >>> tmpstore = cover_widget.tmpstore
+    >>> tmpstore.max_items
+    100
+    >>> BookWithAttachment.clone_schema()['cover'].widget is cover_widget
+    False
+    >>> from isis.model.mapper import SpoolingTmpStore
+    >>> isinstance(tmpstore, SpoolingTmpStore), tmpstore.spool_size
+    (True, 1048576)
+    >>> uploads = SpoolingTmpStore(max_items=100)
+    >>> for i in range(150): uploads['upload%s' % i] = {'fp': None}
+    >>> len(uploads), 'upload49' in uploads, 'upload50' in uploads
+    (100, False, True)
+
+The store copies each upload to a temporary file, which goes to disk when
+larger than spool_size, and rewinds it whenever it is read; a file which
+is dropped stays open for the requests still reading it::
+
+    >>> import StringIO
+    >>> spooling = SpoolingTmpStore(spool_size=1000)
+    >>> spooling['small'] = {'fp': StringIO.StringIO('x' * 10), 'filename': 'small.txt'}
+    >>> spooling['large'] = {'fp': StringIO.StringIO('y' * 5000), 'filename': 'large.txt'}
+    >>> spooling['small']['fp']._rolled, spooling['large']['fp']._rolled
+    (False, True)
+    >>> spooling['large']['fp'].read(3), spooling['large']['fp'].read(3)
+    ('yyy', 'yyy')
+    >>> spooling['empty'] = {'fp': StringIO.StringIO(''), 'filename': 'empty.txt'}
+    >>> print spooling['empty']['fp']
+    None
+    >>> large = spooling['large']['fp']
+    >>> del spooling['large']
+    >>> large.closed, 'large' in spooling
+    (False, False)
+    >>> large.read(3)
+    'yyy'
+
 New CompositeText test
 
     >>> class OtherBook(Document):
@@ -209,6 +403,30 @@ New CompositeText test
     >>> other_schema.serialize({'author':{'name':'john', 'role':'writer'}}) == {'author': {'role': u'writer', 'name': u'john'}}
     True
 
+Isis composite properties with raw=True are serialized as the raw fields,
+without expanding their subfields::
+
+    >>> class RawMagazine(Document):
+    ...     title = TextProperty(required=True)
+    ...     editor = IsisCompositeTextProperty(subkeys='fl', raw=True)
+    ...     authors = MultiIsisCompositeTextProperty(subkeys='fl', raw=True)
+
+    >>> raw_magazine = RawMagazine(title='Algorithms in a nutshell',
+    ...               editor=u'^lLoukides^fMike',
+    ...               authors=(u'^lHeineman^fGeorge T.', u'^lPollice^fGary'))
+    >>> raw_magazine.to_python() == {'TYPE': 'RawMagazine',
+    ...     'title': u'Algorithms in a nutshell', 'editor': u'^lLoukides^fMike',
+    ...     'authors': (u'^lHeineman^fGeorge T.', u'^lPollice^fGary')}
+    True
+    >>> [author.expanded for author in raw_magazine.authors]
+    [False, False]
+    >>> raw_copy = RawMagazine.from_python(raw_magazine.to_python())
+    >>> raw_copy.authors[1]['l']
+    u'Pollice'
+    >>> raw_schema = RawMagazine.get_schema()
+    >>> ' '.join('%s:%s' % (c.name, type(c.typ).__name__) for c in raw_schema.children)
+    'title:String editor:String authors:Sequence'
+
 MultiCompositeTextProperty test
 
     >>> class MultiCompositeOtherBook(Document):
@@ -223,11 +441,12 @@ MultiCompositeTextProperty test
     >>> multi_other_schema.serialize({'author':({'name':'john', 'role':'writer'}, {'name':'foo', 'role':'editor'})}) == {'author': [{'role': u'writer', 'name': u'john'}, {'role': u'editor', 'name': u'foo'}]}
     True
 """
-from isis.model import Document
+from isis.model import Document, RecordError
 from isis.model import TextProperty, MultiTextProperty
 from isis.model import CompositeTextProperty, IsisCompositeTextProperty
 from isis.model import MultiCompositeTextProperty, MultiIsisCompositeTextProperty
 from isis.model import ReferenceProperty, FileProperty, BooleanProperty
+import time
 
 def test():
     import doctest
@@ -63,6 +63,75 @@ este atributo `order` para ordenar uma lista com os nomes dos campos.
     >>> bike.cor = u'preto'
     ...
 
+Os valores das propriedades ficam em `__slots__` gerados pela metaclasse;
+as instâncias também têm um `__dict__`, para outros atributos, como campos
+guardados que o modelo não declara, e aceitam referências fracas::
+
+    >>> Bicicleta.__slots__
+    ('__dict__', '_slot_rodas', '_slot_aro', '_slot_cor')
+    >>> bike.marca = 'Caloi'
+    >>> bike.marca
+    'Caloi'
+    >>> import weakref
+    >>> weakref.ref(bike)() is bike
+    True
+
+Subclasses herdam os slots das propriedades das classes base::
+
+    >>> class BicicletaEletrica(Bicicleta):
+    ...     bateria = OrderedProperty()
+    >>> eletrica = BicicletaEletrica(aro=29, bateria=u'36V')
+    >>> eletrica.aro, eletrica.bateria
+    (29, u'36V')
+    >>> eletrica.cor
+    Traceback (most recent call last):
+      ...
+    AttributeError: 'BicicletaEletrica' object has no attribute 'cor'
+
+Para economizar memória quando muitos documentos são carregados, uma classe
+cujas bases também declaram `__slots__` (como OrderedModel, Document e
+CouchdbDocument) pode declará-los: suas instâncias não têm um `__dict__`
+e só aceitam as propriedades e os atributos declarados::
+
+    >>> class Triciclo(OrderedModel):
+    ...     __slots__ = ()
+    ...     rodas = OrderedProperty()
+    >>> triciclo = Triciclo(rodas=3)
+    >>> hasattr(triciclo, '__dict__'), weakref.ref(triciclo)() is triciclo
+    (False, True)
+    >>> triciclo.marca = 'Bandeirante'
+    Traceback (most recent call last):
+      ...
+    AttributeError: 'Triciclo' object has no attribute 'marca'
+
+As instâncias podem ser serializadas com `pickle`, em qualquer protocolo,
+com os valores dos slots e do `__dict__`::
+
+    >>> import pickle, sys
+    >>> for classe in (Bicicleta, BicicletaEletrica, Triciclo):
+    ...     setattr(sys.modules[__name__], classe.__name__, classe) # pickle procura as classes no módulo
+    >>> for protocolo in range(pickle.HIGHEST_PROTOCOL + 1):
+    ...     copia = pickle.loads(pickle.dumps(eletrica, protocolo))
+    ...     print protocolo, copia.aro, copia.bateria, hasattr(copia, 'cor')
+    0 29 36V False
+    1 29 36V False
+    2 29 36V False
+    >>> copia = pickle.loads(pickle.dumps(bike))
+    >>> copia.aro, copia.marca
+    (26, 'Caloi')
+    >>> pickle.loads(pickle.dumps(triciclo, 2)).rodas
+    3
+
+Como cada classe guarda os valores das suas propriedades em slots próprios,
+uma classe não pode derivar de duas classes com propriedades; deve derivar
+de uma e declarar as propriedades da outra::
+
+    >>> class Bicicleta3(Bicicleta, Triciclo):
+    ...     pass
+    Traceback (most recent call last):
+      ...
+    TypeError: Bicicleta3 cannot derive from more than one of Bicicleta, Triciclo, whose properties are kept in slots: derive from one and declare the properties of the others
+
 """
 from isis.model.ordered import OrderedModel, OrderedProperty
 
@@ -74,6 +74,21 @@ are expanded::
     >>> expand('John Tenniel^rillustrator', subkeys='')
     [('_', 'John Tenniel^rillustrator')]
 
+The set of valid keys for each subkeys value is built once and cached,
+up to PARSER_CACHE_SIZE different values, in an isis.utils.cache.LRUCache
+keeping the ones used most recently::
+
+    >>> subfield_parser('fl') is subfield_parser('fl')
+    True
+    >>> for i in range(PARSER_CACHE_SIZE + 10):
+    ...     keys = subfield_parser(str(i)), subfield_parser('fl')
+    >>> len(subfield._parsers) == PARSER_CACHE_SIZE
+    True
+    >>> 'fl' in subfield._parsers, '0' in subfield._parsers
+    (True, False)
+    >>> expand('^Fabc^lxyz^x', subkeys='fl')
+    [('_', ''), ('f', 'abc'), ('l', 'xyz^x')]
+
 
 ---------------------
 CompositeString tests
@@ -96,9 +111,52 @@ Iteration semantics are similar to dicts::
     >>> for k, v in author.items(): print k, v
     _ John Tenniel
     r illustrator
+
+Subfields are only expanded when first needed, so fields which are only
+converted back to text are never parsed::
+
+    >>> title = CompositeString('Alice^bThrough the looking glass')
+    >>> unicode(title), title.expanded
+    (u'Alice^bThrough the looking glass', False)
+    >>> title['b'], title.expanded
+    (u'Through the looking glass', True)
+
+Lookups return the first occurrence of a repeated subfield; getall returns
+all of them, in field order::
+
+    >>> place = CompositeString('Paris^cFrance^c1900^cEurope', subkeys='c')
+    >>> place['c']
+    u'France'
+    >>> place.getall('c')
+    [u'France', u'1900', u'Europe']
+    >>> place.getall('x')
+    []
+    >>> place['x']
+    Traceback (most recent call last):
+      ...
+    KeyError: 'x'
+
+--------------------
+CompositeField tests
+--------------------
+
+    >>> author = CompositeField([('name', 'Braz, Marcelo')], subkeys=['name', 'role'])
+    >>> author['name'], author['role']
+    ('Braz, Marcelo', None)
+    >>> author.getall('name'), author.getall('email')
+    (['Braz, Marcelo'], [])
+
+Lookups follow a replaced value::
+
+    >>> author.value = (('name', 'Lima, Ana'), ('role', 'editor'))
+    >>> author['role']
+    'editor'
 """
 
-from isis.model.subfield import expand, CompositeString
+from isis.model import subfield
+from isis.model.subfield import expand, subfield_parser, CompositeString
+from isis.model.subfield import CompositeField
+from isis.model.subfield import PARSER_CACHE_SIZE
 import json
 
 def test():
@@ -1,6 +1,8 @@
 #!/usr/bin/env python
 # coding: utf-8
 
+import itertools
+import os
 import string
 from random import randrange
 
@@ -29,6 +31,40 @@ def calcbase(s, digitos=BASE28):
 def genbase(tamanho, digitos=BASE28):
     return reprbase(randrange(len(digitos)**tamanho), digitos).rjust(tamanho,digitos[0])
 
+class IdGenerator(object):
+    ''' gera ids sem colisões: o prefixo do nó, aleatório se não for
+        informado, seguido de um contador crescente; o contador ocupa
+        `tamanho_contador` dígitos e cresce além disso se preciso; com os
+        tamanhos padrão os ids têm 8 caracteres
+
+        >>> ids = IdGenerator('x2')
+        >>> [ids.next() for i in range(3)]
+        ['x22222', 'x22223', 'x22224']
+        >>> ids.renew('y3')
+        >>> ids.next()
+        'y32225'
+        >>> len(IdGenerator().next())
+        8
+    '''
+    def __init__(self, node=None, tamanho_no=4, tamanho_contador=4,
+                 digitos=BASE28):
+        self.tamanho_no = tamanho_no
+        self.tamanho_contador = tamanho_contador
+        self.digitos = digitos
+        self.counter = itertools.count() # next() é atômico, sem lock
+        self.renew(node)
+
+    def renew(self, node=None):
+        ''' passa a usar outro prefixo: após um conflito, ou um fork '''
+        self.node = node if node is not None else genbase(self.tamanho_no, self.digitos)
+        self.pid = os.getpid()
+
+    def next(self):
+        if self.pid != os.getpid(): # processo filho: o contador foi copiado
+            self.renew()
+        valor = reprbase(next(self.counter), self.digitos)
+        return self.node + valor.rjust(self.tamanho_contador, self.digitos[0])
+
 if __name__=='__main__':
     print 'Amostra de alguns números em base 28'
 
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+# ISIS-DM: the ISIS Data Model API
+#
+# Copyright (C) 2010 BIREME/PAHO/WHO
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 2.1 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+from collections import OrderedDict
+import threading
+import time
+
+class LRUCache(object):
+    '''
+    in-process cache keeping at most `max_items` values, dropping the least
+    recently used ones; values stored more than `ttl` seconds ago are
+    returned as not fresh, for the caller to revalidate and touch, or pop;
+    with a `ttl` of None values are always fresh
+
+    Any object with the same get, set, touch, pop and clear methods can be
+    used instead, like a cache shared by many processes.
+
+        >>> cache = LRUCache(max_items=2, ttl=60)
+        >>> cache.set('a', 1)
+        >>> cache.set('b', 2)
+        >>> cache.get('a')
+        (1, True)
+        >>> cache.set('c', 3)
+        >>> print cache.get('b')
+        None
+        >>> cache.ttl = 0
+        >>> cache.get('a')
+        (1, False)
+        >>> cache.touch('a')
+        >>> cache.pop('c')
+        >>> sorted(cache.stats().items())
+        [('evictions', 1), ('hits', 2), ('invalidations', 1), ('items', 1), ('misses', 1), ('validations', 1)]
+        >>> 'a' in cache, 'c' in cache, len(cache)
+        (True, False, 1)
+        >>> cache.ttl = None
+        >>> cache.get('a')
+        (1, True)
+    '''
+    def __init__(self, max_items=1000, ttl=60):
+        self.max_items = max_items
+        self.ttl = ttl
+        self.items = OrderedDict() # key: (value, time stored or validated)
+        self.lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+        self.validations = self.invalidations = 0
+
+    def get(self, key):
+        ''' (value, fresh) for key, or None if it is not cached '''
+        with self.lock:
+            try:
+                value, stored = self.items.pop(key)
+            except KeyError:
+                self.misses += 1
+                return None
+            self.items[key] = (value, stored) # the most recently used
+            self.hits += 1
+        return value, self.ttl is None or time.time() - stored < self.ttl
+
+    def set(self, key, value):
+        with self.lock:
+            self.items.pop(key, None)
+            self.items[key] = (value, time.time())
+            while len(self.items) > self.max_items:
+                self.items.popitem(last=False)
+                self.evictions += 1
+
+    def touch(self, key):
+        ''' key was revalidated: it is fresh again '''
+        with self.lock:
+            if key in self.items:
+                self.items[key] = (self.items[key][0], time.time())
+                self.validations += 1
+
+    def pop(self, key):
+        ''' forget key, which changed or was removed '''
+        with self.lock:
+            if self.items.pop(key, None) is not None:
+                self.invalidations += 1
+
+    def __contains__(self, key):
+        return key in self.items
+
+    def __len__(self):
+        return len(self.items)
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'evictions': self.evictions, 'items': len(self.items),
+                    'validations': self.validations,
+                    'invalidations': self.invalidations}
@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+# ISIS-DM: the ISIS Data Model API
+#
+# Copyright (C) 2010 BIREME/PAHO/WHO
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 2.1 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import Queue
+import sys
+import threading
+
+class TimeoutError(Exception):
+    ''' a Future was not done in the time given to wait for it '''
+
+
+class Future(object):
+    '''
+    the result of a call submitted to an Executor: result waits for it,
+    raising the exception of the call if it failed, and the callbacks
+    added are called with the future once it is done
+    '''
+    def __init__(self):
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks = []
+        self._result = self._exc_info = None
+
+    def done(self):
+        return self._done.is_set()
+
+    def result(self, timeout=None):
+        self._wait(timeout)
+        if self._exc_info is not None:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._result
+
+    def exception(self, timeout=None):
+        ''' the exception raised by the call, None if it returned '''
+        self._wait(timeout)
+        return self._exc_info[1] if self._exc_info is not None else None
+
+    def add_done_callback(self, callback):
+        with self._lock:
+            if not self.done():
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def _wait(self, timeout):
+        if not self._done.wait(timeout) and not self.done():
+            raise TimeoutError('not done after %ss' % timeout)
+
+    def _set(self, result=None, exc_info=None):
+        with self._lock:
+            self._result, self._exc_info = result, exc_info
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback(self)
+
+
+class Executor(object):
+    '''
+    runs the calls submitted in at most `max_workers` threads, started as
+    they are needed, and returns a Future for each; when `max_pending`
+    calls are waiting for a thread, submit waits for one of them to start
+
+        >>> executor = Executor(max_workers=2)
+        >>> futures = [executor.submit(pow, 2, n) for n in range(4)]
+        >>> [future.result(5) for future in futures]
+        [1, 2, 4, 8]
+        >>> executor.submit(int, 'x').exception(5)
+        ValueError("invalid literal for int() with base 10: 'x'",)
+        >>> executor.shutdown()
+        >>> sorted(executor.stats().items())
+        [('completed', 5), ('failed', 1), ('max_workers', 2), ('pending', 0), ('workers', 0)]
+        >>> executor.submit(pow, 2, 4)
+        Traceback (most recent call last):
+        ...
+        RuntimeError: cannot submit calls after shutdown
+    '''
+    def __init__(self, max_workers=10, max_pending=0):
+        self.max_workers = max_workers
+        self.calls = Queue.Queue(max_pending)
+        self.lock = threading.Lock()
+        self.workers = []
+        self.idle = 0 # workers waiting for a call
+        self.completed = self.failed = 0
+        self.closed = False
+
+    def submit(self, function, *args, **kwargs):
+        future = Future()
+        with self.lock:
+            if self.closed:
+                raise RuntimeError('cannot submit calls after shutdown')
+            if self.idle <= self.calls.qsize() and len(self.workers) < self.max_workers:
+                worker = threading.Thread(target=self._work)
+                worker.daemon = True
+                worker.start()
+                self.workers.append(worker)
+        self.calls.put((future, function, args, kwargs))
+        return future
+
+    def shutdown(self, wait=True):
+        ''' stop the threads once the calls submitted are done '''
+        with self.lock:
+            workers, self.workers = self.workers, []
+            self.closed = True
+        for worker in workers:
+            self.calls.put(None)
+        if wait:
+            for worker in workers:
+                worker.join()
+
+    def stats(self):
+        with self.lock:
+            return {'max_workers': self.max_workers,
+                    'workers': len(self.workers),
+                    'pending': self.calls.qsize(),
+                    'completed': self.completed, 'failed': self.failed}
+
+    def _work(self):
+        while True:
+            with self.lock:
+                self.idle += 1
+            call = self.calls.get()
+            with self.lock:
+                self.idle -= 1
+            if call is None:
+                return
+            future, function, args, kwargs = call
+            try:
+                result, exc_info = function(*args, **kwargs), None
+            except BaseException:
+                result, exc_info = None, sys.exc_info()
+            with self.lock:
+                self.completed += 1
+                self.failed += exc_info is not None
+            future._set(result, exc_info)
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+# ISIS-DM: the ISIS Data Model API
+#
+# Copyright (C) 2010 BIREME/PAHO/WHO
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 2.1 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import socket
+import threading
+import time
+import couchdbkit
+from restkit import conn
+from socketpool import ConnectionPool
+from socketpool.pool import MaxConnectionsError
+
+class Connection(conn.Connection):
+    '''
+    keep-alive connection to CouchDB, giving its place in the pool back
+    when it is released or closed
+    '''
+    def __init__(self, host, port, timeout=None, **options):
+        super(Connection, self).__init__(host, port, **options)
+        sock = self.socket()
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if timeout is not None:
+            sock.settimeout(timeout)
+        self.couchdb_pool = options['pool']
+        self.checked_out = False
+        self.uses = 0
+
+    def close(self):
+        super(Connection, self).close()
+        self.couchdb_pool.checkin(self)
+
+
+class CouchdbPool(ConnectionPool):
+    '''
+    at most `max_connections` HTTP connections to the CouchDB server at
+    `uri`, shared by the threads of a process, each with its own
+    couchdbkit.Database handles: a couchdbkit.Server is not safe to use
+    from many threads at once. A thread waits up to `timeout` seconds for
+    a free connection, then MaxConnectionsError is raised; `timeout` is
+    also the limit of each socket operation. Connections are closed
+    instead of reused once they are `max_lifetime` seconds old.
+
+    CouchdbDocument methods take the names of the databases of
+    CouchdbDocument.pool too:
+
+        >>> pool = CouchdbPool('http://127.0.0.1:5984', max_connections=4)
+        >>> db = pool.database('isisdm')
+        >>> db is pool.database('isisdm')
+        True
+        >>> sorted(pool.stats().items())
+        [('created', 0), ('idle', 0), ('in_use', 0), ('max_connections', 4), ('peak', 0), ('reused', 0), ('timeouts', 0), ('waits', 0)]
+    '''
+    def __init__(self, uri='http://127.0.0.1:5984', max_connections=10,
+                 timeout=30, max_lifetime=600):
+        super(CouchdbPool, self).__init__(Connection, max_size=max_connections,
+                                          max_lifetime=max_lifetime,
+                                          options={'timeout': timeout},
+                                          reap_connections=False)
+        self.uri = uri.rstrip('/')
+        self.max_connections = max_connections
+        self.wait_timeout = timeout
+        self.local = threading.local()
+        self.free = threading.Condition()
+        self.in_use = self.peak = 0
+        self.created = self.reused = self.waits = self.timeouts = 0
+
+    def server(self):
+        ''' couchdbkit.Server of the current thread '''
+        try:
+            return self.local.server
+        except AttributeError:
+            self.local.server = couchdbkit.Server(self.uri, pool=self)
+            self.local.databases = {}
+            return self.local.server
+
+    def database(self, name, create=False):
+        ''' couchdbkit.Database of the current thread '''
+        server = self.server()
+        try:
+            return self.local.databases[name]
+        except KeyError:
+            db = couchdbkit.Database(self.uri + '/' + name, create=create,
+                                     server=server)
+            self.local.databases[name] = db
+            return db
+
+    def get(self, **options):
+        with self.free:
+            if self.in_use >= self.max_connections:
+                self.waits += 1
+                deadline = time.time() + self.wait_timeout
+                while self.in_use >= self.max_connections:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        self.timeouts += 1
+                        raise MaxConnectionsError('no free connection to %s after %ss'
+                                                  % (self.uri, self.wait_timeout))
+                    self.free.wait(remaining)
+            self.in_use += 1
+            self.peak = max(self.peak, self.in_use)
+        try:
+            connection = super(CouchdbPool, self).get(**options)
+        except:
+            self.free_slot()
+            raise
+        with self.free:
+            connection.checked_out = True
+            if connection.uses:
+                self.reused += 1
+            else:
+                self.created += 1
+            connection.uses += 1
+        return connection
+
+    def checkin(self, connection):
+        ''' connection was closed while in use '''
+        with self.free:
+            in_use, connection.checked_out = connection.checked_out, False
+        if in_use:
+            self.free_slot()
+
+    def release_connection(self, connection):
+        with self.free:
+            in_use, connection.checked_out = connection.checked_out, False
+        # back among the idle ones before a waiting thread looks for it
+        super(CouchdbPool, self).release_connection(connection)
+        if in_use:
+            self.free_slot()
+
+    def free_slot(self):
+        with self.free:
+            self.in_use -= 1
+            self.free.notify()
+
+    def stats(self):
+        with self.free:
+            return {'max_connections': self.max_connections,
+                    'in_use': self.in_use, 'idle': self.size,
+                    'peak': self.peak, 'created': self.created,
+                    'reused': self.reused, 'waits': self.waits,
+                    'timeouts': self.timeouts}
@@ -8,9 +8,12 @@ try:
 except IOError:
     README = CHANGES = ''
 
+# isis.utils.pool extends the connections and pool of restkit and socketpool
 requirements = ['colander',
                 'deform',
-                'couchdbkit']
+                'couchdbkit>=0.6.5,<0.7',
+                'restkit>=4.2.2,<4.3',
+                'socketpool>=0.5.3,<0.6']
 
 additional_files = ['README.txt',
                     'CHANGES.txt']
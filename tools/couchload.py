@@ -0,0 +1,340 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+# couchload.py: load ISIS and ISO-2709 files directly into CouchDB
+#
+# Copyright (C) 2010 BIREME/PAHO/WHO
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 2.1 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+############################
+# this script works with CPython (versions >=2.6 and <3)
+
+import sys
+import time
+import json
+import socket
+import httplib
+import threading
+import urllib
+import uuid
+from Queue import Queue
+from urlparse import urlsplit
+
+import argparse
+from isis2json import iterIsoRecords, iterMstRecords, convertRecord
+from isis2json import checkUniqueId, DEFAULT_QTY, ISIS_MFN_KEY
+
+DEFAULT_BATCH_SIZE = 1000
+DEFAULT_CONCURRENCY = 4 # batches posted at the same time
+DEFAULT_RETRIES = 3
+RETRY_DELAY = 0.5 # seconds, doubled after each failed attempt
+REPORT_INTERVAL = 5 # seconds between progress reports
+JSON_HEADERS = {'Content-Type': 'application/json'}
+
+class CouchError(Exception):
+    ''' unexpected HTTP status in a response from CouchDB '''
+
+    def __init__(self, status, reason):
+        Exception.__init__(self, '%s %s' % (status, reason))
+        self.status = status
+
+class ConnectionPool(object):
+    ''' keep-alive HTTP connections to one server, shared by threads '''
+
+    def __init__(self, url, size=DEFAULT_CONCURRENCY, timeout=60):
+        parts = urlsplit(url)
+        self.host, self.port = parts.hostname, parts.port or 80
+        self.timeout = timeout
+        self.idle = Queue()
+        for i in range(size):
+            self.idle.put(None) # connections are opened when first used
+
+    def request(self, method, path, body=None):
+        ''' return (status, decoded JSON response) '''
+        conn = self.idle.get()
+        try:
+            if conn is None:
+                conn = httplib.HTTPConnection(self.host, self.port,
+                                              timeout=self.timeout)
+            conn.request(method, path, body, JSON_HEADERS)
+            response = conn.getresponse()
+            data = response.read()
+        except (socket.error, httplib.HTTPException):
+            if conn is not None:
+                conn.close()
+            self.idle.put(None) # reconnect next time
+            raise
+        self.idle.put(conn)
+        return response.status, json.loads(data)
+
+    def close(self):
+        for i in range(self.idle.qsize()):
+            conn = self.idle.get()
+            if conn is not None:
+                conn.close()
+
+class BulkLoader(object):
+    ''' post JSON documents to a database through _bulk_docs, `concurrency`
+        batches at a time; documents rejected in a batch are retried one
+        by one, conflicts replacing the stored revision when `overwrite`
+        is set; documents without an "_id" get a random one before they
+        are posted, so a batch posted again is not stored twice '''
+
+    def __init__(self, db_url, batch_size=DEFAULT_BATCH_SIZE,
+                 concurrency=DEFAULT_CONCURRENCY, retries=DEFAULT_RETRIES,
+                 overwrite=True, report=None):
+        self.db_path = urlsplit(db_url).path.rstrip('/')
+        self.pool = ConnectionPool(db_url, concurrency)
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.retries = retries
+        self.overwrite = overwrite
+        self.report = report
+        self.lock = threading.Lock()
+        self.loaded = self.conflicts = self.batches = 0
+        self.failed = []  # (doc id, error) pairs
+        self.errors = []  # exceptions which stopped a batch
+        self.started = self.last_report = None
+
+    def create_db(self):
+        status, result = self.pool.request('PUT', self.db_path)
+        if status not in (201, 412): # 412: already exists
+            raise CouchError(status, result.get('reason'))
+
+    def load(self, json_docs):
+        ''' load an iterable of JSON encoded documents; return the
+            number of documents saved '''
+        self.started = self.last_report = time.time()
+        loaded_before = self.loaded
+        batches = Queue(self.concurrency * 2)
+        threads = [threading.Thread(target=self.post_batches, args=(batches,))
+                   for i in range(self.concurrency)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        try:
+            batch = []
+            for json_doc in json_docs:
+                batch.append(json_doc)
+                if len(batch) == self.batch_size:
+                    batches.put(batch)
+                    batch = []
+                if self.errors:
+                    break
+            if batch:
+                batches.put(batch)
+        finally:
+            for thread in threads:
+                batches.put(None)
+            for thread in threads:
+                thread.join()
+        self.show_progress(final=True)
+        if self.errors:
+            raise self.errors[0]
+        return self.loaded - loaded_before
+
+    def post_batches(self, batches):
+        while True:
+            batch = batches.get()
+            if batch is None:
+                return
+            if self.errors:
+                continue # stop posting, but keep draining the queue
+            try:
+                self.post_batch(batch)
+            except Exception, exc:
+                with self.lock:
+                    self.errors.append(exc)
+
+    def post_batch(self, batch):
+        batch = [self.with_id(json_doc) for json_doc in batch]
+        body = '{"docs":[%s]}' % ','.join(batch)
+        status, results = self.retry(self.pool.request, 'POST',
+                                     self.db_path + '/_bulk_docs', body)
+        if status != 201:
+            raise CouchError(status, results.get('reason'))
+        loaded = conflicts = 0
+        for json_doc, result in zip(batch, results):
+            if 'error' not in result:
+                loaded += 1
+            elif self.save_doc(json.loads(json_doc), result):
+                loaded += 1
+                conflicts += result['error'] == 'conflict'
+        with self.lock:
+            self.loaded += loaded
+            self.conflicts += conflicts
+            self.batches += 1
+        self.show_progress()
+
+    def with_id(self, json_doc):
+        ''' json_doc with an "_id", given one from uuid4 if it has none '''
+        if '"_id"' in json_doc and '_id' in json.loads(json_doc):
+            return json_doc
+        fields = json_doc.lstrip()[1:].lstrip() # the rest of the object
+        return '{"_id": "%s"%s%s' % (uuid.uuid4().hex,
+                                     '' if fields.startswith('}') else ', ', fields)
+
+    def save_doc(self, doc, result):
+        ''' retry a document rejected by _bulk_docs; return True if saved '''
+        path = self.db_path + '/' + urllib.quote(result['id'], safe='')
+        error = result['error']
+        for attempt in range(self.retries):
+            if error == 'conflict':
+                if not self.overwrite:
+                    break
+                status, current = self.retry(self.pool.request, 'GET', path)
+                if status == 200:
+                    doc['_rev'] = current['_rev']
+            status, response = self.retry(self.pool.request, 'PUT', path,
+                                          json.dumps(doc))
+            if status == 201:
+                return True
+            error = response.get('error')
+        with self.lock:
+            self.failed.append((result['id'], error))
+        return False
+
+    def retry(self, function, *args):
+        ''' call function, retrying connection errors and 5xx responses '''
+        delay = RETRY_DELAY
+        for attempt in range(self.retries + 1):
+            try:
+                status, result = function(*args)
+                if status < 500 or attempt == self.retries:
+                    return status, result
+            except (socket.error, httplib.HTTPException):
+                if attempt == self.retries:
+                    raise
+            time.sleep(delay)
+            delay *= 2
+
+    def rate(self):
+        elapsed = time.time() - self.started
+        return self.loaded / elapsed if elapsed else 0.0
+
+    def show_progress(self, final=False):
+        if self.report is None:
+            return
+        with self.lock:
+            now = time.time()
+            if not final and now - self.last_report < REPORT_INTERVAL:
+                return
+            self.last_report = now
+            msg = '%d docs loaded, %.1f docs/s' % (self.loaded, self.rate())
+            if final:
+                msg += ', %d conflicts replaced, %d failed' % (
+                    self.conflicts, len(self.failed))
+            self.report.write(msg + '\n')
+
+    def close(self):
+        self.pool.close()
+
+def iterJsonDocs(iterRecords, file_name, qty, skip, id_tag, gen_uuid, mfn,
+                 isis_json_type, prefix, constant):
+    ''' generate the JSON documents isis2json.py would write '''
+    end = skip + qty
+    id_tag = str(id_tag) if id_tag else ''
+    ids = set()
+    for i, record in enumerate(iterRecords(file_name, isis_json_type)):
+        if i >= end:
+            break
+        if i >= skip:
+            json_doc = convertRecord(record, i, id_tag, gen_uuid, mfn,
+                                     isis_json_type, prefix, constant)
+            if id_tag:
+                checkUniqueId(record['_id'], ids, id_tag, i,
+                              record.get(ISIS_MFN_KEY))
+            yield json_doc
+
+if __name__ == '__main__':
+
+    # create the parser
+    parser = argparse.ArgumentParser(
+        description='Load an ISIS .mst or .iso file into a CouchDB database')
+
+    # add the arguments
+    parser.add_argument(
+        'file_name', metavar='INPUT.(mst|iso)', help='.mst or .iso file to read')
+    parser.add_argument(
+        'db_url', metavar='DATABASE_URL',
+        help='database to load (ex. http://127.0.0.1:5984/lilacs)')
+    parser.add_argument(
+        '-b', '--batch', type=int, default=DEFAULT_BATCH_SIZE,
+        help='documents per _bulk_docs request (default=%s)'
+             % DEFAULT_BATCH_SIZE)
+    parser.add_argument(
+        '-c', '--concurrency', type=int, default=DEFAULT_CONCURRENCY,
+        help='_bulk_docs requests sent at the same time (default=%s)'
+             % DEFAULT_CONCURRENCY)
+    parser.add_argument(
+        '-r', '--retries', type=int, default=DEFAULT_RETRIES,
+        help='attempts for failed requests and rejected documents'
+             ' (default=%s)' % DEFAULT_RETRIES)
+    parser.add_argument(
+        '--no-overwrite', action='store_true',
+        help='keep stored documents when ids conflict (default: replace them)')
+    parser.add_argument(
+        '--create', action='store_true',
+        help='create the database if it does not exist')
+    parser.add_argument(
+        '-t', '--type', type=int, metavar='ISIS_JSON_TYPE', default=1,
+        help='ISIS-JSON type, sets field structure: 1=string, 2=alist, 3=dict')
+    parser.add_argument(
+        '-q', '--qty', type=int, default=DEFAULT_QTY,
+        help='maximum quantity of records to read (default=ALL)')
+    parser.add_argument(
+        '-s', '--skip', type=int, default=0,
+        help='records to skip from start of input (default=0)')
+    parser.add_argument(
+        '-i', '--id', type=int, metavar='TAG_NUMBER', default=0,
+        help='generate an "_id" from the given unique TAG field number'
+             ' for each record')
+    parser.add_argument(
+        '-u', '--uuid', action='store_true',
+        help='generate an "_id" with a random UUID for each record')
+    parser.add_argument(
+        '-p', '--prefix', type=str, metavar='PREFIX', default='',
+        help='concatenate prefix to every numeric field tag (ex. 99 becomes "v99")')
+    parser.add_argument(
+        '-n', '--mfn', action='store_true',
+        help='generate an "_id" from the MFN of each record'
+             ' (available only for .mst input)')
+    parser.add_argument(
+        '-k', '--constant', type=str, metavar='TAG:VALUE', default='',
+        help='Include a constant tag:value in every record (ex. -k type:AS)')
+
+    # parse the command line
+    args = parser.parse_args()
+    if args.file_name.lower().endswith('.mst'):
+        iterRecords = iterMstRecords
+    else:
+        if args.mfn:
+            print('UNSUPORTED: -n/--mfn option only available for .mst input.')
+            raise SystemExit
+        iterRecords = iterIsoRecords
+    loader = BulkLoader(args.db_url, args.batch, args.concurrency,
+                        args.retries, not args.no_overwrite, sys.stderr)
+    if args.create:
+        loader.create_db()
+    try:
+        loader.load(iterJsonDocs(iterRecords, args.file_name, args.qty,
+                    args.skip, args.id, args.uuid, args.mfn, args.type,
+                    args.prefix, args.constant))
+    finally:
+        loader.close()
+    for doc_id, error in loader.failed:
+        sys.stderr.write('failed: %s (%s)\n' % (doc_id, error))
+    if loader.failed:
+        raise SystemExit(1)
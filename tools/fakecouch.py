@@ -0,0 +1,428 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+# fakecouch.py: in-memory stand-in for the CouchDB HTTP API, for tests
+#
+# Copyright (C) 2010 BIREME/PAHO/WHO
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 2.1 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+''' Only the requests used by the loaders and CouchdbDocument are
+    supported: PUT/GET/DELETE of databases, GET/HEAD/PUT of documents and of
+    their attachments (with Content-Length or chunked), POST to _bulk_docs
+    (with inline attachments), GET or POST of _all_docs with keys and GET
+    or POST (with keys) of the views whose map functions CouchdbDocument
+    writes, and GET of _changes (normal, longpoll or continuous). '''
+
+import base64
+import bisect
+import hashlib
+import json
+import re
+import socket
+import threading
+import time
+import urllib
+import urlparse
+from uuid import uuid4
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+
+def map_function(source):
+    ''' python version of a map function written by CouchdbDocument '''
+    index = re.search(r'var type = (".*?"), path = (\[.*?\]);', source)
+    if index is not None:
+        return index_function(json.loads(index.group(1)), json.loads(index.group(2)))
+    doc_type = json.loads(re.search(r'doc\.TYPE === (".*?")', source).group(1))
+    emit = re.search(r'emit\((.*)\);', source).group(1)
+    emit = re.sub(r'doc\[(".*?")\]', r'doc.get(\1)', emit)
+    emit = emit.replace('doc._id', 'doc["_id"]').replace('null', 'None')
+    emit = eval('lambda doc: (%s)' % emit)
+    def map_doc(doc):
+        if doc.get('TYPE') == doc_type:
+            yield emit(doc)
+    return map_doc
+
+def index_function(doc_type, path):
+    ''' the values found following path, like the index views do '''
+    def map_doc(doc):
+        if doc.get('TYPE') != doc_type:
+            return
+        values = [doc]
+        for step in path:
+            found = []
+            for value in values:
+                if value is None:
+                    continue
+                if step == '*':
+                    found.extend(value if isinstance(value, list) else [value])
+                elif isinstance(value, list):
+                    found.extend(pair[1] for pair in value if pair[0] == step)
+                else:
+                    found.append(value.get(step))
+            values = found
+        for value in values:
+            if value is not None:
+                yield value, None
+    return map_doc
+
+class FakeCouchHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1' # keep-alive, like CouchDB
+    wbufsize = -1
+
+    def log_message(self, format, *args):
+        pass
+
+    def reply(self, status, body):
+        data = json.dumps(body)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def read_body(self):
+        length = int(self.headers.getheader('Content-Length') or 0)
+        return json.loads(self.rfile.read(length)) if length else None
+
+    def read_data(self):
+        ''' the raw body, sent with Content-Length or chunked '''
+        if self.headers.getheader('Transfer-Encoding', '').lower() != 'chunked':
+            return self.rfile.read(int(self.headers.getheader('Content-Length') or 0))
+        chunks = []
+        while True:
+            size = int(self.rfile.readline().split(';')[0], 16)
+            chunks.append(self.rfile.read(size))
+            self.rfile.readline() # CRLF after the chunk
+            if not size:
+                return ''.join(chunks)
+
+    def parts(self):
+        path = self.path.split('?')[0]
+        return [urllib.unquote(part) for part in path.split('/') if part]
+
+    def doc_path(self, parts):
+        ''' document id and attachment name (None for the document) '''
+        size = 3 if parts[1] == '_design' else 2
+        return '/'.join(parts[1:size]), '/'.join(parts[size:]) or None
+
+    def query(self):
+        ''' query parameters, JSON encoded except for plain strings '''
+        params = {}
+        for key, values in urlparse.parse_qs(urlparse.urlsplit(self.path).query).items():
+            try:
+                params[key] = json.loads(values[-1])
+            except ValueError:
+                params[key] = values[-1]
+        return params
+
+    def all_docs(self, db, keys):
+        ''' _all_docs rows for keys, or for every document '''
+        include_docs = self.query().get('include_docs', False)
+        rows = []
+        for key in sorted(db) if keys is None else keys:
+            doc = db.get(key)
+            if doc is None:
+                rows.append({'key': key, 'error': 'not_found'})
+                continue
+            row = {'id': key, 'key': key, 'value': {'rev': doc['_rev']}}
+            if include_docs:
+                row['doc'] = doc
+            rows.append(row)
+        return self.reply(200, {'total_rows': len(db), 'offset': 0, 'rows': rows})
+
+    def view(self, db, design, name, keys=None):
+        ''' rows of a view, for keys or from startkey (and startkey_docid) on,
+            up to limit rows '''
+        try:
+            source = db['_design/' + design]['views'][name]['map']
+        except KeyError:
+            return self.reply(404, {'error': 'not_found', 'reason': 'missing_named_view'})
+        rows = self.server.index(db, source)
+        query = self.query()
+        offset = 0
+        if keys is not None:
+            page = []
+            for key in keys:
+                i = bisect.bisect_left(rows, (key,))
+                while i < len(rows) and rows[i][0] == key:
+                    page.append(rows[i])
+                    i += 1
+        else:
+            if 'startkey' in query:
+                start = (query['startkey'],) + (
+                    (query['startkey_docid'],) if 'startkey_docid' in query else ())
+                offset = bisect.bisect_left(rows, start)
+            page = rows[offset:offset + query.get('limit', len(rows))]
+        result = []
+        for key, doc_id, value in page:
+            result.append({'id': doc_id, 'key': key, 'value': value})
+            if query.get('include_docs', False):
+                result[-1]['doc'] = db.get(doc_id)
+        return self.reply(200, {'total_rows': len(rows), 'offset': offset, 'rows': result})
+
+    def changes(self, db):
+        ''' rows of the documents written after since, at once or waiting
+            for them (longpoll), or as they are written (continuous) '''
+        query = self.query()
+        since = query.get('since', 0)
+        include_docs = query.get('include_docs', False)
+        timeout = query.get('timeout', 60000) / 1000.0
+        if query.get('feed') != 'continuous':
+            wait = timeout if query.get('feed') == 'longpoll' else 0
+            rows = self.server.changes(db, since, query.get('limit'), include_docs, wait)
+            return self.reply(200, {'results': rows,
+                                    'last_seq': rows[-1]['seq'] if rows else since})
+        heartbeat = query.get('heartbeat', 60000) / 1000.0
+        deadline = time.time() + timeout
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        while not self.server.closing:
+            remaining = deadline - time.time()
+            rows = self.server.changes(db, since, None, include_docs,
+                                       max(0, min(heartbeat, remaining)))
+            for row in rows:
+                self.write_chunk(json.dumps(row) + '\n')
+                since = row['seq']
+            if not rows:
+                if remaining <= 0:
+                    break
+                self.write_chunk('\n') # heartbeat
+        self.write_chunk(json.dumps({'last_seq': since}) + '\n')
+        self.write_chunk('')
+
+    def write_chunk(self, data):
+        self.wfile.write('%x\r\n%s\r\n' % (len(data), data))
+        self.wfile.flush()
+
+    def do_GET(self):
+        self.server.count(self)
+        parts = self.parts()
+        if not parts:
+            return self.reply(200, {'couchdb': 'Welcome', 'version': 'fake'})
+        db = self.server.databases.get(parts[0])
+        if db is None:
+            return self.reply(404, {'error': 'not_found', 'reason': 'no_db_file'})
+        if len(parts) == 1:
+            return self.reply(200, {'db_name': parts[0], 'doc_count': len(db)})
+        if parts[1:] == ['_all_docs']:
+            return self.all_docs(db, self.query().get('keys'))
+        if parts[1:] == ['_changes']:
+            return self.changes(db)
+        if len(parts) == 5 and parts[1] == '_design' and parts[3] == '_view':
+            return self.view(db, parts[2], parts[4])
+        doc_id, name = self.doc_path(parts)
+        doc = db.get(doc_id)
+        if doc is None:
+            return self.reply(404, {'error': 'not_found', 'reason': 'missing'})
+        if name is None:
+            return self.reply(200, doc)
+        stub = doc.get('_attachments', {}).get(name)
+        if stub is None:
+            return self.reply(404, {'error': 'not_found',
+                                    'reason': 'Document is missing attachment'})
+        data = self.server.attachments[stub['digest']]
+        self.send_response(200)
+        self.send_header('Content-Type', stub['content_type'])
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_HEAD(self):
+        ''' the revision of a document, in the ETag header '''
+        self.server.count(self)
+        parts = self.parts()
+        db = self.server.databases.get(parts[0], {})
+        doc = db.get(self.doc_path(parts)[0]) if len(parts) > 1 else None
+        self.send_response(404 if doc is None else 200)
+        if doc is not None:
+            self.send_header('ETag', '"%s"' % doc['_rev'])
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_PUT(self):
+        self.server.count(self)
+        parts = self.parts()
+        if len(parts) == 1:
+            if parts[0] in self.server.databases:
+                return self.reply(412, {'error': 'file_exists'})
+            self.server.databases[parts[0]] = {}
+            return self.reply(201, {'ok': True})
+        db = self.server.databases.get(parts[0])
+        if db is None:
+            return self.reply(404, {'error': 'not_found', 'reason': 'no_db_file'})
+        doc_id, name = self.doc_path(parts)
+        if name is None:
+            body = self.read_body()
+            body['_id'] = doc_id
+        else:
+            body = dict(db.get(doc_id) or {}, _id=doc_id)
+            body['_rev'] = self.query().get('rev')
+            body['_attachments'] = dict(body.get('_attachments', {}))
+            body['_attachments'][name] = {
+                'content_type': self.headers.getheader('Content-Type'),
+                'data': base64.b64encode(self.read_data())}
+        result = self.server.store(db, body)
+        return self.reply(409 if 'error' in result else 201, result)
+
+    def do_POST(self):
+        self.server.count(self)
+        parts = self.parts()
+        db = self.server.databases.get(parts[0])
+        if db is None:
+            return self.reply(404, {'error': 'not_found', 'reason': 'no_db_file'})
+        if parts[1:] == ['_all_docs']:
+            return self.all_docs(db, self.read_body()['keys'])
+        if len(parts) == 5 and parts[1] == '_design' and parts[3] == '_view':
+            return self.view(db, parts[2], parts[4], self.read_body()['keys'])
+        if parts[1:] != ['_bulk_docs']:
+            return self.reply(400, {'error': 'bad_request'})
+        failures = self.server.fail_next_posts
+        if failures:
+            self.server.fail_next_posts = failures - 1
+            return self.reply(500, {'error': 'unknown_error'})
+        results = [self.server.store(db, doc) for doc in self.read_body()['docs']]
+        lost = self.server.lose_next_replies
+        if lost:
+            self.server.lose_next_replies = lost - 1
+            return self.reply(500, {'error': 'unknown_error'})
+        return self.reply(201, results)
+
+    def do_DELETE(self):
+        self.server.count(self)
+        self.server.databases.pop(self.parts()[0], None)
+        return self.reply(200, {'ok': True})
+
+class FakeCouchServer(ThreadingMixIn, HTTPServer):
+    ''' serve in a daemon thread on a free local port; `url` is the root '''
+    daemon_threads = True
+
+    def __init__(self, port=0):
+        HTTPServer.__init__(self, ('127.0.0.1', port), FakeCouchHandler)
+        self.url = 'http://127.0.0.1:%s' % self.server_address[1]
+        self.databases = {}
+        self.attachments = {} # data of the attachments, by digest
+        self.requests = []
+        self.connections = set()
+        self.sockets = set()
+        self.threads = []
+        self.fail_next_posts = 0
+        self.lose_next_replies = 0 # _bulk_docs stored, but answered with 500
+        self.lock = threading.Lock()
+        self.writes = 0
+        self.indexes = {} # (id of the database, map): (writes, sorted rows)
+        self.sequences = {} # id of the database: (last seq, {doc id: seq})
+        self.written = threading.Condition(self.lock)
+        self.closing = False
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def process_request(self, request, client_address):
+        thread = threading.Thread(target=self.process_request_thread,
+                                  args=(request, client_address))
+        thread.daemon = True
+        self.threads.append(thread)
+        thread.start()
+
+    def handle_error(self, request, client_address):
+        pass # clients closing keep-alive connections are not errors here
+
+    def count(self, handler):
+        with self.lock:
+            self.requests.append((handler.command, handler.path))
+            self.connections.add(handler.client_address)
+            self.sockets.add(handler.connection)
+
+    def store(self, db, doc):
+        ''' save doc, checking its _rev like CouchDB does '''
+        with self.lock:
+            doc_id = doc.get('_id') or uuid4().hex
+            old = db.get(doc_id)
+            old_rev = old['_rev'] if old else None
+            if doc.get('_rev') != old_rev:
+                return {'id': doc_id, 'error': 'conflict',
+                        'reason': 'Document update conflict.'}
+            number = int(old_rev.split('-')[0]) + 1 if old_rev else 1
+            doc = dict(doc, _id=doc_id, _rev='%s-%s' % (number, uuid4().hex))
+            if '_attachments' in doc:
+                doc['_attachments'] = dict((name, self.stub(attachment, number))
+                    for name, attachment in doc['_attachments'].items())
+            db[doc_id] = doc
+            self.writes += 1
+            last_seq, seqs = self.sequences.get(id(db), (0, {}))
+            seqs[doc_id] = last_seq + 1
+            self.sequences[id(db)] = (last_seq + 1, seqs)
+            self.written.notify_all()
+            return {'ok': True, 'id': doc_id, 'rev': doc['_rev']}
+
+    def index(self, db, source):
+        ''' sorted rows of a view, mapped again only after writes '''
+        with self.lock:
+            writes = self.writes
+            indexed = self.indexes.get((id(db), source))
+        if indexed is not None and indexed[0] == writes:
+            return indexed[1]
+        map_doc = map_function(source)
+        rows = sorted((key, doc_id, value) for doc_id, doc in db.items()
+                      for key, value in map_doc(doc))
+        with self.lock:
+            self.indexes[(id(db), source)] = (writes, rows)
+        return rows
+
+    def changes(self, db, since, limit, include_docs, wait):
+        ''' _changes rows after since, waiting up to wait seconds for one '''
+        deadline = time.time() + wait
+        with self.written:
+            while True:
+                last_seq, seqs = self.sequences.get(id(db), (0, {}))
+                found = sorted((seq, doc_id) for doc_id, seq in seqs.items() if seq > since)
+                remaining = deadline - time.time()
+                if found or remaining <= 0 or self.closing:
+                    break
+                self.written.wait(remaining)
+        rows = []
+        for seq, doc_id in found[:limit]:
+            doc = db[doc_id]
+            rows.append({'seq': seq, 'id': doc_id, 'changes': [{'rev': doc['_rev']}]})
+            if include_docs:
+                rows[-1]['doc'] = doc
+        return rows
+
+    def stub(self, attachment, revpos):
+        ''' the stub CouchDB keeps for an inline attachment '''
+        if 'data' not in attachment:
+            return attachment
+        data = base64.b64decode(attachment['data'])
+        digest = 'md5-' + base64.b64encode(hashlib.md5(data).digest())
+        self.attachments[digest] = data
+        return {'stub': True, 'revpos': revpos, 'length': len(data),
+                'content_type': attachment.get('content_type'),
+                'digest': digest}
+
+    def stop(self):
+        with self.written: # release threads waiting for changes
+            self.closing = True
+            self.written.notify_all()
+        self.shutdown()
+        self.server_close()
+        for sock in self.sockets: # release threads waiting on keep-alive
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+        for thread in self.threads:
+            thread.join()
@@ -0,0 +1,279 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+# CDS/ISIS inverted file reader (.cnt, .n01, .n02, .l01, .l02 and .ifp files)
+#
+# Copyright (C) 2010 BIREME/PAHO/WHO
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 2.1 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import re
+from struct import unpack, calcsize
+from collections import namedtuple
+
+from masterfile import sibling_file_name
+
+# control record, one per tree: idtype ordn ordf n k liv posrx nmaxpos fmaxpos abnormal
+CNT_FORMAT = '<hhhhhhiiih'
+CNT_LEN = calcsize(CNT_FORMAT)
+KEY_LENGTHS = {1:10, 2:30} # keys up to 10 chars go in tree 1, longer ones in tree 2
+NODE_HEADER_FORMAT = '<ihh' # pos ock it
+LEAF_HEADER_FORMAT = '<ihhi' # pos ock it ps
+IFP_BLOCK_LEN = 512
+IFP_WORDS = 127 # 4 byte words per .ifp block, after the block number
+IFP_SEGMENT_FORMAT = '<iiiii' # nxtb nxtp totp segp segc
+POSTING_LEN = 8 # big-endian: mfn (3 bytes) tag (2) occ (1) cnt (2)
+TRUNCATION = '$'
+AND, OR, NOT = '*', '+', '^'
+QUERY_TOKEN_RE = re.compile(r'\s*(?:"([^"]*)"|([()*+^])|([^\s()*+^"]+))')
+
+Posting = namedtuple('Posting', 'mfn tag occ cnt')
+
+def tree_for(key):
+    return 1 if len(key) <= KEY_LENGTHS[1] else 2
+
+def normalize(term):
+    return term.strip().upper()
+
+def decode_posting(raw):
+    mfn = ord(raw[0]) << 16 | ord(raw[1]) << 8 | ord(raw[2])
+    tag = ord(raw[3]) << 8 | ord(raw[4])
+    cnt = ord(raw[6]) << 8 | ord(raw[7])
+    return Posting(mfn, tag, ord(raw[5]), cnt)
+
+class Tree(object):
+    ''' one of the two B*trees of the dictionary: index nodes in .n0x and
+        leaves, sorted and chained by the `ps` pointer, in .l0x '''
+
+    def __init__(self, base_name, control):
+        (self.idtype, self.ordn, self.ordf, self.n, self.k, self.liv,
+         self.posrx, self.nmaxpos, self.fmaxpos, self.abnormal) = control
+        self.key_len = KEY_LENGTHS[self.idtype]
+        self.node_entry_format = '%ssi' % self.key_len
+        self.leaf_entry_format = '%ssii' % self.key_len
+        self.node_len = (calcsize(NODE_HEADER_FORMAT) +
+                         2 * self.ordn * calcsize('<'+self.node_entry_format))
+        self.leaf_len = (calcsize(LEAF_HEADER_FORMAT) +
+                         2 * self.ordf * calcsize('<'+self.leaf_entry_format))
+        self.nodes = self.leaves = None
+        if not self.empty:
+            suffix = '%s' % self.idtype
+            self.nodes = open(sibling_file_name(base_name, '.n0'+suffix), 'rb')
+            self.leaves = open(sibling_file_name(base_name, '.l0'+suffix), 'rb')
+
+    @property
+    def empty(self):
+        return self.liv < 0
+
+    def pad(self, key):
+        return key[:self.key_len].ljust(self.key_len)
+
+    def read_node(self, pos):
+        self.nodes.seek((pos - 1) * self.node_len)
+        raw = self.nodes.read(self.node_len)
+        pos, ock, it = unpack(NODE_HEADER_FORMAT, raw[:8])
+        entries = unpack('<' + self.node_entry_format * ock,
+                         raw[8:8 + ock * calcsize('<'+self.node_entry_format)])
+        return zip(entries[0::2], entries[1::2])
+
+    def read_leaf(self, pos):
+        ''' return (keys, (block, position) pointers, next leaf) '''
+        self.leaves.seek((pos - 1) * self.leaf_len)
+        raw = self.leaves.read(self.leaf_len)
+        pos, ock, it, ps = unpack(LEAF_HEADER_FORMAT, raw[:12])
+        entries = unpack('<' + self.leaf_entry_format * ock,
+                         raw[12:12 + ock * calcsize('<'+self.leaf_entry_format)])
+        return entries[0::3], zip(entries[1::3], entries[2::3]), ps
+
+    def find_leaf(self, padded_key):
+        punt = self.posrx
+        while punt > 0:
+            entries = self.read_node(punt)
+            punt = entries[0][1]
+            for key, pointer in entries[1:]:
+                if key > padded_key:
+                    break
+                punt = pointer
+        return -punt
+
+    def lookup(self, key):
+        ''' return the .ifp (block, position) of `key`, or None '''
+        if self.empty:
+            return None
+        padded = self.pad(key)
+        keys, pointers, ps = self.read_leaf(self.find_leaf(padded))
+        for leaf_key, pointer in zip(keys, pointers):
+            if leaf_key == padded:
+                return pointer
+        return None
+
+    def scan(self, prefix=''):
+        ''' generate (key, pointer) for keys starting with prefix, in order '''
+        if self.empty:
+            return
+        leaf = self.find_leaf(self.pad(prefix))
+        while leaf > 0:
+            keys, pointers, leaf = self.read_leaf(leaf)
+            for key, pointer in zip(keys, pointers):
+                key = key.rstrip()
+                if key < prefix:
+                    continue
+                if not key.startswith(prefix):
+                    return
+                yield key, pointer
+
+    def close(self):
+        for open_file in (self.nodes, self.leaves):
+            if open_file is not None:
+                open_file.close()
+
+class InvertedFile(object):
+
+    def __init__(self, file_name):
+        self.file_name = sibling_file_name(file_name, '.cnt')
+        cnt = open(self.file_name, 'rb').read(2 * CNT_LEN)
+        self.trees = {}
+        for i in (0, 1):
+            control = unpack(CNT_FORMAT, cnt[i*CNT_LEN:(i+1)*CNT_LEN])
+            self.trees[control[0]] = Tree(file_name, control)
+        self.ifp = open(sibling_file_name(file_name, '.ifp'), 'rb')
+
+    def read_words(self, block, pos, count):
+        ''' read `count` words starting at word `pos` of .ifp `block`,
+            skipping the block numbers at the start of each block '''
+        chunks = []
+        while count > 0:
+            if pos >= IFP_WORDS:
+                block, pos = block + 1, pos - IFP_WORDS
+                continue
+            size = min(count, IFP_WORDS - pos)
+            self.ifp.seek((block - 1) * IFP_BLOCK_LEN + 4 + pos * 4)
+            chunks.append(self.ifp.read(size * 4))
+            pos += size
+            count -= size
+        return ''.join(chunks)
+
+    def read_postings(self, pointer):
+        ''' generate the postings of a key, following the chained segments '''
+        block, pos = pointer
+        while block > 0:
+            header = self.read_words(block, pos, 5)
+            next_block, next_pos, total, seg_postings, seg_capacity = unpack(
+                IFP_SEGMENT_FORMAT, header)
+            raw = self.read_words(block, pos + 5, seg_postings * 2)
+            for i in xrange(0, len(raw), POSTING_LEN):
+                yield decode_posting(raw[i:i+POSTING_LEN])
+            block, pos = next_block, next_pos
+
+    def postings(self, term):
+        ''' return the postings of an exact term '''
+        key = normalize(term)
+        pointer = self.trees[tree_for(key)].lookup(key)
+        if pointer is None:
+            return []
+        return list(self.read_postings(pointer))
+
+    def terms(self, prefix=''):
+        ''' generate (key, pointer) for dictionary keys starting with prefix '''
+        prefix = normalize(prefix)
+        for idtype in (1, 2):
+            if idtype == 1 and len(prefix) > KEY_LENGTHS[1]:
+                continue
+            for item in self.trees[idtype].scan(prefix):
+                yield item
+
+    def lookup(self, term):
+        ''' return the sorted MFNs of records indexed by `term`; a trailing
+            $ searches every term starting with the remaining prefix '''
+        if term.endswith(TRUNCATION):
+            return self.prefix(term[:-1])
+        return sorted(set(posting.mfn for posting in self.postings(term)))
+
+    def prefix(self, prefix):
+        mfns = set()
+        for key, pointer in self.terms(prefix):
+            mfns.update(posting.mfn for posting in self.read_postings(pointer))
+        return sorted(mfns)
+
+    def search(self, expression):
+        ''' evaluate a CDS/ISIS style search expression, with the operators
+            ^ (AND NOT), * (AND) and + (OR) in decreasing precedence,
+            parentheses, "quoted terms" and $ truncation '''
+        tokens = tokenize(expression)
+        result = self.parse_or(tokens)
+        if tokens:
+            raise SyntaxError('Unexpected %r in %r' % (tokens[0][1], expression))
+        return sorted(result)
+
+    def parse_or(self, tokens):
+        result = self.parse_and(tokens)
+        while tokens and tokens[0] == ('op', OR):
+            tokens.pop(0)
+            result = result | self.parse_and(tokens)
+        return result
+
+    def parse_and(self, tokens):
+        result = self.parse_not(tokens)
+        while tokens and tokens[0] == ('op', AND):
+            tokens.pop(0)
+            result = result & self.parse_not(tokens)
+        return result
+
+    def parse_not(self, tokens):
+        result = self.parse_primary(tokens)
+        while tokens and tokens[0] == ('op', NOT):
+            tokens.pop(0)
+            result = result - self.parse_primary(tokens)
+        return result
+
+    def parse_primary(self, tokens):
+        if not tokens:
+            raise SyntaxError('Incomplete search expression')
+        kind, value = tokens.pop(0)
+        if kind == 'term':
+            return set(self.lookup(value))
+        if value == '(':
+            result = self.parse_or(tokens)
+            if not tokens or tokens.pop(0) != ('op', ')'):
+                raise SyntaxError('Missing closing parenthesis')
+            return result
+        raise SyntaxError('Unexpected %r' % value)
+
+    def close(self):
+        for tree in self.trees.values():
+            tree.close()
+        self.ifp.close()
+
+def tokenize(expression):
+    tokens = []
+    pos = 0
+    expression = expression.rstrip()
+    while pos < len(expression):
+        match = QUERY_TOKEN_RE.match(expression, pos)
+        if match is None:
+            raise SyntaxError('Invalid search expression: %r' % expression)
+        quoted, operator, term = match.groups()
+        if operator is not None:
+            tokens.append(('op', operator))
+        else:
+            tokens.append(('term', quoted if quoted is not None else term))
+        pos = match.end()
+    return tokens
+
+def test():
+    import doctest
+    doctest.testfile('invertedfile_test.txt')
+
+if __name__=='__main__':
+    test()
@@ -40,8 +40,41 @@ ISIS_MFN_KEY = 'mfn'
 ISIS_ACTIVE_KEY = 'active'
 SUBFIELD_DELIMITER = '^'
 INPUT_ENCODING = 'cp1252'
+CHUNKS_PER_WORKER = 4 # input ranges per worker process, for load balancing
 
-def iterMstRecords(master_file_name, isis_json_type):
+def iterMstRecords(master_file_name, isis_json_type, first=1, last=None):
+    if os.name == 'java': # running Jython
+        return iterZeusMstRecords(master_file_name, isis_json_type)
+    return iterMasterFileRecords(master_file_name, isis_json_type, first, last)
+
+def iterMasterFileRecords(master_file_name, isis_json_type, first=1, last=None):
+    from masterfile import MasterFile
+    from subfield import expand
+
+    mst = MasterFile(master_file_name)
+    for record in mst.records(first, last):
+        fields = {}
+        if SKIP_INACTIVE:
+            if not record.active:
+                continue
+        else: # save status only there are non-active records
+            fields[ISIS_ACTIVE_KEY] = record.active
+        fields[ISIS_MFN_KEY] = record.mfn
+        for tag, value in record.fields:
+            field_occurrences = fields.setdefault(str(tag),[])
+            content = value.decode(INPUT_ENCODING,'replace')
+            if isis_json_type == 1:
+                field_occurrences.append(content)
+            elif isis_json_type == 2:
+                field_occurrences.append(expand(content))
+            elif isis_json_type == 3:
+                field_occurrences.append(dict(expand(content)))
+            else:
+                raise NotImplementedError('ISIS-JSON type %s conversion not yet implemented for .mst input' % isis_json_type)
+        yield fields
+    mst.close()
+
+def iterZeusMstRecords(master_file_name, isis_json_type):
     try:
         from br.bireme.zeus.master import MasterFactory, Record
     except ImportError:
@@ -84,11 +117,11 @@ def iterMstRecords(master_file_name, isis_json_type):
         yield fields
     mst.close()
 
-def iterIsoRecords(iso_file_name, isis_json_type):
-    from iso2709 import IsoFile
+def iterIsoRecords(iso_file_name, isis_json_type, start=0, end=None):
+    from iso2709 import MappedIsoFile
     from subfield import expand
 
-    iso = IsoFile(iso_file_name)
+    iso = MappedIsoFile(iso_file_name, start=start, end=end)
     for record in iso:
         fields = {}
         for field in record.directory:
@@ -107,6 +140,55 @@ def iterIsoRecords(iso_file_name, isis_json_type):
         yield fields
     iso.close()
 
+def recordId(record, i, id_tag, isis_json_type):
+    occurrences = record.get(id_tag, None)
+    if occurrences is None:
+        msg = 'id tag #%s not found in record %s'
+        if ISIS_MFN_KEY in record:
+            msg = msg + (' (mfn=%s)' % record[ISIS_MFN_KEY])
+        raise KeyError(msg % (id_tag, i))
+    if len(occurrences) > 1:
+        msg = 'multiple id tags #%s found in record %s'
+        if ISIS_MFN_KEY in record:
+            msg = msg + (' (mfn=%s)' % record[ISIS_MFN_KEY])
+        raise TypeError(msg % (id_tag, i))
+    else: # ok, we have one and only one id field
+        if isis_json_type == 1:
+            return occurrences[0]
+        elif isis_json_type == 2:
+            return occurrences[0][0][1]
+        elif isis_json_type == 3:
+            return occurrences[0]['_']
+
+def checkUniqueId(id, ids, id_tag, i, mfn):
+    if id in ids:
+        msg = 'duplicate id %s in tag #%s, record %s'
+        if mfn is not None:
+            msg = msg + (' (mfn=%s)' % mfn)
+        raise TypeError(msg % (id, id_tag, i))
+    ids.add(id)
+
+def convertRecord(record, i, id_tag, gen_uuid, mfn, isis_json_type, prefix,
+                  constant):
+    ''' add the _id and constant keys, prefix the tags and return the
+        record as JSON '''
+    if id_tag:
+        record['_id'] = recordId(record, i, id_tag, isis_json_type)
+    elif gen_uuid:
+        record['_id'] = unicode(uuid4())
+    elif mfn:
+        record['_id'] = record[ISIS_MFN_KEY]
+    if prefix:
+        for tag in tuple(record): # iterate over a fixed sequence of tags
+            if str(tag).isdigit():
+                record[prefix+tag] = record[tag]
+                del record[tag] # this is why we iterate over a tuple
+                # with the tags, and not directly on the record dict
+    if constant:
+        constant_key, constant_value = constant.split(':')
+        record[constant_key] = constant_value
+    return json.dumps(record).encode('utf-8')
+
 def writeJsonArray(iterRecords, file_name, output, qty, skip, id_tag,
                    gen_uuid, mongo, mfn, isis_json_type, prefix, constant):
     start = skip
@@ -123,48 +205,185 @@ def writeJsonArray(iterRecords, file_name, output, qty, skip, id_tag,
             break
         if i > start and not mongo:
             output.write(',')
-        output.write('\n')
         if start <= i < end:
+            output.write('\n')
+            json_record = convertRecord(record, i, id_tag, gen_uuid, mfn,
+                                        isis_json_type, prefix, constant)
             if id_tag:
-                occurrences = record.get(id_tag, None)
-                if occurrences is None:
-                    msg = 'id tag #%s not found in record %s'
-                    if ISIS_MFN_KEY in record:
-                        msg = msg + (' (mfn=%s)' % record[ISIS_MFN_KEY])
-                    raise KeyError(msg % (id_tag, i))
-                if len(occurrences) > 1:
-                    msg = 'multiple id tags #%s found in record %s'
-                    if ISIS_MFN_KEY in record:
-                        msg = msg + (' (mfn=%s)' % record[ISIS_MFN_KEY])
-                    raise TypeError(msg % (id_tag, i))
-                else: # ok, we have one and only one id field
-                    if isis_json_type == 1:
-                        id = occurrences[0]
-                    elif isis_json_type == 2:
-                        id = occurrences[0][0][1]
-                    elif isis_json_type == 3:
-                        id = occurrences[0]['_']
-                    if id in ids:
-                        msg = 'duplicate id %s in tag #%s, record %s'
-                        if ISIS_MFN_KEY in record:
-                            msg = msg + (' (mfn=%s)' % record[ISIS_MFN_KEY])
-                        raise TypeError(msg % (id, id_tag, i))
-                    record['_id'] = id
-                    ids.add(id)
-            elif gen_uuid:
-                record['_id'] = unicode(uuid4())
-            elif mfn:
-                record['_id'] = record[ISIS_MFN_KEY]
-            if prefix:
-                for tag in tuple(record): # iterate over a fixed sequence of tags
-                    if str(tag).isdigit():
-                        record[prefix+tag] = record[tag]
-                        del record[tag] # this is why we iterate over a tuple
-                        # with the tags, and not directly on the record dict
-            if constant:
-                constant_key, constant_value = constant.split(':')
-                record[constant_key] = constant_value
-            output.write(json.dumps(record).encode('utf-8'))
+                checkUniqueId(record['_id'], ids, id_tag, i,
+                              record.get(ISIS_MFN_KEY))
+            output.write(json_record)
+    if not mongo:
+        output.write('\n]')
+    output.write('\n')
+
+def chunkFileName(file_name, number):
+    ''' numbered output file name: out.json -> out-0001.json '''
+    base, ext = os.path.splitext(file_name)
+    return '%s-%04d%s' % (base, number, ext or '.json')
+
+def writeJsonChunks(iterRecords, file_name, out_name, qty, skip, repeat,
+                    id_tag, gen_uuid, mongo, mfn, isis_json_type, prefix,
+                    constant, couch):
+    ''' read the input only once, writing up to `repeat` numbered files
+        with `qty` records each (repeat=0 writes until end of input);
+        generate the name of each file as soon as it is closed '''
+    if id_tag:
+        id_tag = str(id_tag)
+        ids = set()
+    else:
+        id_tag = ''
+    chunks = 0
+    output = None
+    for i, record in enumerate(iterRecords(file_name, isis_json_type)):
+        if i < skip:
+            continue
+        if output is None:
+            chunks += 1
+            chunk_name = chunkFileName(out_name, chunks)
+            output = open(chunk_name, 'w')
+            if couch:
+                output.write('{ "docs" : ')
+            if not mongo:
+                output.write('[')
+            written = 0
+        json_record = convertRecord(record, i, id_tag, gen_uuid, mfn,
+                                    isis_json_type, prefix, constant)
+        if id_tag:
+            checkUniqueId(record['_id'], ids, id_tag, i,
+                          record.get(ISIS_MFN_KEY))
+        if written and not mongo:
+            output.write(',')
+        output.write('\n')
+        output.write(json_record)
+        written += 1
+        if written == qty:
+            closeJsonChunk(output, mongo, couch)
+            output = None
+            yield chunk_name
+            if chunks == repeat:
+                break
+    if output is not None:
+        closeJsonChunk(output, mongo, couch)
+        yield chunk_name
+
+def closeJsonChunk(output, mongo, couch):
+    if not mongo:
+        output.write('\n]')
+    output.write('\n')
+    if couch:
+        output.write('}\n')
+    output.close()
+
+def splitIsoInput(file_name, parts):
+    ''' return (iterRecords keyword arguments, record count) for byte
+        ranges of the input starting at record boundaries '''
+    from iso2709 import split_file
+    return [(dict(start=start, end=end), count)
+            for start, end, count in split_file(file_name, parts)]
+
+def splitMstInput(file_name, parts):
+    ''' return (iterRecords keyword arguments, record count) for MFN
+        ranges of the input, counting records through the .xrf '''
+    from masterfile import MasterFile, XRF_PHYSICALLY_DELETED
+    mst = MasterFile(file_name)
+    size = max(len(mst) // parts, 1)
+    chunks = []
+    for first in xrange(1, len(mst) + 1, size):
+        last = min(first + size - 1, len(mst))
+        count = 0
+        for mfn, pointer in mst.pointers(first, last):
+            if pointer > 0 or (not SKIP_INACTIVE and pointer not in
+                               (0, XRF_PHYSICALLY_DELETED)):
+                count += 1
+        chunks.append((dict(first=first, last=last), count))
+    mst.close()
+    return chunks
+
+def convertChunk(args):
+    ''' worker process task: convert the records of one input range,
+        returning (index, id, mfn, JSON) for each record to be written '''
+    (iterRecords, file_name, bounds, first_index, start, end, id_tag,
+     gen_uuid, mfn, isis_json_type, prefix, constant) = args
+    iterRecords = globals()[iterRecords]
+    results = []
+    for i, record in enumerate(iterRecords(file_name, isis_json_type, **bounds)):
+        i += first_index
+        if i >= end:
+            break
+        if i >= start:
+            json_record = convertRecord(record, i, id_tag, gen_uuid, mfn,
+                                        isis_json_type, prefix, constant)
+            results.append((i, record.get('_id'), record.get(ISIS_MFN_KEY),
+                            json_record))
+    return results
+
+def convertChunkSafely(args):
+    ''' return (results, None), or (None, exception) for errors to be
+        raised by the main process '''
+    try:
+        return convertChunk(args), None
+    except Exception, exc:
+        return None, exc
+
+def writeJsonArrayParallel(iterRecords, file_name, output, qty, skip, id_tag,
+                           gen_uuid, mongo, mfn, isis_json_type, prefix,
+                           constant, workers, ordered=True):
+    ''' like writeJsonArray, converting input ranges in `workers`
+        processes and writing them in input order, or as soon as they are
+        done when not `ordered`; ids are checked for uniqueness here '''
+    import multiprocessing
+    import Queue
+    start = skip
+    end = start + qty
+    id_tag = str(id_tag) if id_tag else ''
+    if iterRecords is iterIsoRecords:
+        chunks = splitIsoInput(file_name, workers * CHUNKS_PER_WORKER)
+    else:
+        chunks = splitMstInput(file_name, workers * CHUNKS_PER_WORKER)
+    tasks = []
+    first_index = 0
+    for bounds, count in chunks:
+        if count and first_index < end and first_index + count > start:
+            tasks.append((iterRecords.__name__, file_name, bounds, first_index,
+                          start, end, id_tag, gen_uuid, mfn, isis_json_type,
+                          prefix, constant))
+        first_index += count
+    if not mongo:
+        output.write('[')
+    pool = multiprocessing.Pool(workers)
+    done = Queue.Queue()
+    ready = {} # converted chunks waiting for their turn to be written
+    ids = set()
+    next_task = next_write = written = 0
+    try:
+        while next_write < len(tasks):
+            # keep a bounded window of chunks being converted or waiting
+            while next_task < len(tasks) and next_task - next_write < workers * 2:
+                pool.apply_async(convertChunkSafely, (tasks[next_task],),
+                    callback=lambda result, n=next_task: done.put((n, result)))
+                next_task += 1
+            n, (chunk, error) = done.get()
+            if error is not None:
+                raise error
+            if not ordered: # write chunks in the order they are done
+                n = next_write + len(ready)
+            ready[n] = chunk
+            while next_write in ready:
+                for i, id, record_mfn, json_record in ready.pop(next_write):
+                    if id_tag:
+                        checkUniqueId(id, ids, id_tag, i, record_mfn)
+                    if written and not mongo:
+                        output.write(',')
+                    output.write('\n')
+                    output.write(json_record)
+                    written += 1
+                next_write += 1
+    finally:
+        # never terminate: a worker killed while sending its results
+        # can leave the pool waiting forever
+        pool.close()
+        pool.join()
     if not mongo:
         output.write('\n]')
     output.write('\n')
@@ -179,7 +398,7 @@ if __name__ == '__main__':
     parser.add_argument(
         'file_name', metavar='INPUT.(mst|iso)', help='.mst or .iso file to read')
     parser.add_argument(
-        '-o', '--out', type=argparse.FileType('w'), default=sys.stdout,
+        '-o', '--out', default=None,
         metavar='OUTPUT.json',
         help='the file where the JSON output should be written'
              ' (default: write to stdout)')
@@ -217,14 +436,20 @@ if __name__ == '__main__':
     parser.add_argument(
         '-k', '--constant', type=str, metavar='TAG:VALUE', default='',
         help='Include a constant tag:value in every record (ex. -k type:AS)')
+    parser.add_argument(
+        '-w', '--workers', type=int, metavar='N', default=0,
+        help='convert input ranges in N parallel processes'
+             ' (default=0, convert in this process)')
+    parser.add_argument(
+        '--unordered', action='store_true',
+        help='with -w, write records as soon as each input range is'
+             ' converted, not in input order')
 
-    '''
-    # TODO: implement this to export large quantities of records to CouchDB
     parser.add_argument(
         '-r', '--repeat', type=int, default=1,
-        help='repeat operation, saving multiple JSON files'
+        help='repeat operation, saving multiple JSON files of QTY records'
+             ' named after OUTPUT.json, reading the input only once'
              ' (default=1, use -r 0 to repeat until end of input)')
-    '''
     # parse the command line
     args = parser.parse_args()
     if args.file_name.lower().endswith('.mst'):
@@ -234,10 +459,34 @@ if __name__ == '__main__':
             print('UNSUPORTED: -n/--mfn option only available for .mst input.')
             raise SystemExit
         iterRecords = iterIsoRecords
+    if args.workers and os.name == 'java':
+        print('UNSUPORTED: -w/--workers option not available with Jython.')
+        raise SystemExit
+    if args.repeat != 1:
+        if args.out is None or args.workers:
+            print('UNSUPORTED: -r/--repeat option requires -o/--out'
+                  ' and is not available with -w/--workers.')
+            raise SystemExit
+        for chunk_name in writeJsonChunks(iterRecords, args.file_name,
+                args.out, args.qty, args.skip, args.repeat, args.id,
+                args.uuid, args.mongo, args.mfn, args.type, args.prefix,
+                args.constant, args.couch):
+            print(chunk_name)
+            sys.stdout.flush() # for bulkup.sh to upload it meanwhile
+        raise SystemExit
+    if args.out is None:
+        args.out = sys.stdout
+    else:
+        args.out = open(args.out, 'w')
     if args.couch:
         args.out.write('{ "docs" : ')
-    writeJsonArray(iterRecords, args.file_name, args.out, args.qty, args.skip,
-        args.id, args.uuid, args.mongo, args.mfn, args.type, args.prefix, args.constant)
+    if args.workers:
+        writeJsonArrayParallel(iterRecords, args.file_name, args.out, args.qty,
+            args.skip, args.id, args.uuid, args.mongo, args.mfn, args.type,
+            args.prefix, args.constant, args.workers, not args.unordered)
+    else:
+        writeJsonArray(iterRecords, args.file_name, args.out, args.qty, args.skip,
+            args.id, args.uuid, args.mongo, args.mfn, args.type, args.prefix, args.constant)
     if args.couch:
         args.out.write('}\n')
     args.out.close()
@@ -18,7 +18,12 @@
 # You should have received a copy of the GNU Lesser General Public License
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 
+import os
 from struct import unpack
+try:
+    import mmap
+except ImportError: # Jython has no mmap module
+    mmap = None
 
 CR =  '\x0D' # \r
 LF =  '\x0A' # \n
@@ -30,6 +35,7 @@ LABEL_FORMAT = '5s c 4s c c 5s 3s c c c c'
 TAG_LEN = 3
 DEFAULT_ENCODING = 'ASCII'
 SUBFIELD_DELIMITER = '^'
+BLOCK_SIZE = 2**20 # bytes read at a time by MappedIsoFile
 
 class IsoFile(object):
 
@@ -68,6 +74,135 @@ class IsoFile(object):
     def close(self):
         self.file.close()
 
+class MappedIsoFile(IsoFile):
+    ''' faster reader which maps the file into memory (or reads it in large
+        blocks when mmap is not available), drops all CR and LF characters
+        once per block and slices the records out of the buffer at the IS3
+        separators; read slices the same buffer, so records may also be
+        loaded byte by byte with IsoRecord(iso_file) '''
+
+    def __init__(self, filename, encoding = DEFAULT_ENCODING,
+                 block_size = BLOCK_SIZE, start = 0, end = None):
+        ''' read the records within the `start` and `end` byte offsets,
+            which must be record boundaries (see split_file) '''
+        super(MappedIsoFile, self).__init__(filename, encoding)
+        self.block_size = block_size
+        self.start = start
+        self.end = end
+        self.map = None
+        if mmap is not None:
+            try:
+                self.map = mmap.mmap(self.file.fileno(), 0,
+                                     access=mmap.ACCESS_READ)
+            except (ValueError, EnvironmentError): # empty file, pipe etc.
+                pass
+        self.blocks = self.iter_blocks()
+        self.buffer = '' # blocks without line breaks
+        self.offset = 0 # of the next byte to read in the buffer
+
+    def next(self):
+        return IsoRecord(raw=self.read_raw_record())
+
+    __next__ = next # Python 3 compatibility
+
+    def read(self, size):
+        ''' slice the next `size` bytes out of the buffer '''
+        while len(self.buffer) - self.offset < size and self.fill():
+            pass
+        chunk = self.buffer[self.offset:self.offset+size]
+        self.offset += len(chunk)
+        return chunk
+
+    def read_raw_record(self):
+        ''' the next record without line breaks and IS3 separator '''
+        found = self.buffer.find(IS3, self.offset)
+        while found < 0:
+            searched = len(self.buffer) - self.offset
+            if not self.fill():
+                if self.offset < len(self.buffer):
+                    raise ValueError('Incomplete record at end of file: "%s"'
+                        % self.buffer[self.offset:self.offset+LABEL_LEN])
+                raise StopIteration
+            found = self.buffer.find(IS3, searched)
+        raw = self.buffer[self.offset:found]
+        self.offset = found + 1
+        return raw
+
+    def fill(self):
+        ''' append the next block to the bytes not read yet; return False
+            when there are no more blocks '''
+        block = next(self.blocks, None)
+        if block is None:
+            return False
+        if CR in block or LF in block:
+            block = block.translate(None, CR+LF)
+        self.buffer = self.buffer[self.offset:] + block
+        self.offset = 0
+        return True
+
+    def iter_blocks(self):
+        if self.map is not None:
+            end = len(self.map) if self.end is None else self.end
+            for start in xrange(self.start, end, self.block_size):
+                yield self.map[start:min(start+self.block_size, end)]
+        else:
+            self.file.seek(self.start)
+            remaining = self.end - self.start if self.end is not None else -1
+            while remaining:
+                size = self.block_size
+                if remaining > 0:
+                    size = min(size, remaining)
+                block = self.file.read(size)
+                if not block:
+                    break
+                remaining -= len(block)
+                yield block
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+        super(MappedIsoFile, self).close()
+
+def split_file(filename, parts, block_size = BLOCK_SIZE):
+    ''' split a file into up to `parts` byte ranges of similar size,
+        starting at record boundaries; return a list of
+        (start, end, record_count) tuples '''
+    iso = open(filename, 'rb')
+    size = os.fstat(iso.fileno()).st_size
+    boundaries = [0]
+    for part in xrange(1, parts):
+        target = max(size * part // parts, boundaries[-1] + 1)
+        if target >= size:
+            break
+        iso.seek(target - 1)
+        offset = target - 1
+        while True: # look for the separator ending the current record
+            block = iso.read(block_size)
+            if not block:
+                offset = size
+                break
+            found = block.find(IS3)
+            if found >= 0:
+                offset += found + 1
+                break
+            offset += len(block)
+        if offset >= size:
+            break
+        boundaries.append(offset)
+    boundaries.append(size)
+    ranges = []
+    iso.seek(0)
+    for start, end in zip(boundaries, boundaries[1:]):
+        count = 0
+        remaining = end - start
+        while remaining > 0:
+            block = iso.read(min(block_size, remaining))
+            remaining -= len(block)
+            count += block.count(IS3)
+        ranges.append((start, end, count))
+    iso.close()
+    return ranges
+
 class IsoRecord(object):
     label_part_names = ('rec_len rec_status impl_codes indicator_len identifier_len'
                         ' base_addr user_defined'
@@ -75,11 +210,14 @@ class IsoRecord(object):
                         ' fld_len_len start_len impl_len reserved').split()
     rec_len = 0
 
-    def __init__(self, iso_file=None):
+    def __init__(self, iso_file=None, raw=None):
         self.iso_file = iso_file
-        self.load_label()
-        self.load_directory()
-        self.load_fields()
+        if raw is not None:
+            self.parse(raw)
+        else:
+            self.load_label()
+            self.load_directory()
+            self.load_fields()
 
     def __len__(self):
         return self.rec_len
@@ -88,7 +226,10 @@ class IsoRecord(object):
         label = self.iso_file.read(LABEL_LEN)
         if len(label) == 0:
             raise StopIteration
-        elif len(label) != 24:
+        self.set_label(label)
+
+    def set_label(self, label):
+        if len(label) != LABEL_LEN:
             raise ValueError('Invalid record label: "%s"' % label)
         parts = unpack(LABEL_FORMAT, label)
         for name, part in zip(self.label_part_names, parts):
@@ -129,6 +270,29 @@ class IsoRecord(object):
             field.value = value[:-1] # remove trailing field separator
         self.iso_file.read(1) # discard record separator
 
+    def parse(self, raw):
+        ''' slice label, directory and fields out of a record buffer
+            without line breaks or the trailing record separator '''
+        self.set_label(raw[:LABEL_LEN])
+        fmt_dir = '3s %ss %ss %ss' % (self.fld_len_len, self.start_len, self.impl_len)
+        entry_len = TAG_LEN + self.fld_len_len + self.start_len + self.impl_len
+        self.directory = []
+        pos = LABEL_LEN
+        while raw[pos:pos+1].isdigit():
+            self.directory.append(Field(* unpack(fmt_dir, raw[pos:pos+entry_len])))
+            pos += entry_len
+        pos += 1 # skip directory terminator
+        for field in self.directory:
+            # see load_fields about the identifier_len
+            if self.indicator_len > 0:
+                field.indicator = raw[pos:pos+self.indicator_len]
+                pos += self.indicator_len
+            end = pos + field.len
+            if end > len(raw):
+                raise ValueError('Field %s exceeds the record length' % field.tag)
+            field.value = raw[pos:end-1] # remove trailing field separator
+            pos = end
+
     def __iter__(self):
         return self
 
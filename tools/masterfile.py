@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+# CDS/ISIS master file reader (.mst records located through the .xrf file)
+#
+# Copyright (C) 2010 BIREME/PAHO/WHO
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 2.1 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import threading
+from struct import unpack, calcsize
+
+from isis.utils.cache import LRUCache
+
+BLOCK_LEN = 512 # both .mst and .xrf files are written in 512 byte blocks
+XRF_ENTRIES = 127 # pointers per .xrf block, after the block number
+XRF_BLOCK_SHIFT = 11 # pointer = block << 11 | flags | offset
+XRF_OFFSET_MASK = 0x1FF
+XRF_PHYSICALLY_DELETED = -1 << XRF_BLOCK_SHIFT
+# control record: ctlmfn nxtmfn nxtmfb nxtmfp mftype reccnt mfcxx1 mfcxx2 mfcxx3
+CONTROL_FORMAT = '<iiihhiiii'
+# record leader: mfn mfrl mfbwb mfbwp base nvf status
+LEADER_FORMAT = '<ihihhhh'
+LEADER_LEN = calcsize(LEADER_FORMAT)
+# directory entry: tag pos len
+DIR_ENTRY_FORMAT = '<HHH'
+DIR_ENTRY_LEN = calcsize(DIR_ENTRY_FORMAT)
+ACTIVE = 0
+LOGICALLY_DELETED = 1
+DEFAULT_CACHE_SIZE = 1000 # decoded records kept by MasterFile.get
+
+def sibling_file_name(file_name, extension):
+    ''' replace the extension of file_name, preserving its case '''
+    base, ext = os.path.splitext(file_name)
+    if ext.isupper():
+        extension = extension.upper()
+    return base + extension
+
+def split_pointer(pointer):
+    ''' return (block, offset, deleted) from a .xrf pointer '''
+    deleted = pointer < 0
+    pointer = abs(pointer)
+    return pointer >> XRF_BLOCK_SHIFT, pointer & XRF_OFFSET_MASK, deleted
+
+def mst_position(pointer):
+    ''' absolute .mst file offset of the record a .xrf pointer refers to '''
+    block, offset, deleted = split_pointer(pointer)
+    return (block - 1) * BLOCK_LEN + offset
+
+class MasterFile(object):
+    ''' reader of a master file; instances may be shared by threads, as
+        each seek and read of a record or .xrf block is done holding
+        self.lock: get, get_many, read and records may run concurrently '''
+
+    def __init__(self, file_name, cache_size=DEFAULT_CACHE_SIZE):
+        self.file_name = sibling_file_name(file_name, '.mst')
+        self.mst = open(self.file_name, 'rb')
+        self.xrf = open(sibling_file_name(file_name, '.xrf'), 'rb')
+        self.cache = LRUCache(max_items=cache_size, ttl=None)
+        self.lock = threading.Lock() # the file positions are shared
+        self.load_control()
+
+    def load_control(self):
+        control = self.mst.read(calcsize(CONTROL_FORMAT))
+        (self.ctl_mfn, self.next_mfn, self.next_block, self.next_offset,
+         self.mf_type, self.rec_count) = unpack(CONTROL_FORMAT, control)[:6]
+
+    def __len__(self):
+        ''' highest MFN ever assigned, including deleted records '''
+        return self.next_mfn - 1
+
+    def __iter__(self):
+        return self.records()
+
+    def records(self, first=1, last=None):
+        ''' generate existing records with MFNs from `first` to `last`,
+            in MFN order '''
+        for mfn, pointer in self.pointers(first, last):
+            record = self.load_record(mfn, pointer)
+            if record is not None:
+                yield record
+
+    def pointers(self, first=1, last=None):
+        ''' generate (mfn, pointer) pairs, reading the .xrf sequentially
+            one block at a time '''
+        if last is None or last > len(self):
+            last = len(self)
+        mfn = first
+        while mfn <= last:
+            block_index, entry = divmod(mfn - 1, XRF_ENTRIES)
+            pointers = self.load_xrf_block(block_index)
+            for pointer in pointers[entry:]:
+                if mfn > last:
+                    return
+                yield mfn, pointer
+                mfn += 1
+
+    def load_xrf_block(self, block_index):
+        with self.lock:
+            self.xrf.seek(block_index * BLOCK_LEN)
+            block = self.xrf.read(BLOCK_LEN)
+        if len(block) != BLOCK_LEN:
+            raise ValueError('Truncated .xrf block #%s' % (block_index + 1))
+        return unpack('<%si' % XRF_ENTRIES, block[4:])
+
+    def locate(self, mfn):
+        ''' return the .xrf pointer for `mfn`, with one seek '''
+        if not 0 < mfn <= len(self):
+            raise KeyError(mfn)
+        block_index, entry = divmod(mfn - 1, XRF_ENTRIES)
+        with self.lock:
+            self.xrf.seek(block_index * BLOCK_LEN + 4 + entry * 4)
+            return unpack('<i', self.xrf.read(4))[0]
+
+    def read(self, mfn):
+        ''' random access to a record by MFN, active or logically deleted '''
+        record = self.load_record(mfn, self.locate(mfn))
+        if record is None:
+            raise KeyError(mfn)
+        return record
+
+    def get(self, mfn, default=None):
+        ''' cached random access to a record by MFN '''
+        cached = self.cache.get(mfn)
+        if cached is not None:
+            return cached[0]
+        try:
+            record = self.read(mfn)
+        except KeyError:
+            return default
+        self.cache.set(mfn, record)
+        return record
+
+    def get_many(self, mfns, default=None):
+        ''' return the records for `mfns`, in the same order; records not
+            cached are read in .mst file order to minimize seeks '''
+        mfns = list(mfns)
+        found = {}
+        pointers = {}
+        for mfn in sorted(set(mfns)):
+            cached = self.cache.get(mfn)
+            if cached is not None:
+                found[mfn] = cached[0]
+            elif 0 < mfn <= len(self):
+                pointers[mfn] = None
+        xrf_blocks = {}
+        for mfn in pointers: # read each .xrf block only once
+            block_index, entry = divmod(mfn - 1, XRF_ENTRIES)
+            if block_index not in xrf_blocks:
+                xrf_blocks[block_index] = self.load_xrf_block(block_index)
+            pointers[mfn] = xrf_blocks[block_index][entry]
+        by_position = sorted(pointers, key=lambda mfn: mst_position(pointers[mfn]))
+        for mfn in by_position:
+            record = self.load_record(mfn, pointers[mfn])
+            if record is not None:
+                self.cache.set(mfn, record)
+                found[mfn] = record
+        return [found.get(mfn, default) for mfn in mfns]
+
+    def load_record(self, mfn, pointer):
+        if pointer == 0 or pointer == XRF_PHYSICALLY_DELETED:
+            return None # never created or physically deleted
+        with self.lock:
+            self.mst.seek(mst_position(pointer))
+            record = MasterRecord(self.mst.read(LEADER_LEN), self.mst)
+        if record.mfn != mfn:
+            raise ValueError('Invalid .xrf pointer for mfn=%s: found mfn=%s'
+                             % (mfn, record.mfn))
+        if pointer < 0: # logically deleted
+            record.status = LOGICALLY_DELETED
+        return record
+
+    def close(self):
+        self.cache.clear()
+        self.mst.close()
+        self.xrf.close()
+
+class MasterRecord(object):
+    leader_part_names = 'mfn mfrl mfbwb mfbwp base nvf status'.split()
+
+    def __init__(self, leader, mst_file):
+        if len(leader) != LEADER_LEN:
+            raise ValueError('Truncated record leader')
+        for name, part in zip(self.leader_part_names,
+                              unpack(LEADER_FORMAT, leader)):
+            setattr(self, name, part)
+        self.mfrl = abs(self.mfrl) # negative mfrl flags a locked record
+        if self.base != LEADER_LEN + self.nvf * DIR_ENTRY_LEN:
+            raise ValueError('Unsupported master file format (mfn=%s)'
+                             % self.mfn)
+        self.load_fields(mst_file.read(self.mfrl - LEADER_LEN))
+
+    def load_fields(self, body):
+        data_start = self.base - LEADER_LEN
+        self.fields = []
+        for i in xrange(0, self.nvf * DIR_ENTRY_LEN, DIR_ENTRY_LEN):
+            tag, pos, length = unpack(DIR_ENTRY_FORMAT,
+                                      body[i:i+DIR_ENTRY_LEN])
+            start = data_start + pos
+            self.fields.append((tag, body[start:start+length]))
+
+    @property
+    def active(self):
+        return self.status == ACTIVE
+
+    def show_leader(self):
+        for name in self.leader_part_names:
+            print('%15s : %r' % (name, getattr(self, name)))
+
+    def dump(self):
+        for tag, value in self.fields:
+            print('%03d %r' % (tag, value))
+
+def test():
+    import doctest
+    doctest.testfile('masterfile_test.txt')
+
+if __name__=='__main__':
+    test()
@@ -1,7 +1,9 @@
 #!/bin/bash
 
-PYTHONPATH=../isisdm/:$PYTHONPATH
+export PYTHONPATH=..:../isis/model:$PYTHONPATH
 
 python isis2json.py -t $1 ../fixtures/lilacs1/LILACS.iso
 
+python isis2json.py -t $1 ../fixtures/lilacs1/LILACS.mst
+
 #jython isis2json.py -t $1 ../fixtures/lilacs1/LILACS.mst